@@ -0,0 +1 @@
+"""Benchmarks for kbr_char."""
@@ -0,0 +1,93 @@
+"""Seeded generator of magic.json shaped catalogs and spellbooks."""
+from __future__ import annotations  # For using | with type hints
+
+import json
+import random
+from typing import Any
+
+from kbr_char.magic import (
+    CATEGORIES,
+    Element,
+    Modifier,
+    Range,
+    Shape,
+    Spell,
+    SpellBook,
+    SpellComponentCollection,
+)
+
+SCALES = {"1k": 1_000, "100k": 100_000, "1M": 1_000_000}
+SEED = 20220130
+
+# Share of each category in magic.json, and formulas in the same style.
+SHARES = {"Elements": 0.4, "Range": 0.1, "Shape": 0.4, "Modifiers": 0.1}
+UNITS = [None, "ft", "%", "mi"]
+
+
+def _formula(rng: random.Random) -> str:
+    return rng.choice(
+        [
+            str(rng.randint(0, 15)),
+            "x",
+            "x/5",
+            f"(x/5)*{rng.randint(2, 10)}",
+        ]
+    )
+
+
+def generate_catalog(count: int, seed: int = SEED) -> dict[str, list[dict[str, Any]]]:
+    rng = random.Random(seed)
+    catalog: dict[str, list[dict[str, Any]]] = {}
+    for category, share in SHARES.items():
+        records = catalog[category] = []
+        for number in range(max(1, int(count * share))):
+            formula = _formula(rng)
+            records.append(
+                {
+                    "name": f"{category[:-1] if category.endswith('s') else category}"
+                    f"{number:07d}",
+                    "x": rng.randint(0, 20),
+                    "desc": f"a generated {category.lower()} component",
+                    "formula": formula,
+                    "units": rng.choice(UNITS) if "x" in formula else None,
+                }
+            )
+    return catalog
+
+
+def write_catalog(count: int, filepath: str, seed: int = SEED) -> None:
+    with open(filepath, "w") as file_object:
+        json.dump(generate_catalog(count, seed), file_object)
+
+
+def generate_spells(
+    collection: SpellComponentCollection, count: int, seed: int = SEED
+) -> list[Spell]:
+    """Spells of one Element, Range and Shape and sometimes a Modifier."""
+    rng = random.Random(seed)
+    names = {
+        component_type: [x.name for x in collection.get_by_type(component_type)]
+        for component_type in CATEGORIES.values()
+    }
+    spells = []
+    for number in range(count):
+        spell = Spell(f"Spell{number:07d}")
+        for component_type in [Element, Range, Shape]:
+            component = collection.get(
+                component_type, rng.choice(names[component_type])
+            )
+            component.customize(rng.randint(0, 100))
+            spell.add_component(component)
+        if rng.random() < 0.3:
+            spell.add_component(collection.get(Modifier, rng.choice(names[Modifier])))
+        spells.append(spell)
+    return spells
+
+
+def generate_spellbook(
+    collection: SpellComponentCollection, count: int, seed: int = SEED
+) -> SpellBook:
+    spellbook = SpellBook("Generated", components=collection)
+    for spell in generate_spells(collection, count, seed):
+        spellbook.add_spell(spell)
+    return spellbook
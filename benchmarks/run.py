@@ -0,0 +1,180 @@
+"""Time and peak memory of kbr_char hot paths at a given scale.
+
+    python -m benchmarks.run --scale 100k --output results.json
+    python -m benchmarks.run --scale 100k --compare results.json
+"""
+from __future__ import annotations  # For using | with type hints
+
+import argparse
+import gc
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Optional
+
+from benchmarks.generate import SCALES, SEED, generate_catalog, generate_spells
+from kbr_char.magic import (
+    CATEGORIES,
+    Calc,
+    SpellBook,
+    SpellComponentCollection,
+    formula_cache,
+)
+
+OPERATIONS = 10_000  # Calls timed per benchmark, capped at the scale
+
+
+def measure(setup: Callable[[], Any], run: Callable[[Any], Any]) -> dict[str, float]:
+    """Time run(setup()), then run it again under tracemalloc for peak memory."""
+    state = setup()
+    gc.collect()
+    start = time.perf_counter()
+    run(state)
+    seconds = time.perf_counter() - start
+
+    state = setup()
+    gc.collect()
+    tracemalloc.start()
+    run(state)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"seconds": seconds, "peak_bytes": peak}
+
+
+def run_benchmarks(scale: str, seed: int = SEED) -> dict[str, Any]:
+    count = SCALES[scale]
+    operations = min(OPERATIONS, count)
+    rng = random.Random(seed)
+    catalog = generate_catalog(count, seed)
+    formulas = [rng.choice(catalog["Range"])["formula"] for _ in range(operations)]
+    xs = [rng.randint(0, 100) for _ in range(operations)]
+    keys = [
+        (CATEGORIES[category], rng.choice(catalog[category])["name"])
+        for category in rng.choices(list(catalog), k=operations)
+    ]
+    results: dict[str, dict[str, float]] = {}
+
+    def record(name: str, calls: int, setup: Callable, run: Callable) -> None:
+        result = measure(setup, run)
+        result["calls"] = calls
+        result["us_per_call"] = result["seconds"] / calls * 1e6
+        results[name] = result
+        print(
+            f"{scale:>5} {name:<28} {result['us_per_call']:>10.2f} us/call"
+            f" {result['peak_bytes'] / 1024:>12.1f} KiB peak"
+        )
+
+    def evaluate(_: Any) -> None:
+        for formula, x in zip(formulas, xs):
+            Calc.evaluate(formula, x)
+
+    def interpret(_: Any) -> None:
+        for formula, x in zip(formulas, xs):
+            Calc.interpret(formula, x)
+
+    record("Calc.evaluate", operations, formula_cache.clear, evaluate)
+    record("Calc.interpret", operations, lambda: None, interpret)
+    record(
+        "SpellComponentCollection.load",
+        count,
+        lambda: None,
+        lambda _: SpellComponentCollection(catalog).get_by_type(CATEGORIES["Range"]),
+    )
+
+    collection = SpellComponentCollection(catalog)
+    collection.get(*keys[0])  # Build the indexes outside the timing
+
+    def get(_: Any) -> None:
+        for key in keys:
+            collection.get(*key)
+
+    record("SpellComponentCollection.get", operations, lambda: None, get)
+
+    spells = generate_spells(collection, count, seed)
+    names = [rng.choice(spells).name for _ in range(operations)]
+
+    def add_spells(spellbook: SpellBook) -> None:
+        for spell in spells:
+            spellbook.add_spell(spell)
+
+    def filled_spellbook() -> SpellBook:
+        spellbook = SpellBook("Benchmark", components=collection)
+        add_spells(spellbook)
+        return spellbook
+
+    record("SpellBook.add_spell", count, lambda: SpellBook("Benchmark"), add_spells)
+
+    def get_spells(spellbook: SpellBook) -> None:
+        for name in names:
+            spellbook.get_spell(name)
+
+    record("SpellBook.get_spell", operations, filled_spellbook, get_spells)
+
+    def spell_dcs(_: Any) -> None:
+        for spell in spells:
+            spell.dc
+
+    # Warmed in setup, so both passes time cached reads, _recompute_dc is timed below
+    record("Spell.dc", count, lambda: spell_dcs(None), spell_dcs)
+
+    def recompute_dcs(_: Any) -> None:
+        for spell in spells:
+            spell._recompute_dc()
+
+    record("Spell._recompute_dc", count, lambda: None, recompute_dcs)
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        pass  # NumPy is optional
+    else:
+        from kbr_char.dc_matrix import DCMatrix
+
+        spellbook = filled_spellbook()
+        record(
+            "DCMatrix.refresh",
+            count,
+            lambda: DCMatrix.from_book(spellbook),
+            lambda matrix: (matrix.refresh(), matrix.dcs()),
+        )
+    return {
+        "scale": scale,
+        "count": count,
+        "seed": seed,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+def compare(current: dict[str, Any], previous: dict[str, Any]) -> None:
+    print(f"\nCompared to the run saved at scale {previous['scale']}:")
+    for name, result in current["results"].items():
+        before = previous["results"].get(name)
+        if before:
+            ratio = result["us_per_call"] / before["us_per_call"]
+            print(f"{name:<34} {ratio:>6.2f}x time")
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", choices=list(SCALES), default="1k")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--output", help="Save results as JSON")
+    parser.add_argument("--compare", help="Results JSON of an earlier run")
+    arguments = parser.parse_args(argv)
+
+    results = run_benchmarks(arguments.scale, arguments.seed)
+    if arguments.output:
+        with open(arguments.output, "w") as file_object:
+            json.dump(results, file_object, indent=2)
+    if arguments.compare:
+        with open(arguments.compare) as file_object:
+            compare(results, json.load(file_object))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""Scoring large batches of spells across worker processes."""
+from __future__ import annotations  # For using | with type hints
+
+import json
+import multiprocessing
+from collections import deque
+from typing import Iterable, Iterator, Optional
+
+from kbr_char.magic import SpellComponentCollection, spell_from_dict
+
+CHUNK_SIZE = 1000
+
+_collection: Optional[SpellComponentCollection] = None  # Per worker process
+
+
+def score_line(line: str, collection: SpellComponentCollection) -> str:
+    """Score one JSON spell definition, as written by spell_to_dict.
+
+    Catalog components may leave out type and x, e.g.
+    {"name": "Fireball", "components": [{"name": "Combustion"},
+    {"type": "Range", "name": "SpellRange", "x": 100}]}
+    """
+    name = None
+    try:
+        data = json.loads(line)
+        name = data.get("name")
+        spell = spell_from_dict(data, collection)
+        return json.dumps({"name": spell.name, "dc": spell.dc})
+    except (
+        ArithmeticError,  # Such as 10/x at x=0
+        AttributeError,
+        IndexError,
+        KeyError,
+        RecursionError,
+        TypeError,
+        ValueError,
+    ) as error:
+        return json.dumps({"name": name, "error": f"{type(error).__name__}: {error}"})
+
+
+def _load_catalog(catalog_path: str) -> None:
+    global _collection
+    _collection = SpellComponentCollection.from_file(catalog_path)
+
+
+def _score_chunk(lines: list[str]) -> list[str]:
+    return [score_line(line, _collection) for line in lines]
+
+
+def _chunks(lines: Iterable[str], chunk_size: int) -> Iterator[list[str]]:
+    chunk: list[str] = []
+    for line in lines:
+        if not line.strip():
+            continue
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def score_spells(
+    lines: Iterable[str],
+    catalog_path: str,
+    workers: Optional[int] = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[str]:
+    """Score JSON Lines spell definitions, yielding JSON Lines results in order.
+
+    Chunks of lines are handed to a pool of workers that each load the catalog once.
+    At most two chunks per worker are read ahead, so memory stays constant however
+    long the input is. With one worker everything runs in this process.
+    """
+    workers = workers or multiprocessing.cpu_count()
+    if workers == 1:
+        collection = SpellComponentCollection.from_file(catalog_path)
+        for line in lines:
+            if line.strip():
+                yield score_line(line, collection)
+        return
+    with multiprocessing.Pool(
+        workers, initializer=_load_catalog, initargs=(catalog_path,)
+    ) as pool:
+        pending: deque = deque()
+        for chunk in _chunks(lines, chunk_size):
+            pending.append(pool.apply_async(_score_chunk, (chunk,)))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
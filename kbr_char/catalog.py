@@ -0,0 +1,555 @@
+"""Catalog file readers."""
+from __future__ import annotations  # For using | with type hints
+
+import ast
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+from dataclasses import dataclass, field
+from typing import Any, BinaryIO, Callable, Iterator, Optional
+
+CHUNK_SIZE = 1 << 16
+DEFAULT_CATALOG = os.path.join(os.path.dirname(__file__), "magic.json")
+
+_STRING = rb'"(?:[^"\\]|\\.)*"'
+_SPACE = re.compile(rb"\s*")
+_KEY = re.compile(rb"(" + _STRING + rb")\s*:", re.S)
+_RECORD = re.compile(rb"\{(?:[^{}\"]|" + _STRING + rb")*\}", re.S)
+# Windows that _KEY and _RECORD could still match once more of the file is read
+_OPEN_STRING = rb'"(?:[^"\\]|\\.)*\\?'
+_KEY_START = re.compile(rb"(?:" + _STRING + rb"\s*|" + _OPEN_STRING + rb")\Z", re.S)
+_RECORD_START = re.compile(
+    rb"\{(?:[^{}\"]|" + _STRING + rb")*(?:" + _OPEN_STRING + rb")?\Z", re.S
+)
+
+
+class _ChunkReader:
+    """Sliding window over a binary file, refilled a chunk at a time."""
+
+    def __init__(self, file_object: BinaryIO, chunk_size: int) -> None:
+        self.file_object = file_object
+        self.chunk_size = chunk_size
+        self.data = b""
+        self.offset = 0  # File offset of data[0]
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.file_object.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.data = self.data[self.pos :] + chunk
+        self.offset += self.pos
+        self.pos = 0
+        return True
+
+    def match(
+        self, pattern: re.Pattern, start: Optional[re.Pattern] = None
+    ) -> Optional[re.Match]:
+        # A match touching the end of the window may still grow, so read on until
+        # it ends inside the window or the file runs out. Without a match, only read
+        # on while the window could be the start of one, as start matches.
+        while True:
+            found = pattern.match(self.data, self.pos)
+            if found and found.end() < len(self.data):
+                return found
+            if not found and start and not start.match(self.data, self.pos):
+                return None
+            if not self.fill():
+                return found
+
+    def peek(self) -> bytes:
+        self.pos = self.match(_SPACE).end()
+        return self.data[self.pos : self.pos + 1]
+
+    def expect(self, char: bytes) -> None:
+        if self.peek() != char:
+            raise ValueError(
+                f"Expected {char.decode()} at byte {self.offset + self.pos}"
+            )
+        self.pos += 1
+
+
+def iter_records(
+    file_object: BinaryIO, chunk_size: int = CHUNK_SIZE
+) -> Iterator[tuple[str, int, int, bytes]]:
+    """Stream (category, start, end, raw record) from a catalog, one record at a time.
+
+    A catalog is an object of category name to list of flat component records, like
+    magic.json. At most one record plus one chunk is held in memory.
+    """
+    reader = _ChunkReader(file_object, chunk_size)
+    reader.expect(b"{")
+    while True:
+        char = reader.peek()
+        if char == b"}":
+            return
+        if char == b",":
+            reader.pos += 1
+            continue
+        key = reader.match(_KEY, _KEY_START)
+        if key is None:
+            raise ValueError(
+                f"Expected a category at byte {reader.offset + reader.pos}"
+            )
+        category = json.loads(key.group(1))
+        reader.pos = key.end()
+        reader.expect(b"[")
+        while True:
+            char = reader.peek()
+            if char == b"]":
+                reader.pos += 1
+                break
+            if char == b",":
+                reader.pos += 1
+                continue
+            record = reader.match(_RECORD, _RECORD_START)
+            if record is None:
+                raise ValueError(
+                    f"Expected a record at byte {reader.offset + reader.pos}"
+                )
+            reader.pos = record.end()
+            yield (
+                category,
+                reader.offset + record.start(),
+                reader.offset + record.end(),
+                record.group(),
+            )
+
+
+class CatalogSource:
+    """A catalog SpellComponentCollection can build components from on demand."""
+
+    def find(self, category: str, name: str) -> Optional[dict[str, Any]]:
+        """The first record in category with this name, ignoring case."""
+        raise NotImplementedError
+
+    def records(self, category: str) -> Iterator[dict[str, Any]]:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Release the file behind the catalog, if one is held open."""
+
+
+@dataclass
+class StreamingCatalog(CatalogSource):
+    """Catalog file read on demand. Only byte spans of records seen so far are kept.
+
+    The file is scanned as far as a lookup needs, and records are parsed again from
+    their span when asked for.
+    """
+
+    filepath: str
+    chunk_size: int = CHUNK_SIZE
+    _spans: dict[tuple[str, str], tuple[int, int]] = field(
+        default_factory=dict, init=False, repr=False
+    )
+    _categories: dict[str, list[tuple[int, int]]] = field(
+        default_factory=dict, init=False, repr=False
+    )
+    _stream: Optional[Iterator[tuple[str, int, int, bytes]]] = field(
+        default=None, init=False, repr=False
+    )
+    _scanned: bool = field(default=False, init=False, repr=False)
+
+    def _records(self) -> Iterator[tuple[str, int, int, bytes]]:
+        with open(self.filepath, "rb") as file_object:
+            yield from iter_records(file_object, self.chunk_size)
+
+    def _scan(self, until: Optional[tuple[str, str]] = None) -> None:
+        if self._scanned:
+            return
+        if self._stream is None:
+            self._categories.clear()  # Filled again from the start of the file
+            self._stream = self._records()
+        for category, start, end, raw in self._stream:
+            key = (category, json.loads(raw)["name"].casefold())
+            self._spans.setdefault(key, (start, end))
+            self._categories.setdefault(category, []).append((start, end))
+            if key == until:
+                return
+        self._stream = None
+        self._scanned = True
+
+    def _read(self, spans: list[tuple[int, int]]) -> Iterator[dict[str, Any]]:
+        with open(self.filepath, "rb") as file_object:
+            for start, end in spans:
+                file_object.seek(start)
+                yield json.loads(file_object.read(end - start))
+
+    def find(self, category: str, name: str) -> Optional[dict[str, Any]]:
+        key = (category, name.casefold())
+        if key not in self._spans:
+            self._scan(until=key)
+        if key not in self._spans:
+            return None
+        return next(self._read([self._spans[key]]))
+
+    def records(self, category: str) -> Iterator[dict[str, Any]]:
+        self._scan()
+        return self._read(self._categories.get(category, []))
+
+    def close(self) -> None:
+        if self._stream is not None:
+            self._stream.close()  # Closes the file a partial scan left open
+            self._stream = None
+
+
+BINARY_MAGIC = b"KBRC"
+BINARY_VERSION = 1
+NO_STRING = 0xFFFFFFFF
+
+# magic, version, category/record/formula/string counts, then section offsets for
+# categories, records, sorted keys, formulas, string offsets, strings and programs.
+_HEADER = struct.Struct("<4sHxxIIII7Q")
+_CATEGORY_ROW = struct.Struct("<III")  # name, first record, record count
+_RECORD_ROW = struct.Struct("<IIIIIq")  # name, casefolded name, desc, units, formula, x
+_FORMULA_ROW = struct.Struct("<III")  # text, program offset, program length
+_INDEX = struct.Struct("<I")
+
+# Formula programs are postfix: constants and x are pushed, operators pop two.
+_PUSH_INT = 0
+_PUSH_FLOAT = 1
+_PUSH_X = 2
+_OPCODES = [ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow]
+_INT = struct.Struct("<q")
+_FLOAT = struct.Struct("<d")
+
+
+def encode_formula(formula: str) -> bytes:
+    program = bytearray()
+
+    def emit(node: ast.AST) -> None:
+        if isinstance(node, ast.BinOp) and type(node.op) in _OPCODES:
+            emit(node.left)
+            emit(node.right)
+            program.append(_PUSH_X + 1 + _OPCODES.index(type(node.op)))
+        elif isinstance(node, ast.Constant) and type(node.value) is int:
+            if not -(1 << 63) <= node.value < 1 << 63:
+                raise ValueError(f"Constant in formula {formula!r} is too large")
+            program.append(_PUSH_INT)
+            program.extend(_INT.pack(node.value))
+        elif isinstance(node, ast.Constant) and type(node.value) is float:
+            program.append(_PUSH_FLOAT)
+            program.extend(_FLOAT.pack(node.value))
+        elif isinstance(node, ast.Name) and node.id == "x":
+            program.append(_PUSH_X)
+        else:
+            raise ValueError(f"Can't encode formula {formula!r}")
+
+    tree = ast.parse(formula)
+    if len(tree.body) != 1 or not isinstance(tree.body[0], ast.Expr):
+        raise ValueError(f"Can't encode formula {formula!r}")
+    emit(tree.body[0].value)
+    return bytes(program)
+
+
+def decode_formula(program: bytes) -> Callable[[Any], Any]:
+    """Build the same closures as FormulaCompiler from an encoded program, under
+    the same budget."""
+    from kbr_char.magic import Calc, FormulaBudgetError, FormulaCompiler, formula_cache
+
+    budget = formula_cache.budget
+    compiler = FormulaCompiler(budget)
+    stack: list[tuple[Callable[[Any], Any], int]] = []  # Closure, depth
+    nodes = 0
+    pos = 0
+    while pos < len(program):
+        code = program[pos]
+        pos += 1
+        if code == _PUSH_INT:
+            stack.append((compiler.constant(_INT.unpack_from(program, pos)[0]), 1))
+            pos += _INT.size
+        elif code == _PUSH_FLOAT:
+            stack.append((compiler.constant(_FLOAT.unpack_from(program, pos)[0]), 1))
+            pos += _FLOAT.size
+        elif code == _PUSH_X:
+            stack.append((lambda x: x, 1))
+        else:
+            right, right_depth = stack.pop()
+            left, left_depth = stack.pop()
+            op = Calc.op_map[_OPCODES[code - _PUSH_X - 1]]
+            depth = max(left_depth, right_depth) + 1
+            if depth > budget.max_depth:
+                raise FormulaBudgetError(
+                    f"Formula nested deeper than {budget.max_depth}"
+                )
+            stack.append((compiler.combine(op, left, right), depth))
+        nodes += 1
+        if nodes > budget.max_nodes:
+            raise FormulaBudgetError(f"Formula has over {budget.max_nodes} nodes")
+    return budget.bounded(stack.pop()[0])
+
+
+def compile_catalog(source_path: str, target_path: str) -> None:
+    """Write a JSON catalog out as a binary catalog that MappedCatalog can open."""
+    strings: dict[str, int] = {}
+    formulas: dict[str, tuple[int, int, bytes]] = {}  # id, text, program
+    categories: dict[str, list[tuple[int, int, int, int, int, int]]] = {}
+
+    def intern(value: Optional[str]) -> int:
+        if value is None:
+            return NO_STRING
+        return strings.setdefault(value, len(strings))
+
+    with open(source_path, "rb") as file_object:
+        for category, _, _, raw in iter_records(file_object):
+            record = json.loads(raw)
+            if type(record["x"]) is not int:
+                raise ValueError(f"x of {record['name']} is not an int")
+            formula = record["formula"]
+            if formula not in formulas:
+                formulas[formula] = (
+                    len(formulas),
+                    intern(formula),
+                    encode_formula(formula),
+                )
+            intern(category)
+            categories.setdefault(category, []).append(
+                (
+                    intern(record["name"]),
+                    intern(record["name"].casefold()),
+                    intern(record.get("desc")),
+                    intern(record.get("units")),
+                    formulas[formula][0],
+                    record["x"],
+                )
+            )
+
+    string_data = [x.encode() for x in strings]
+    category_table = bytearray()
+    record_table = bytearray()
+    sorted_table = bytearray()
+    first = 0
+    for category, records in categories.items():
+        category_table += _CATEGORY_ROW.pack(strings[category], first, len(records))
+        for record in records:
+            record_table += _RECORD_ROW.pack(*record)
+        by_key = sorted(range(len(records)), key=lambda i: string_data[records[i][1]])
+        for position in by_key:
+            sorted_table += _INDEX.pack(first + position)
+        first += len(records)
+    formula_table = bytearray()
+    programs = bytearray()
+    for _, text, program in formulas.values():
+        formula_table += _FORMULA_ROW.pack(text, len(programs), len(program))
+        programs += program
+    string_offsets = bytearray(_INDEX.pack(0))
+    total = 0
+    for data in string_data:
+        total += len(data)
+        string_offsets += _INDEX.pack(total)
+
+    sections = [
+        category_table,
+        record_table,
+        sorted_table,
+        formula_table,
+        string_offsets,
+        b"".join(string_data),
+        programs,
+    ]
+    offsets = []
+    position = _HEADER.size
+    for section in sections:
+        offsets.append(position)
+        position += len(section)
+    header = _HEADER.pack(
+        BINARY_MAGIC,
+        BINARY_VERSION,
+        len(categories),
+        first,
+        len(formulas),
+        len(strings),
+        *offsets,
+    )
+    temporary_path = f"{target_path}.tmp"
+    with open(temporary_path, "wb") as file_object:
+        file_object.write(header)
+        for section in sections:
+            file_object.write(section)
+    os.replace(temporary_path, target_path)
+
+
+class MappedCatalog(CatalogSource):
+    """Binary catalog read in place through mmap.
+
+    Records are fixed size and each category keeps its records sorted by casefolded
+    name, so lookups are a binary search over the mapped pages. Worker processes
+    opening the same file share those pages.
+    """
+
+    def __init__(self, filepath: str) -> None:
+        self.filepath = filepath
+        with open(filepath, "rb") as file_object:
+            self._mmap = mmap.mmap(file_object.fileno(), 0, access=mmap.ACCESS_READ)
+        header = _HEADER.unpack_from(self._mmap, 0)
+        if header[0] != BINARY_MAGIC or header[1] != BINARY_VERSION:
+            raise ValueError(f"{filepath} is not a version {BINARY_VERSION} catalog")
+        (
+            self.category_count,
+            self.record_count,
+            self.formula_count,
+            self.string_count,
+        ) = header[2:6]
+        (
+            self._categories_at,
+            self._records_at,
+            self._sorted_at,
+            self._formulas_at,
+            self._string_offsets_at,
+            self._strings_at,
+            self._programs_at,
+        ) = header[6:]
+        self._strings: dict[int, str] = {}  # Decoded strings, interned once
+        self._category_ranges: dict[str, tuple[int, int]] = {}
+        for position in range(self.category_count):
+            name, first, count = _CATEGORY_ROW.unpack_from(
+                self._mmap, self._categories_at + position * _CATEGORY_ROW.size
+            )
+            self._category_ranges[self._string(name)] = (first, count)
+
+    def close(self) -> None:
+        self._mmap.close()
+
+    def _string(self, index: int) -> Optional[str]:
+        if index == NO_STRING:
+            return None
+        try:
+            return self._strings[index]
+        except KeyError:
+            value = sys.intern(self._string_bytes(index).decode())
+            self._strings[index] = value
+            return value
+
+    def _string_bytes(self, index: int) -> bytes:
+        at = self._string_offsets_at + index * _INDEX.size
+        start, end = struct.unpack_from("<II", self._mmap, at)
+        return self._mmap[self._strings_at + start : self._strings_at + end]
+
+    def _record(self, index: int) -> dict[str, Any]:
+        name, _, desc, units, formula, x = _RECORD_ROW.unpack_from(
+            self._mmap, self._records_at + index * _RECORD_ROW.size
+        )
+        text, program_at, program_length = _FORMULA_ROW.unpack_from(
+            self._mmap, self._formulas_at + formula * _FORMULA_ROW.size
+        )
+        program_at += self._programs_at
+        return {
+            "name": self._string(name),
+            "x": x,
+            "desc": self._string(desc),
+            "formula": self._string(text),
+            "units": self._string(units),
+            "program": self._mmap[program_at : program_at + program_length],
+        }
+
+    def categories(self) -> list[str]:
+        return list(self._category_ranges)
+
+    def find(self, category: str, name: str) -> Optional[dict[str, Any]]:
+        if category not in self._category_ranges:
+            return None
+        first, count = self._category_ranges[category]
+        key = name.casefold().encode()
+        low, high = first, first + count
+        while low < high:
+            middle = (low + high) // 2
+            if self._sorted_key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == first + count or self._sorted_key(low) != key:
+            return None
+        return self._record(self._sorted_record(low))
+
+    def _sorted_record(self, position: int) -> int:
+        return _INDEX.unpack_from(self._mmap, self._sorted_at + position * _INDEX.size)[
+            0
+        ]
+
+    def _sorted_key(self, position: int) -> bytes:
+        at = self._records_at + self._sorted_record(position) * _RECORD_ROW.size
+        return self._string_bytes(_RECORD_ROW.unpack_from(self._mmap, at)[1])
+
+    def records(self, category: str) -> Iterator[dict[str, Any]]:
+        first, count = self._category_ranges.get(category, (0, 0))
+        for index in range(first, first + count):
+            yield self._record(index)
+
+
+def open_catalog(filepath: str) -> StreamingCatalog | MappedCatalog:
+    """Open a catalog lazily, as binary if it was made by compile_catalog."""
+    with open(filepath, "rb") as file_object:
+        is_binary = file_object.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+    if is_binary:
+        return MappedCatalog(filepath)
+    return StreamingCatalog(filepath)
+
+
+@dataclass
+class CatalogWatcher:
+    """Reloads a SpellComponentCollection when its catalog file changes.
+
+    Changes are noticed by polling the file's mtime and size, either by calling poll
+    from an existing loop or every interval seconds from a thread started by start.
+    A file caught half written fails to parse and is retried on the next poll.
+    """
+
+    collection: Any  # SpellComponentCollection, which imports this module
+    filepath: str
+    interval: float = 1.0
+    on_reload: Optional[Callable[[Any], None]] = None
+    _stamp: Optional[tuple[int, int]] = field(default=None, init=False, repr=False)
+    _stop: Any = field(default=None, init=False, repr=False)
+    _thread: Any = field(default=None, init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self._stamp = self._read_stamp()
+
+    def _read_stamp(self) -> Optional[tuple[int, int]]:
+        try:
+            stat = os.stat(self.filepath)
+        except FileNotFoundError:  # Between an editor's delete and write
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def poll(self) -> Any:
+        """Reload if the file changed since the last reload, returning the
+        CatalogDiff, or None if it did not change."""
+        stamp = self._read_stamp()
+        if stamp is None or stamp == self._stamp:
+            return None
+        diff = self.collection.reload_file(self.filepath)
+        self._stamp = stamp
+        if self.on_reload is not None:
+            self.on_reload(diff)
+        return diff
+
+    def start(self) -> None:
+        import threading
+
+        if self._thread is not None:
+            return
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except (OSError, ValueError, KeyError):
+                pass  # Half written or broken, try again next time
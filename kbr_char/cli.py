@@ -4,13 +4,167 @@ import sys
 import click
 
 
-@click.command()
-def main(args=None):
+@click.group(invoke_without_command=True)
+@click.pass_context
+def main(ctx, args=None):
     """Console script for kbr_char."""
-    click.echo("Replace this message by putting your code into " "kbr_char.cli.main")
-    click.echo("See click documentation at https://click.palletsprojects.com/")
+    if ctx.invoked_subcommand is None:
+        click.echo(
+            "Replace this message by putting your code into " "kbr_char.cli.main"
+        )
+        click.echo("See click documentation at https://click.palletsprojects.com/")
     return 0
 
 
+@main.command("compile-catalog")
+@click.argument("source", type=click.Path(exists=True, dir_okay=False))
+@click.argument("target", type=click.Path(dir_okay=False, writable=True))
+def compile_catalog_command(source, target):
+    """Compile a JSON catalog SOURCE into a binary catalog TARGET."""
+    from kbr_char.catalog import compile_catalog
+
+    compile_catalog(source, target)
+    click.echo(f"Compiled {source} into {target}")
+
+
+@main.command("dc")
+@click.argument("spells", type=click.File("r"), default="-")
+@click.option(
+    "--catalog",
+    type=click.Path(exists=True, dir_okay=False),
+    help="JSON or compiled catalog to look components up in.",
+)
+@click.option(
+    "--workers", type=click.IntRange(min=1), help="Worker processes [default: cores]"
+)
+@click.option(
+    "--chunk-size", type=click.IntRange(min=1), default=1000, show_default=True
+)
+@click.option("--output", type=click.File("w"), default="-")
+def dc_command(spells, catalog, workers, chunk_size, output):
+    """Score SPELLS, JSON Lines spell definitions (default stdin).
+
+    Writes one JSON line with the name and dc, or an error, per spell, in input
+    order.
+    """
+    from kbr_char.batch import score_spells
+    from kbr_char.catalog import DEFAULT_CATALOG
+
+    for line in score_spells(spells, catalog or DEFAULT_CATALOG, workers, chunk_size):
+        output.write(line + "\n")
+
+
+@main.command("validate")
+@click.argument("catalog", type=click.Path(exists=True, dir_okay=False), required=False)
+@click.option(
+    "--workers", type=click.IntRange(min=1), help="Worker processes [default: cores]"
+)
+@click.option(
+    "--x-range",
+    type=(int, int),
+    default=(0, 100),
+    show_default=True,
+    help="Lowest and highest x to evaluate formulas at.",
+)
+@click.option("--cache/--no-cache", default=True, help="Reuse earlier results.")
+def validate_command(catalog, workers, x_range, cache):
+    """Check every formula of CATALOG, JSON or compiled (default the built-in one).
+
+    Formulas must parse, use only supported syntax and the variable x, and give a
+    finite, non-negative dc at every x. Exits with 1 if any does not.
+    """
+    from kbr_char.catalog import DEFAULT_CATALOG
+    from kbr_char.validate import validate_file, validate_source
+
+    catalog = catalog or DEFAULT_CATALOG
+    if cache:
+        issues = validate_file(catalog, x_range, workers)
+    else:
+        from kbr_char.catalog import open_catalog
+
+        source = open_catalog(catalog)
+        try:
+            issues = validate_source(source, x_range, workers)
+        finally:
+            source.close()
+    for issue in issues:
+        click.echo(f"{issue.category} {issue.name}: {issue.formula!r}: {issue.problem}")
+    if issues:
+        sys.exit(1)
+    click.echo(f"All formulas of {catalog} are valid")
+
+
+@main.command("serve")
+@click.option(
+    "--catalog",
+    type=click.Path(exists=True, dir_okay=False),
+    help="JSON or compiled catalog to look components up in.",
+)
+@click.option(
+    "--journal",
+    type=click.Path(dir_okay=False),
+    help="Keep the served SpellBook in this journal, see SpellBookJournal.",
+)
+@click.option("--name", default="Served", show_default=True, help="SpellBook name")
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", type=click.IntRange(0, 65535), default=8080, show_default=True)
+def serve_command(catalog, journal, name, host, port):
+    """Serve spell DCs over HTTP/JSON, see kbr_char.service.DCService."""
+    import asyncio
+
+    from kbr_char.catalog import DEFAULT_CATALOG
+    from kbr_char.journal import SpellBookJournal
+    from kbr_char.magic import SpellBook, SpellComponentCollection
+    from kbr_char.service import DCService
+
+    from kbr_char.validate import validate_file
+
+    issues = validate_file(catalog or DEFAULT_CATALOG)  # Cached while unchanged
+    if issues:
+        raise click.ClickException(
+            f"{len(issues)} invalid formulas, see the validate command"
+        )
+    components = SpellComponentCollection.from_file(catalog or DEFAULT_CATALOG)
+    if journal:
+        book = SpellBookJournal(journal).load(name, components)
+    else:
+        book = SpellBook(name, components=components)
+    service = DCService(book, host, port)
+    click.echo(f"Serving {book.name} on http://{host}:{port}")
+    try:
+        asyncio.run(service.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+@main.command("load-test")
+@click.argument("spells", type=click.File("r"), required=False)
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", type=click.IntRange(0, 65535), default=8080, show_default=True)
+@click.option(
+    "--requests", type=click.IntRange(min=1), default=10000, show_default=True
+)
+@click.option(
+    "--concurrency", type=click.IntRange(min=1), default=100, show_default=True
+)
+def load_test_command(spells, host, port, requests, concurrency):
+    """Load test a running serve command.
+
+    POSTs each line of SPELLS, JSON Lines spell definitions, to /dc in turn, or
+    GETs /spells without SPELLS. Prints throughput and latency as JSON.
+    """
+    import asyncio
+    import json
+
+    from kbr_char.service import load_test
+
+    if spells:
+        targets = [("POST", "/dc", x.strip().encode()) for x in spells if x.strip()]
+    else:
+        targets = [("GET", "/spells", b"")]
+    report = asyncio.run(load_test(host, port, targets, requests, concurrency))
+    click.echo(json.dumps(report, indent=2))
+
+
 if __name__ == "__main__":
     sys.exit(main())  # pragma: no cover
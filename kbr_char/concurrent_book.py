@@ -0,0 +1,196 @@
+"""SpellBook and SpellComponentCollection for sharing between threads.
+
+Readers never take a lock. Writers take one between themselves, build new
+immutable snapshots of what they change and publish each with a single
+assignment, so a reader sees either all of a write or none of it.
+"""
+from __future__ import annotations  # For using | with type hints
+
+import threading
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Any, Iterable, Mapping, Optional, Type
+
+from kbr_char.catalog import CatalogSource
+from kbr_char.magic import (
+    CatalogDiff,
+    Spell,
+    SpellBook,
+    SpellComponent,
+    SpellComponentCollection,
+)
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """The lookup indexes of a collection, as of one load or reload."""
+
+    components: tuple[SpellComponent, ...] = ()
+    index: Mapping[tuple[Type[SpellComponent], str], SpellComponent] = field(
+        default_factory=dict
+    )
+    by_type: Mapping[Type[SpellComponent], tuple[SpellComponent, ...]] = field(
+        default_factory=dict
+    )
+    by_name: Mapping[str, tuple[SpellComponent, ...]] = field(default_factory=dict)
+
+
+@dataclass
+class ConcurrentSpellComponentCollection(SpellComponentCollection):
+    """SpellComponentCollection whose lookups read a published CatalogSnapshot.
+
+    A lazy source is read in full up front, so a lookup never has to load anything.
+    Reloads run under a lock on the collection's own lists, then publish a new
+    snapshot. Changed templates are still updated in place, as spells rely on that,
+    so a reader racing a reload may see one template's fields part way through.
+    """
+
+    _lock: threading.RLock = field(
+        default_factory=threading.RLock, init=False, repr=False, compare=False
+    )
+    _snapshot: CatalogSnapshot = field(
+        default_factory=CatalogSnapshot, init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self) -> None:
+        with self._lock:
+            super().__post_init__()
+            super().get_by_type(SpellComponent)
+            self._publish()
+
+    def publish(self) -> None:
+        """Publish components appended to components since the last snapshot."""
+        with self._lock:
+            self._publish()
+
+    def _publish(self) -> None:
+        self._sync_index()
+        self._snapshot = CatalogSnapshot(
+            tuple(self.components),
+            MappingProxyType(dict(self._index)),
+            MappingProxyType({k: tuple(v) for k, v in self._by_type.items()}),
+            MappingProxyType({k: tuple(v) for k, v in self._by_name.items()}),
+        )
+
+    def snapshot(self) -> CatalogSnapshot:
+        return self._snapshot
+
+    def reload(self, data: dict[str, list[dict[str, Any]]]) -> CatalogDiff:
+        with self._lock:
+            diff = super().reload(data)
+            self._publish()
+        return diff
+
+    def reload_source(self, source: CatalogSource) -> CatalogDiff:
+        with self._lock:
+            diff = super().reload_source(source)
+            super().get_by_type(SpellComponent)
+            self._publish()
+        return diff
+
+    def get_template(
+        self, component_type: Type[SpellComponent], name: str
+    ) -> SpellComponent:
+        snapshot = self._snapshot
+        key = name.casefold()
+        component = snapshot.index.get((component_type, key))
+        if component is not None:
+            return component
+        for component in snapshot.by_name.get(key, ()):  # subclasses of component_type
+            if isinstance(component, component_type):
+                return component
+        raise IndexError(f"No {component_type.__name__} named {name}")
+
+    def get_by_type(self, component_type: Type[SpellComponent]) -> list[SpellComponent]:
+        snapshot = self._snapshot
+        types = [x for x in snapshot.by_type if issubclass(x, component_type)]
+        if len(types) == 1:
+            return list(snapshot.by_type[types[0]])
+        return [x for x in snapshot.components if isinstance(x, component_type)]
+
+    def get_by_name(self, name: str) -> list[SpellComponent]:
+        return list(self._snapshot.by_name.get(name.casefold(), ()))
+
+
+@dataclass
+class ConcurrentSpellBook(SpellBook):
+    """SpellBook whose spells are published as an immutable mapping.
+
+    spells is never changed in place: adding, removing and replacing spells each
+    copy it, change the copy and publish it as the new spells. spell_list,
+    get_spell and the rest read whichever mapping is published when they start,
+    and snapshot hands one out to read several times consistently.
+
+    Spells themselves are shared between snapshots, so customizing a component
+    shows in all of them. To change a spell atomically, build a new one and
+    replace_spell it.
+    """
+
+    _lock: threading.Lock = field(
+        default_factory=threading.Lock, init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self) -> None:
+        spells = self.spells
+        self.spells = MappingProxyType({})
+        self.add_spells(spells.values() if isinstance(spells, Mapping) else spells)
+
+    def snapshot(self) -> Mapping[str, Spell]:
+        return self.spells
+
+    def _publish(
+        self, added: Iterable[Spell] = (), removed: Iterable[str] = ()
+    ) -> tuple[list[Spell], list[Spell]]:
+        """Publish spells with added put in, replacing any of the same name, and
+        removed taken out. Returns the spells put in and those taken out."""
+        spells = dict(self.spells)
+        dropped = [spells.pop(x) for x in removed if x in spells]
+        added = list(added)
+        for spell in added:
+            previous = spells.get(spell.name)
+            if previous is not None and previous is not spell:
+                dropped.append(previous)
+            spells[spell.name] = spell
+        self.spells = MappingProxyType(spells)
+        return added, dropped
+
+    def _notify(self, added: list[Spell], removed: list[Spell]) -> None:
+        for spell in removed:
+            if spell._books is not None:
+                spell._books.pop(id(self), None)
+            for listener in self.listeners:
+                listener.spell_removed(self, spell)
+        for spell in added:
+            self._watch(spell)
+            for listener in self.listeners:
+                listener.spell_added(self, spell)
+
+    def add_spell(self, spell: Spell) -> None:
+        self.add_spells([spell])
+
+    def add_spells(self, spells: Iterable[Spell]) -> None:
+        """Add spells all in one snapshot, or none of them if any name is taken."""
+        spells = list(spells)
+        with self._lock:
+            names = set(self.spells)
+            for spell in spells:
+                if spell.name in names:
+                    raise ValueError(f"Spell already in SpellBook {self.name}")
+                names.add(spell.name)
+            self._notify(*self._publish(added=spells))
+
+    def remove_spell(self, spellname: str) -> None:
+        self.remove_spells([spellname])
+
+    def remove_spells(self, spellnames: Iterable[str]) -> None:
+        """Remove spells all in one snapshot, skipping names not in the book."""
+        with self._lock:
+            removed = [x for x in spellnames if x in self.spells]
+            if removed:
+                self._notify(*self._publish(removed=removed))
+
+    def replace_spell(self, spell: Spell, name: Optional[str] = None) -> None:
+        """Publish spell in place of the spell named name, by default its own name."""
+        with self._lock:
+            removed = [name] if name is not None and name != spell.name else []
+            self._notify(*self._publish(added=[spell], removed=removed))
@@ -0,0 +1,122 @@
+"""Recomputing the dc of every spell in a SpellBook at once, with NumPy."""
+from __future__ import annotations  # For using | with type hints
+
+from dataclasses import dataclass, field
+from operator import attrgetter
+from typing import TYPE_CHECKING
+
+from kbr_char.magic import Calc, ComponentInstance, SpellBook, SpellComponent
+
+if TYPE_CHECKING:
+    import numpy
+
+
+@dataclass(eq=False)
+class DCMatrix:
+    """A SpellBook as a sparse spells by components incidence matrix.
+
+    Each column is one component object, so a ComponentInstance or a customized
+    SpellComponent. Each row holds how many times each spell uses a column, in
+    compressed sparse row form. refresh reads every column's formula and x again
+    and evaluates each formula once, over the distinct xs using it. The dcs are
+    then the product of the matrix with those column dcs.
+
+    The matrix only follows a book's spells as they were when it was built. After
+    adding, removing or reordering spells or their components, build a new one.
+    Customizing x or reloading the catalog only needs refresh.
+    """
+
+    names: list[str]
+    columns: list[SpellComponent | ComponentInstance] = field(repr=False)
+    # Entries of row i are from indptr[i] up to indptr[i + 1]
+    indptr: numpy.ndarray = field(repr=False)
+    indices: numpy.ndarray = field(repr=False)  # Column of each entry
+    counts: numpy.ndarray = field(repr=False)  # Times the spell uses the column
+    # Columns of each template, so each formula is read once rather than per column
+    _by_template: list[tuple[SpellComponent, numpy.ndarray]] = field(
+        init=False, repr=False
+    )
+    column_dcs: numpy.ndarray = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        import numpy
+
+        by_template: dict[int, tuple[SpellComponent, list[int]]] = {}
+        for column, component in enumerate(self.columns):
+            template = getattr(component, "template", component)
+            by_template.setdefault(id(template), (template, []))[1].append(column)
+        self._by_template = [
+            (template, numpy.array(columns, dtype=numpy.int64))
+            for template, columns in by_template.values()
+        ]
+        self.refresh()
+
+    @classmethod
+    def from_book(cls, book: SpellBook) -> DCMatrix:
+        import numpy
+
+        names = []
+        columns: dict[int, int] = {}  # Column of each component, by id
+        components = []
+        indptr = [0]
+        indices: list[int] = []
+        counts: list[int] = []
+        for spell in book.detailed_spell_list():
+            names.append(spell.name)
+            row: dict[int, int] = {}
+            for component in spell.components:
+                column = columns.setdefault(id(component), len(components))
+                if column == len(components):
+                    components.append(component)
+                row[column] = row.get(column, 0) + 1
+            indices.extend(row)
+            counts.extend(row.values())
+            indptr.append(len(indices))
+        return cls(
+            names,
+            components,
+            numpy.array(indptr, dtype=numpy.int64),
+            numpy.array(indices, dtype=numpy.int64),
+            numpy.array(counts, dtype=numpy.int64),
+        )
+
+    def refresh(self) -> None:
+        """Evaluate the dc of every column, after customizing or reloading."""
+        import numpy
+
+        xs = numpy.fromiter(
+            map(attrgetter("x"), self.columns),
+            dtype=numpy.int64,
+            count=len(self.columns),
+        )
+        by_formula: dict[str, list[numpy.ndarray]] = {}
+        for template, columns in self._by_template:
+            by_formula.setdefault(template.formula, []).append(columns)
+        self.column_dcs = numpy.zeros(len(self.columns), dtype=numpy.int64)
+        for formula, parts in by_formula.items():
+            columns = numpy.concatenate(parts)
+            distinct, inverse = numpy.unique(xs[columns], return_inverse=True)
+            try:
+                with numpy.errstate(all="raise"):
+                    dcs = Calc.evaluate_many(formula, distinct)
+            except ArithmeticError:
+                # Such as 1/x at 0, raised as it would be by Spell.dc
+                dcs = [int(Calc.evaluate(formula, int(x))) for x in distinct]
+            self.column_dcs[columns] = numpy.asarray(dcs, dtype=numpy.int64)[inverse]
+
+    def dcs(self) -> dict[str, int]:
+        """dc of each spell by name, the same as Spell.dc of each."""
+        import numpy
+
+        entries = self.counts * self.column_dcs[self.indices]
+        totals = numpy.zeros(len(self.names), dtype=numpy.int64)
+        starts = self.indptr[:-1]
+        filled = starts < self.indptr[1:]  # reduceat can't sum an empty row
+        if entries.size:
+            totals[filled] = numpy.add.reduceat(entries, starts[filled])
+        return dict(zip(self.names, totals.tolist()))
+
+
+def book_dcs(book: SpellBook) -> dict[str, int]:
+    """dc of every spell in book by name, computed as one matrix product."""
+    return DCMatrix.from_book(book).dcs()
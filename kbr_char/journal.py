@@ -0,0 +1,163 @@
+"""Append-only journal persistence for SpellBooks."""
+from __future__ import annotations  # For using | with type hints
+
+import json
+import os
+from dataclasses import dataclass, field
+from typing import IO, Any, Optional
+
+from kbr_char.magic import (
+    ComponentInstance,
+    Spell,
+    SpellBook,
+    SpellBookListener,
+    SpellComponent,
+    SpellComponentCollection,
+    spell_from_dict,
+    spell_to_dict,
+)
+
+COMPACT_EVERY = 1000
+
+
+@dataclass(eq=False)
+class SpellBookJournal(SpellBookListener):
+    """Saves a SpellBook as a snapshot plus a journal of the edits made since.
+
+    Each add_spell, remove_spell or component customize appends one line to
+    <path>.journal, so saving costs the same whatever the size of the book. Every
+    compact_every edits the book is written to <path>.snapshot and the journal is
+    emptied. Edits carry a sequence number, so ones already in the snapshot are
+    skipped if a crash left them in the journal too.
+    """
+
+    path: str
+    compact_every: int = COMPACT_EVERY
+    fsync: bool = False
+    sequence: int = 0
+    _book: Optional[SpellBook] = field(default=None, init=False, repr=False)
+    _file: Optional[IO[str]] = field(default=None, init=False, repr=False)
+    _pending: int = field(default=0, init=False, repr=False)
+
+    @property
+    def journal_path(self) -> str:
+        return f"{self.path}.journal"
+
+    @property
+    def snapshot_path(self) -> str:
+        return f"{self.path}.snapshot"
+
+    def load(
+        self, name: str, components: Optional[SpellComponentCollection] = None
+    ) -> SpellBook:
+        """Rebuild the saved book, or start an empty one, and journal its edits."""
+        book = SpellBook(name)
+        if components is not None:
+            book.components = components
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path) as file_object:
+                snapshot = json.load(file_object)
+            book.name = snapshot["name"]
+            self.sequence = snapshot["sequence"]
+            for spell in snapshot["spells"]:
+                book.add_spell(spell_from_dict(spell, book.components))
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "rb+") as file_object:
+                complete = 0  # Bytes up to the end of the last whole entry
+                for line in file_object:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:  # Torn last write
+                        break
+                    if not line.endswith(b"\n"):
+                        break
+                    complete += len(line)
+                    if entry["sequence"] > self.sequence:
+                        self._replay(book, entry)
+                        self.sequence = entry["sequence"]
+                        self._pending += 1
+                # Drop a torn write, so the next entry starts on a line of its own
+                file_object.truncate(complete)
+        self.attach(book)
+        return book
+
+    def _replay(self, book: SpellBook, entry: dict[str, Any]) -> None:
+        if entry["op"] == "add_spell":
+            book.add_spell(spell_from_dict(entry["spell"], book.components))
+        elif entry["op"] == "remove_spell":
+            book.remove_spell(entry["name"])
+        elif entry["op"] == "customize":
+            spell = book.get_spell(entry["spell"])
+            spell.components[entry["component"]].customize(entry["x"])
+        else:
+            raise ValueError(f"Unknown journal entry {entry['op']}")
+
+    def attach(self, book: SpellBook) -> None:
+        if self._book is not None:
+            self._book.listeners.remove(self)
+        self._book = book
+        book.listeners.append(self)
+
+    def close(self) -> None:
+        if self._book is not None:
+            self._book.listeners.remove(self)
+            self._book = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _append(self, entry: dict[str, Any]) -> None:
+        if self._file is None:
+            self._file = open(self.journal_path, "a")
+        self.sequence += 1
+        entry["sequence"] = self.sequence
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._pending += 1
+        if self._book is not None and self._pending >= self.compact_every:
+            self.compact()
+
+    def compact(self) -> None:
+        """Write the whole book to the snapshot and empty the journal."""
+        if self._book is None:
+            return
+        snapshot = {
+            "name": self._book.name,
+            "sequence": self.sequence,
+            "spells": [spell_to_dict(x) for x in self._book.detailed_spell_list()],
+        }
+        temporary_path = f"{self.snapshot_path}.tmp"
+        with open(temporary_path, "w") as file_object:
+            json.dump(snapshot, file_object)
+            file_object.flush()
+            os.fsync(file_object.fileno())
+        os.replace(temporary_path, self.snapshot_path)
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.journal_path, "w")
+        self._pending = 0
+
+    def spell_added(self, book: SpellBook, spell: Spell) -> None:
+        self._append({"op": "add_spell", "spell": spell_to_dict(spell)})
+
+    def spell_removed(self, book: SpellBook, spell: Spell) -> None:
+        self._append({"op": "remove_spell", "name": spell.name})
+
+    def spell_changed(
+        self,
+        book: SpellBook,
+        spell: Spell,
+        component: SpellComponent | ComponentInstance,
+    ) -> None:
+        for index, spell_component in enumerate(spell.components):
+            if spell_component is component:
+                self._append(
+                    {
+                        "op": "customize",
+                        "spell": spell.name,
+                        "component": index,
+                        "x": component.x,
+                    }
+                )
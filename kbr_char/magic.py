@@ -1,30 +1,55 @@
+"""Main module."""
 from __future__ import annotations  # For using | with type hints
 
 import ast
 import json
 import operator
+import os
+import sys
+import time
 from _ast import Constant
 from _ast import operator as op_type
-from dataclasses import dataclass, field
-from typing import Any, Optional, Type
+from collections import OrderedDict
+from dataclasses import FrozenInstanceError, dataclass, field
+from fractions import Fraction
+from functools import wraps
+from typing import TYPE_CHECKING, Any, Callable, Optional, Sequence, Type
+from weakref import WeakValueDictionary, ref
 
-from loguru import logger
+from kbr_char.catalog import (
+    CatalogSource,
+    StreamingCatalog,
+    decode_formula,
+    open_catalog,
+)
+
+if TYPE_CHECKING:
+    import numpy
+
+FORMULA_CACHE_SIZE = 1024
+MAX_POLYNOMIAL_DEGREE = 16
 
 
 class Calc(ast.NodeVisitor):
     """See https://github.com/benreu/PyGtk-Posting/commit/9a34641b62c9639599641f9965ef5ffbb752cb3a"""
 
-    @staticmethod
-    def translate_op(op: op_type):
-        op_map = {
-            ast.Add: operator.add,
-            ast.Sub: operator.sub,
-            ast.Mult: operator.mul,
-            ast.Div: operator.truediv,
-            ast.Invert: operator.neg,
-            ast.Pow: operator.pow,
-        }
-        return op_map[type(op)]
+    op_map = {
+        ast.Add: operator.add,
+        ast.Sub: operator.sub,
+        ast.Mult: operator.mul,
+        ast.Div: operator.truediv,
+        ast.Invert: operator.neg,
+        ast.Pow: operator.pow,
+    }
+
+    @classmethod
+    def translate_op(cls, op: op_type):
+        try:
+            return cls.op_map[type(op)]
+        except KeyError:
+            raise ValueError(
+                f"Unsupported operator in formula: {type(op).__name__}"
+            ) from None
 
     def visit_BinOp(self, node):
         left = self.visit(node.left)
@@ -38,27 +63,591 @@ class Calc(ast.NodeVisitor):
         return self.visit(node.value)
 
     @classmethod
-    def evaluate(cls, expression):
+    def interpret(cls, expression: str, x: Any = None):
+        """Parse and walk the expression on every call, substituting x as text.
+
+        This is the original evaluation path, kept to compare compiled results against.
+        """
+        if x is not None:
+            expression = expression.replace("x", str(x))
         tree = ast.parse(expression)
         calc = cls()
         return calc.visit(tree.body[0])
 
+    @classmethod
+    def compile(cls, formula: str) -> Callable[[Any], Any]:
+        return formula_cache.get(formula)
+
+    @classmethod
+    def evaluate(cls, expression: str, x: Any = None):
+        return formula_cache.get(expression)(x)
+
+    @classmethod
+    def normalize(cls, formula: str) -> Optional[Polynomial]:
+        """The formula as a polynomial in x, or None if it is not one."""
+        return formula_cache.normalize(formula)
+
+    @classmethod
+    def solve(
+        cls, formula: str, dc: int, low: int = 0, high: Optional[int] = None
+    ) -> Optional[int]:
+        """Largest x in [low, high] where int(Calc.evaluate(formula, x)) <= dc.
+
+        Linear formulas are solved in closed form, and high may be None for ones
+        that grow with x. Other formulas are bisected, which needs high and assumes
+        they never decrease as x grows. None if no x in range fits.
+        """
+        compiled = formula_cache.get(formula)
+
+        def fits(x: int) -> bool:
+            return int(compiled(x)) <= dc
+
+        polynomial = formula_cache.normalize(formula)
+        if polynomial is not None and polynomial.degree <= 1:
+            offset, slope = (polynomial.coefficients + (Fraction(0),))[:2]
+            if slope <= 0:  # Never grows, so the top of the range is best
+                if high is None:
+                    raise ValueError(f"{formula} does not grow with x, give a high x")
+                return high if fits(high) else None
+            # int() truncates towards zero, so for dc >= 0 values below dc + 1 fit,
+            # and for dc < 0 only values at or below dc do.
+            if dc >= 0:
+                x = -((offset - dc - 1) // slope) - 1
+            else:
+                x = (dc - offset) // slope
+            x = int(x) if high is None else min(int(x), high)
+            while x >= low and not fits(x):  # Float rounding in the formula
+                x -= 1
+            while x >= low and (high is None or x < high) and fits(x + 1):
+                x += 1
+            return x if x >= low else None
+        if high is None:
+            raise ValueError(f"{formula} is not linear, give a high x to bisect to")
+        if not fits(low):
+            return None
+        while low < high:
+            middle = (low + high + 1) // 2
+            if fits(middle):
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+    @classmethod
+    def evaluate_many(cls, expression: str, xs: Any) -> numpy.ndarray:
+        """Evaluate the formula over an array of x values in one vectorized pass.
+
+        Results are truncated to ints like int(Calc.evaluate(...)). Values are computed
+        with NumPy int64/float64, so they only match exactly while they fit in those.
+        """
+        import numpy
+
+        xs = numpy.asarray(xs)
+        values = numpy.broadcast_to(formula_cache.get(expression)(xs), xs.shape)
+        return values.astype(numpy.int64)
+
+
+_NUMBERS = (int, float)  # Arrays are fixed width, so only these are budgeted
+
+
+class FormulaBudgetError(ValueError):
+    """A formula, or its value at some x, is over its EvaluationBudget."""
+
+
+@dataclass(frozen=True)
+class EvaluationBudget:
+    """Limits keeping any formula from taking unbounded time or memory.
+
+    Length, depth and node count are checked once when a formula is compiled, as
+    are parts of it that don't use x, which are folded into constants. What depends
+    on x is checked as it is evaluated, on Python numbers only, as NumPy arrays are
+    fixed width and can't run away.
+    """
+
+    max_length: int = 1024
+    max_depth: int = 32
+    max_nodes: int = 256
+    max_exponent: int = 64
+    max_operand: int = 10**15  # Largest x, and largest base of a power
+    max_result: int = 10**18  # Largest product, power and value of a formula
+
+    def check_tree(self, tree: ast.AST) -> None:
+        # Only expressions count, as for encoded programs, not operators or contexts
+        nodes = 0
+        stack = [(tree, 0)]
+        while stack:
+            node, depth = stack.pop()
+            if isinstance(node, ast.expr):
+                nodes += 1
+                depth += 1
+            if depth > self.max_depth:
+                raise FormulaBudgetError(f"Formula nested deeper than {self.max_depth}")
+            stack.extend((x, depth) for x in ast.iter_child_nodes(node))
+        if nodes > self.max_nodes:
+            raise FormulaBudgetError(f"Formula has over {self.max_nodes} nodes")
+
+    def check(self, value: Any, limit: int, what: str) -> Any:
+        if type(value) in _NUMBERS and abs(value) > limit:
+            raise FormulaBudgetError(f"{what} over {limit}")
+        return value
+
+    def power(self, base: Any, exponent: Any) -> Any:
+        self.check(exponent, self.max_exponent, "Exponent")
+        self.check(base, self.max_operand, "Base of a power")
+        try:
+            value = base**exponent
+        except OverflowError:
+            raise FormulaBudgetError(f"Power over {self.max_result}")
+        return self.check(value, self.max_result, "Power")
+
+    def multiply(self, left: Any, right: Any) -> Any:
+        return self.check(left * right, self.max_result, "Product")
+
+    def bounded(self, compiled: Callable[[Any], Any]) -> Callable[[Any], Any]:
+        """compiled, checking its x and its value against the budget."""
+        max_operand, max_result = self.max_operand, self.max_result
+
+        def bounded(x: Any) -> Any:
+            # Checked inline rather than by check, as this runs on every evaluation
+            if type(x) in _NUMBERS and abs(x) > max_operand:
+                raise FormulaBudgetError(f"x over {max_operand}")
+            value = compiled(x)
+            if type(value) in _NUMBERS and abs(value) > max_result:
+                raise FormulaBudgetError(f"Formula value over {max_result}")
+            return value
+
+        return bounded
+
+
+DEFAULT_BUDGET = EvaluationBudget()
+
+
+class FormulaCompiler(Calc):
+    """Builds a formula into nested closures of x, so it is parsed only once.
+
+    Parts of the formula without x are worked out while building.
+    """
+
+    def __init__(self, budget: EvaluationBudget = DEFAULT_BUDGET) -> None:
+        self.budget = budget
+        # Closures that ignore x by id, with their value. Holding the closure keeps
+        # its id from being reused by another.
+        self.constants: dict[int, tuple[Callable[[Any], Any], Any]] = {}
+
+    def constant(self, value: Any) -> Callable[[Any], Any]:
+        self.budget.check(value, self.budget.max_result, "Constant")
+        closure = lambda x: value  # noqa: E731
+        self.constants[id(closure)] = (closure, value)
+        return closure
+
+    def visit_BinOp(self, node):
+        left = self.visit(node.left)
+        right = self.visit(node.right)
+        return self.combine(self.translate_op(node.op), left, right)
+
+    def combine(
+        self, op: Callable[[Any, Any], Any], left: Callable, right: Callable
+    ) -> Callable[[Any], Any]:
+        if op is operator.pow:
+            op = self.budget.power
+        elif op is operator.mul and not (
+            id(left) in self.constants or id(right) in self.constants
+        ):
+            op = self.budget.multiply  # Only x times x can compound
+        if id(left) in self.constants and id(right) in self.constants:
+            try:
+                return self.constant(
+                    op(self.constants[id(left)][1], self.constants[id(right)][1])
+                )
+            except FormulaBudgetError:
+                raise
+            except ArithmeticError:
+                pass  # Such as 1/0, left to raise when evaluated
+        return lambda x: op(left(x), right(x))
+
+    def visit_Constant(self, node: Constant) -> Any:
+        if type(node.value) not in _NUMBERS:  # 'ab'*x would grow without bound
+            raise ValueError(f"Unsupported constant in formula: {node.value!r}")
+        return self.constant(node.value)
+
+    def visit_Name(self, node):
+        if node.id != "x":
+            raise ValueError(f"Unknown variable in formula: {node.id}")
+        return lambda x: x
+
+    def generic_visit(self, node):
+        raise ValueError(f"Unsupported syntax in formula: {type(node).__name__}")
+
+    @classmethod
+    def build(
+        cls, formula: str, budget: EvaluationBudget = DEFAULT_BUDGET
+    ) -> Callable[[Any], Any]:
+        if len(formula) > budget.max_length:
+            raise FormulaBudgetError(f"Formula over {budget.max_length} characters")
+        tree = ast.parse(formula)
+        budget.check_tree(tree.body[0])
+        return budget.bounded(cls(budget).visit(tree.body[0]))
+
+
+@dataclass(frozen=True)
+class Polynomial:
+    """Exact coefficients of a polynomial in x, lowest power first."""
+
+    coefficients: tuple[Fraction, ...]
+
+    def __post_init__(self) -> None:
+        coefficients = list(self.coefficients)
+        while len(coefficients) > 1 and coefficients[-1] == 0:
+            coefficients.pop()
+        object.__setattr__(self, "coefficients", tuple(coefficients))
+
+    @property
+    def degree(self) -> int:
+        return len(self.coefficients) - 1
+
+    def __call__(self, x: Any) -> Fraction:
+        value = Fraction(0)
+        for coefficient in reversed(self.coefficients):
+            value = value * x + coefficient
+        return value
+
+    def _padded(self, other: Polynomial) -> list[tuple[Fraction, Fraction]]:
+        length = max(len(self.coefficients), len(other.coefficients))
+        return list(
+            zip(
+                self.coefficients + (Fraction(0),) * (length - len(self.coefficients)),
+                other.coefficients
+                + (Fraction(0),) * (length - len(other.coefficients)),
+            )
+        )
+
+    def __add__(self, other: Polynomial) -> Polynomial:
+        return Polynomial(tuple(a + b for a, b in self._padded(other)))
+
+    def __sub__(self, other: Polynomial) -> Polynomial:
+        return Polynomial(tuple(a - b for a, b in self._padded(other)))
+
+    def __mul__(self, other: Polynomial) -> Polynomial:
+        product = [Fraction(0)] * (len(self.coefficients) + len(other.coefficients) - 1)
+        for i, a in enumerate(self.coefficients):
+            for j, b in enumerate(other.coefficients):
+                product[i + j] += a * b
+        return Polynomial(tuple(product))
+
+    def __truediv__(self, other: Polynomial) -> Polynomial:
+        if other.degree:
+            raise ValueError("Division by x is not a polynomial")
+        return Polynomial(tuple(x / other.coefficients[0] for x in self.coefficients))
+
+    def __pow__(self, other: Polynomial) -> Polynomial:
+        if other.degree:
+            raise ValueError("Powers of x are not polynomials")
+        exponent = other.coefficients[0]
+        if not self.degree:  # Constant folding
+            value = self.coefficients[0] ** exponent
+            if isinstance(value, complex):
+                raise ValueError("Formula has no real value")
+            return Polynomial((Fraction(value),))
+        if exponent.denominator != 1 or exponent < 0:
+            raise ValueError("Only whole, non-negative powers of x are polynomials")
+        if self.degree * exponent > MAX_POLYNOMIAL_DEGREE:
+            raise ValueError(f"Degree over {MAX_POLYNOMIAL_DEGREE}")
+        result = Polynomial((Fraction(1),))
+        for _ in range(int(exponent)):
+            result = result * self
+        return result
+
+
+class PolynomialFolder(Calc):
+    """Folds a formula into a Polynomial, raising ValueError if it is not one.
+
+    Folding constants is checked against the budget like compiling, so a formula
+    such as 7**7**7 is given up on rather than worked out.
+    """
+
+    def __init__(self, budget: EvaluationBudget = DEFAULT_BUDGET) -> None:
+        self.budget = budget
+
+    def check(self, polynomial: Polynomial) -> Polynomial:
+        limit = self.budget.max_result
+        if any(abs(x) > limit for x in polynomial.coefficients):
+            raise FormulaBudgetError(f"Coefficient over {limit}")
+        return polynomial
+
+    def visit_BinOp(self, node):
+        left = self.visit(node.left)
+        right = self.visit(node.right)
+        op = self.translate_op(node.op)
+        if op is operator.pow and not right.degree:
+            if abs(right.coefficients[0]) > self.budget.max_exponent:
+                raise FormulaBudgetError(f"Exponent over {self.budget.max_exponent}")
+            if not left.degree and abs(left.coefficients[0]) > self.budget.max_operand:
+                raise FormulaBudgetError(
+                    f"Base of a power over {self.budget.max_operand}"
+                )
+        return self.check(op(left, right))
+
+    def visit_Constant(self, node: Constant) -> Any:
+        if type(node.value) not in _NUMBERS:
+            raise ValueError(f"Unsupported constant in formula: {node.value!r}")
+        return self.check(Polynomial((Fraction(node.value),)))
+
+    def visit_Name(self, node):
+        if node.id != "x":
+            raise ValueError(f"Unknown variable in formula: {node.id}")
+        return Polynomial((Fraction(0), Fraction(1)))
+
+    def generic_visit(self, node):
+        raise ValueError(f"Unsupported syntax in formula: {type(node).__name__}")
+
+    @classmethod
+    def fold(
+        cls, formula: str, budget: EvaluationBudget = DEFAULT_BUDGET
+    ) -> Optional[Polynomial]:
+        try:
+            if len(formula) > budget.max_length:
+                return None
+            tree = ast.parse(formula).body[0]
+            budget.check_tree(tree)
+            return cls(budget).visit(tree)
+        except (
+            ArithmeticError,
+            IndexError,  # An empty formula
+            RecursionError,
+            SyntaxError,
+            TypeError,
+            ValueError,
+        ):
+            return None
+
 
 @dataclass
-class SpellComponent:
+class FormulaCache:
+    """Bounded LRU of compiled formulas, keyed by formula text."""
+
+    maxsize: int = FORMULA_CACHE_SIZE
+    hits: int = 0
+    misses: int = 0
+    budget: EvaluationBudget = DEFAULT_BUDGET
+    compiled: OrderedDict[str, Callable[[Any], Any]] = field(
+        default_factory=OrderedDict, repr=False
+    )
+    normalized: OrderedDict[str, Optional[Polynomial]] = field(
+        default_factory=OrderedDict, repr=False
+    )
+
+    def get(self, formula: str) -> Callable[[Any], Any]:
+        try:
+            compiled = self.compiled[formula]
+        except KeyError:
+            self.misses += 1
+            compiled = FormulaCompiler.build(formula, self.budget)
+            self.compiled[formula] = compiled
+            if len(self.compiled) > self.maxsize:
+                self.compiled.popitem(last=False)
+        else:
+            self.hits += 1
+            self.compiled.move_to_end(formula)
+        return compiled
+
+    def normalize(self, formula: str) -> Optional[Polynomial]:
+        try:
+            polynomial = self.normalized[formula]
+        except KeyError:
+            polynomial = PolynomialFolder.fold(formula, self.budget)
+            self.normalized[formula] = polynomial
+            if len(self.normalized) > self.maxsize:
+                self.normalized.popitem(last=False)
+        else:
+            self.normalized.move_to_end(formula)
+        return polynomial
+
+    def prime(self, formula: str, compiled: Callable[[Any], Any]) -> None:
+        """Cache an already compiled formula, such as one read from a binary catalog."""
+        if formula not in self.compiled:
+            self.compiled[formula] = compiled
+            if len(self.compiled) > self.maxsize:
+                self.compiled.popitem(last=False)
+
+    def set_budget(self, budget: EvaluationBudget) -> None:
+        """Compile formulas under budget from now on, dropping ones done before."""
+        self.budget = budget
+        self.compiled.clear()
+        self.normalized.clear()
+
+    def clear(self) -> None:
+        self.compiled.clear()
+        self.normalized.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.compiled)
+
+
+formula_cache = FormulaCache()
+
+
+WATCHERS_IN_TUPLE = 4  # Past this many spells, a component keeps them in a dict
+
+
+class _NotifiesSpells:
+    """Tells the spells holding a component when customize changes its x.
+
+    Most components are in a single spell, so the spells are kept as a tuple of weak
+    references, only becoming a WeakValueDictionary for a component in many spells,
+    such as a catalog template.
+    """
+
+    __slots__ = ()
+
+    x: int
+    dc: int
+    _spells: Optional[tuple[ref[Spell], ...] | WeakValueDictionary[int, Spell]]
+
+    def customize(self, x: int):
+        self.x = x
+        self._notify_spells()
+
+    def _watch(self, spell: Spell) -> None:
+        if isinstance(self._spells, WeakValueDictionary):
+            self._spells[id(spell)] = spell
+            return
+        spells = self._watching()
+        if any(x is spell for x in spells):
+            return
+        spells.append(spell)
+        if len(spells) > WATCHERS_IN_TUPLE:
+            self._spells = WeakValueDictionary((id(x), x) for x in spells)
+        else:
+            self._spells = tuple(map(ref, spells))
+
+    def _watching(self) -> list[Spell]:
+        """The spells holding this component, dropping any no longer alive."""
+        if isinstance(self._spells, WeakValueDictionary):
+            return list(self._spells.values())
+        spells = [x() for x in self._spells or ()]
+        return [x for x in spells if x is not None]
+
+    def _notify_spells(self) -> None:
+        for spell in self._watching():
+            spell._component_changed(self)
+
+
+@dataclass
+class SpellComponent(_NotifiesSpells):
     name: str
     x: int
     formula: str
     units: Optional[str] = None
     desc: Optional[str] = None
+    # Spells holding this component, so they can be told when it changes.
+    _spells: Optional[tuple[ref[Spell], ...] | WeakValueDictionary[int, Spell]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    # Set once the component is a shared template in a SpellComponentCollection
+    _frozen: bool = field(default=False, init=False, repr=False, compare=False)
 
     @property
     def dc(self) -> int:
-        formulae = self.formula.replace("x", str(self.x))
-        return int(Calc.evaluate(formulae))
+        return int(Calc.evaluate(self.formula, self.x))
 
-    def customize(self, x: int):
+    def dc_range(self, xs: Any) -> numpy.ndarray:
+        return Calc.evaluate_many(self.formula, xs)
+
+    def largest_x(
+        self, dc: int, low: int = 0, high: Optional[int] = None
+    ) -> Optional[int]:
+        return Calc.solve(self.formula, dc, low, high)
+
+    def instance(self, x: Optional[int] = None) -> ComponentInstance:
+        return ComponentInstance(self, self.x if x is None else x)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name in TEMPLATE_FIELDS and self.__dict__.get("_frozen"):
+            raise FrozenInstanceError(
+                f"{self.name} is a catalog template, customize an instance of it"
+            )
+        super().__setattr__(name, value)
+
+    def __getstate__(self) -> dict[str, Any]:
+        state = self.__dict__.copy()
+        state["_spells"] = None  # Weak references can't be pickled
+        return state
+
+    def __str__(self):
+        return self.name
+
+
+TEMPLATE_FIELDS = frozenset(["name", "x", "formula", "units", "desc"])
+
+
+class ComponentInstance(_NotifiesSpells):
+    """A catalog template as used in one spell, with its own x.
+
+    Only the template and x are stored, everything else is read from the template,
+    so customizing one spell's component never changes another spell.
+    """
+
+    __slots__ = ("template", "x", "_spells")
+
+    def __init__(self, template: SpellComponent, x: int) -> None:
+        self.template = template
         self.x = x
+        self._spells = None
+
+    def _watch(self, spell: Spell) -> None:
+        super()._watch(spell)
+        self.template._watch(spell)  # So a catalog reload can reach the spell
+
+    @property
+    def name(self) -> str:
+        return self.template.name
+
+    @property
+    def formula(self) -> str:
+        return self.template.formula
+
+    @property
+    def units(self) -> Optional[str]:
+        return self.template.units
+
+    @property
+    def desc(self) -> Optional[str]:
+        return self.template.desc
+
+    @property
+    def component_type(self) -> Type[SpellComponent]:
+        return type(self.template)
+
+    @property
+    def dc(self) -> int:
+        return int(Calc.evaluate(self.template.formula, self.x))
+
+    def dc_range(self, xs: Any) -> numpy.ndarray:
+        return Calc.evaluate_many(self.template.formula, xs)
+
+    def largest_x(
+        self, dc: int, low: int = 0, high: Optional[int] = None
+    ) -> Optional[int]:
+        return Calc.solve(self.template.formula, dc, low, high)
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, ComponentInstance):
+            return NotImplemented
+        return self.template == other.template and self.x == other.x
+
+    __hash__ = None  # type: ignore  # Mutable, like SpellComponent
+
+    def __getstate__(self) -> tuple[SpellComponent, int]:
+        return self.template, self.x  # Weak references can't be pickled
+
+    def __setstate__(self, state: tuple[SpellComponent, int]) -> None:
+        self.template, self.x = state
+        self._spells = None
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(template={self.template!r}, x={self.x!r})"
 
     def __str__(self):
         return self.name
@@ -80,6 +669,55 @@ class Modifier(SpellComponent):
     ...
 
 
+CATEGORIES: dict[str, Type[SpellComponent]] = {
+    "Elements": Element,
+    "Range": Range,
+    "Shape": Shape,
+    "Modifiers": Modifier,
+}
+CATEGORY_NAMES = {component_type: name for name, component_type in CATEGORIES.items()}
+
+
+def make_component(
+    component_type: Type[SpellComponent], record: dict[str, Any]
+) -> SpellComponent:
+    return component_type(
+        name=_intern(record["name"]),
+        x=record["x"],
+        desc=_intern(record["desc"]),
+        formula=_intern(record["formula"]),
+        units=_intern(record.get("units")),
+    )
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    """One copy of each catalog string however many catalogs repeat it."""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def update_component(component: SpellComponent, record: dict[str, Any]) -> bool:
+    """Update a component, template or not, in place from a catalog record.
+
+    Spells holding it or instances of it get their dc recomputed. Returns whether
+    anything changed.
+    """
+    fields = {
+        "name": record["name"],
+        "x": record["x"],
+        "desc": record["desc"],
+        "formula": record["formula"],
+        "units": record.get("units"),
+    }
+    changes = {k: v for k, v in fields.items() if getattr(component, k) != v}
+    if not changes:
+        return False
+    for name, value in changes.items():
+        object.__setattr__(component, name, value)
+    for spell in component._watching():
+        spell._template_changed(component)
+    return True
+
+
 def load_data(filepath: str) -> dict:
     with open(filepath) as file_object:
         file_content = file_object.read()
@@ -89,6 +727,84 @@ def load_data(filepath: str) -> dict:
     return config_data
 
 
+def component_to_dict(component: SpellComponent | ComponentInstance) -> dict[str, Any]:
+    """Catalog instances are saved by reference, other components in full."""
+    if isinstance(component, ComponentInstance):
+        category = CATEGORY_NAMES[component.component_type]
+        return {"type": category, "name": component.name, "x": component.x}
+    return {
+        "type": CATEGORY_NAMES.get(type(component)),
+        "name": component.name,
+        "x": component.x,
+        "formula": component.formula,
+        "units": component.units,
+        "desc": component.desc,
+    }
+
+
+def component_from_dict(
+    data: dict[str, Any], collection: SpellComponentCollection
+) -> SpellComponent | ComponentInstance:
+    """Rebuild a component_to_dict result.
+
+    Catalog references may leave out type, to match any type, and x, to keep the
+    catalog's x.
+    """
+    component_type = CATEGORIES.get(data.get("type"), SpellComponent)
+    if "formula" in data:
+        return make_component(component_type, data)
+    component = collection.get(component_type, data["name"])
+    if "x" in data:
+        component.x = data["x"]
+    return component
+
+
+def spell_to_dict(spell: Spell) -> dict[str, Any]:
+    return {
+        "name": spell.name,
+        "components": [component_to_dict(x) for x in spell.components],
+    }
+
+
+def spell_from_dict(
+    data: dict[str, Any], collection: SpellComponentCollection
+) -> Spell:
+    return Spell(
+        data["name"], [component_from_dict(x, collection) for x in data["components"]]
+    )
+
+
+class SpellComponentCollectionListener:
+    """Follows templates entering or leaving a SpellComponentCollection."""
+
+    def component_added(
+        self, collection: SpellComponentCollection, component: SpellComponent
+    ) -> None:
+        """Also told again for every template if the collection is reindexed."""
+
+    def component_removed(
+        self, collection: SpellComponentCollection, component: SpellComponent
+    ) -> None:
+        pass
+
+    def catalog_reloaded(
+        self, collection: SpellComponentCollection, diff: CatalogDiff
+    ) -> None:
+        """Told once reload or reload_source has finished, after any templates."""
+
+
+@dataclass
+class CatalogDiff:
+    """What a reload changed, as (category, name) pairs."""
+
+    added: list[tuple[str, str]] = field(default_factory=list)
+    changed: list[tuple[str, str]] = field(default_factory=list)
+    removed: list[tuple[str, str]] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.changed or self.removed)
+
+
 @dataclass
 class SpellComponentCollection:
     # Remember that order will determine arg input. Keep init_data 1st.
@@ -96,119 +812,623 @@ class SpellComponentCollection:
         default_factory=dict
     )  # Any due to some types require int
     components: list[SpellComponent] = field(default_factory=list)
+    # Lookup indexes over components, caught up with appends on each lookup.
+    _index: dict[tuple[Type[SpellComponent], str], SpellComponent] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    _by_type: dict[Type[SpellComponent], list[SpellComponent]] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    _by_name: dict[str, list[SpellComponent]] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    _indexed: int = field(default=0, init=False, repr=False, compare=False)
+    _indexed_list: Optional[list[SpellComponent]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    # Lazily read catalog, and the categories of it already fully built
+    source: Optional[CatalogSource] = field(default=None, repr=False, compare=False)
+    _loaded: set[str] = field(
+        default_factory=set, init=False, repr=False, compare=False
+    )
+    listeners: list[SpellComponentCollectionListener] = field(
+        default_factory=list, repr=False, compare=False
+    )
 
     def __post_init__(self) -> None:
         if self.init_data:
             self.load_init_data()
 
+    @classmethod
+    def from_file(cls, filepath: str, lazy: bool = True) -> SpellComponentCollection:
+        """Open a JSON catalog, or a binary one made by compile_catalog.
+
+        A lazy collection reads the file on demand and only builds components the
+        first time get, get_by_type or get_by_name touch them.
+        """
+        source = open_catalog(filepath)
+        if isinstance(source, StreamingCatalog) and not lazy:
+            return cls(load_data(filepath))
+        collection = cls(source=source)
+        if not lazy:
+            collection.get_by_type(SpellComponent)
+        return collection
+
     def load_init_data(self):
-        for component in self.init_data[
-            "Elements"
-        ]:  # TODO: reduce duplication pythonic way
-            self.components.append(
-                Element(
-                    name=component["name"],
-                    x=component["x"],
-                    desc=component["desc"],
-                    formula=component["formula"],
-                )
-            )
-        for component in self.init_data["Range"]:
-            self.components.append(
-                Range(
-                    name=component["name"],
-                    x=component["x"],
-                    desc=component["desc"],
-                    formula=component["formula"],
-                )
-            )
-        for component in self.init_data["Shape"]:
-            self.components.append(
-                Shape(
-                    name=component["name"],
-                    x=component["x"],
-                    desc=component["desc"],
-                    formula=component["formula"],
-                )
-            )
-        for component in self.init_data["Modifiers"]:
-            self.components.append(
-                Modifier(
-                    name=component["name"],
-                    x=component["x"],
-                    desc=component["desc"],
-                    formula=component["formula"],
-                )
-            )
+        for category, component_type in CATEGORIES.items():
+            for component in self.init_data[category]:
+                self.components.append(make_component(component_type, component))
 
-    def get(self, component_type: Type[SpellComponent], name: str) -> SpellComponent:
-        filtered = [
-            x
-            for x in self.components
-            if isinstance(x, component_type) and x.name.lower() == name.lower()
-        ]
-        return filtered[0]
+    def _load_from_source(
+        self, component_type: Type[SpellComponent], name: Optional[str] = None
+    ) -> None:
+        if self.source is None:
+            return
+        self._sync_index()
+        for category, category_type in CATEGORIES.items():
+            if category in self._loaded or not issubclass(
+                category_type, component_type
+            ):
+                continue
+            if name is None:
+                records = self.source.records(category)
+            else:
+                record = self.source.find(category, name)
+                records = [record] if record is not None else []
+            for record in records:
+                if (category_type, record["name"].casefold()) not in self._index:
+                    self.components.append(make_component(category_type, record))
+                    formula = record["formula"]
+                    if "program" in record and formula not in formula_cache.compiled:
+                        formula_cache.prime(formula, decode_formula(record["program"]))
+            if name is None:
+                self._loaded.add(category)
+            self._sync_index()
+
+    def _sync_index(self) -> None:
+        if self.components is not self._indexed_list or self._indexed > len(
+            self.components
+        ):
+            self._index.clear()
+            self._by_type.clear()
+            self._by_name.clear()
+            self._indexed = 0
+            self._indexed_list = self.components
+        for position in range(self._indexed, len(self.components)):
+            component = self.components[position]
+            object.__setattr__(component, "_frozen", True)
+            key = component.name.casefold()
+            self._index.setdefault((type(component), key), component)
+            self._by_type.setdefault(type(component), []).append(component)
+            self._by_name.setdefault(key, []).append(component)
+        if self.listeners:
+            for component in self.components[self._indexed :]:
+                for listener in self.listeners:
+                    listener.component_added(self, component)
+        self._indexed = len(self.components)
+
+    def reload(self, data: dict[str, list[dict[str, Any]]]) -> CatalogDiff:
+        """Bring the components in line with a new catalog, such as load_data returns.
+
+        Templates whose record changed are updated in place, so spells using them see
+        the new formula, units and desc without being rebuilt. Instances keep their
+        own x. Records not loaded before are added, and templates missing from data
+        are dropped, though spells already holding them keep them.
+        """
+        self._sync_index()
+        diff = CatalogDiff()
+        seen = set()
+        for category, component_type in CATEGORIES.items():
+            for record in data.get(category, []):
+                key = (component_type, record["name"].casefold())
+                if key in seen:
+                    continue  # Only the first of a name is ever looked up
+                seen.add(key)
+                template = self._index.get(key)
+                if template is None:
+                    self.components.append(make_component(component_type, record))
+                    diff.added.append((category, record["name"]))
+                elif update_component(template, record):
+                    diff.changed.append((category, record["name"]))
+        for key, template in list(self._index.items()):
+            if key not in seen:
+                self._remove(template)
+                diff.removed.append((CATEGORY_NAMES[key[0]], template.name))
+        self.init_data = data
+        self._sync_index()
+        for listener in list(self.listeners):
+            listener.catalog_reloaded(self, diff)
+        return diff
+
+    def reload_source(self, source: CatalogSource) -> CatalogDiff:
+        """Like reload, for a lazy collection now reading from source.
+
+        Only templates already built are compared, the rest are read from source
+        when first looked up.
+        """
+        self._sync_index()
+        if self.source is not None and self.source is not source:
+            self.source.close()
+        self.source = source
+        diff = CatalogDiff()
+        for (component_type, _), template in list(self._index.items()):
+            category = CATEGORY_NAMES[component_type]
+            record = source.find(category, template.name)
+            if record is None:
+                self._remove(template)
+                diff.removed.append((category, template.name))
+            elif update_component(template, record):
+                diff.changed.append((category, record["name"]))
+        for category in self._loaded:
+            component_type = CATEGORIES[category]
+            for record in source.records(category):
+                if (component_type, record["name"].casefold()) not in self._index:
+                    self.components.append(make_component(component_type, record))
+                    diff.added.append((category, record["name"]))
+                    self._sync_index()
+        for listener in list(self.listeners):
+            listener.catalog_reloaded(self, diff)
+        return diff
+
+    def reload_file(self, filepath: str) -> CatalogDiff:
+        """Reload from a catalog file, keeping the collection lazy if it was."""
+        if self.source is not None:
+            return self.reload_source(open_catalog(filepath))
+        return self.reload(load_data(filepath))
+
+    def _remove(self, template: SpellComponent) -> None:
+        key = template.name.casefold()
+        for components in [
+            self.components,
+            self._by_type[type(template)],
+            self._by_name[key],
+        ]:
+            # By identity, as another template may compare equal
+            del components[next(i for i, x in enumerate(components) if x is template)]
+        if self._index.get((type(template), key)) is template:
+            del self._index[(type(template), key)]
+        self._indexed -= 1
+        for listener in self.listeners:
+            listener.component_removed(self, template)
+
+    def get(self, component_type: Type[SpellComponent], name: str) -> ComponentInstance:
+        """A new instance of the named template, to customize and add to one spell."""
+        return self.get_template(component_type, name).instance()
+
+    def get_template(
+        self, component_type: Type[SpellComponent], name: str
+    ) -> SpellComponent:
+        self._sync_index()
+        key = name.casefold()
+        component = self._index.get((component_type, key))
+        if component is not None:
+            return component
+        self._load_from_source(component_type, name)
+        for component in self._by_name.get(key, []):  # subclasses of component_type
+            if isinstance(component, component_type):
+                return component
+        raise IndexError(f"No {component_type.__name__} named {name}")
 
     def get_by_type(self, component_type: Type[SpellComponent]) -> list[SpellComponent]:
+        self._load_from_source(component_type)
+        self._sync_index()
+        types = [x for x in self._by_type if issubclass(x, component_type)]
+        if len(types) == 1:
+            return list(self._by_type[types[0]])
+        if not types:
+            return []
         filtered = [x for x in self.components if isinstance(x, component_type)]
         return filtered
 
     def get_by_name(self, name: str) -> list[SpellComponent]:
-        filtered = [x for x in self.components if x.name.lower() == name.lower()]
-        return filtered
+        self._load_from_source(SpellComponent, name)
+        self._sync_index()
+        return list(self._by_name.get(name.casefold(), []))
+
+    def dc_table(
+        self, xs: Any, component_type: Type[SpellComponent] = SpellComponent
+    ) -> numpy.ndarray:
+        """DCs of every component of component_type at each x, one row per component.
+
+        Rows follow get_by_type order. Each distinct formula is evaluated only once.
+        """
+        import numpy
+
+        xs = numpy.asarray(xs)
+        components = self.get_by_type(component_type)
+        table = numpy.empty((len(components), xs.size), dtype=numpy.int64)
+        rows_by_formula: dict[str, list[int]] = {}
+        for row, component in enumerate(components):
+            rows_by_formula.setdefault(component.formula, []).append(row)
+        for formula, rows in rows_by_formula.items():
+            table[rows] = Calc.evaluate_many(formula, xs.ravel())
+        return table
+
+
+@dataclass(eq=False)
+class CatalogRegistry(SpellComponentCollectionListener):
+    """SpellComponentCollections shared by every SpellBook using the same catalog.
+
+    Books treat a shared collection as read only. Customizing a component only ever
+    changes the book's own ComponentInstance, never the shared template, so each
+    book costs its instances rather than a catalog of its own. A collection is
+    dropped once no book holds it, and moved to the key of its new catalog when
+    reloaded.
+    """
+
+    collections: WeakValueDictionary[Any, SpellComponentCollection] = field(
+        default_factory=WeakValueDictionary, repr=False
+    )
+
+    def _key(self, data: dict[str, list[dict[str, Any]]]) -> str:
+        import hashlib
+
+        return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+    def _share(self, key: Any, collection: SpellComponentCollection) -> None:
+        self.collections[key] = collection
+        if self not in collection.listeners:
+            collection.listeners.append(self)
+
+    def get(self, data: dict[str, list[dict[str, Any]]]) -> SpellComponentCollection:
+        """The shared collection of catalog data, such as load_data returns."""
+        key = self._key(data)
+        collection = self.collections.get(key)
+        if collection is None:
+            collection = SpellComponentCollection(data)
+            self._share(key, collection)
+        return collection
+
+    def from_file(self, filepath: str, lazy: bool = True) -> SpellComponentCollection:
+        """The shared collection of a catalog file, as it is now on disk."""
+        stat = os.stat(filepath)
+        key = (os.path.realpath(filepath), stat.st_mtime_ns, stat.st_size, lazy)
+        collection = self.collections.get(key)
+        if collection is None:
+            collection = SpellComponentCollection.from_file(filepath, lazy)
+            self._share(key, collection)
+        return collection
+
+    def catalog_reloaded(
+        self, collection: SpellComponentCollection, diff: CatalogDiff
+    ) -> None:
+        # Its old key names a catalog it no longer holds. A lazy collection can't be
+        # keyed by its data without reading all of it, so is no longer shared.
+        for key in [k for k, v in self.collections.items() if v is collection]:
+            del self.collections[key]
+        if collection.source is None:
+            key = self._key(collection.init_data)
+            if key not in self.collections:
+                self.collections[key] = collection
+
+    def __len__(self) -> int:
+        return len(self.collections)
+
+
+catalog_registry = CatalogRegistry()
 
 
 @dataclass
 class Spell:
     name: str
-    components: list[SpellComponent] = field(default_factory=list)
+    components: list[SpellComponent | ComponentInstance] = field(default_factory=list)
+    # Total dc of the components as of _dc_key, their ids, xs and formulas.
+    # Recomputed on reading dc when the key differs, however the components were
+    # changed.
+    _dc: int = field(default=0, init=False, repr=False, compare=False)
+    _dc_key: Optional[tuple[tuple[Any, ...], ...]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    # The components _dc_key was taken from, kept so their ids can't be reused
+    _dc_components: tuple[SpellComponent | ComponentInstance, ...] = field(
+        default=(), init=False, repr=False, compare=False
+    )
+    # SpellBooks holding this spell, by id, told when a component is customized.
+    _books: Optional[WeakValueDictionary[int, SpellBook]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
 
-    def add_component(self, component: SpellComponent) -> None:
+    def __post_init__(self) -> None:
+        self._watch_components()  # dc is left until read, it may not evaluate
+
+    def add_component(self, component: SpellComponent | ComponentInstance) -> None:
         self.components.append(component)
+        component._watch(self)
+
+    def _component_changed(self, component: SpellComponent | ComponentInstance) -> None:
+        if not any(x is component for x in self.components):
+            return
+        for book in list(self._books.values()) if self._books else []:
+            book._spell_changed(self, component)
+
+    def _template_changed(self, template: SpellComponent) -> None:
+        affected = [
+            x
+            for x in self.components
+            if x is template or getattr(x, "template", None) is template
+        ]
+        if not affected:
+            return
+        for book in list(self._books.values()) if self._books else []:
+            book._template_changed(self, template)
+
+    def _components_key(
+        self, components: Optional[Sequence[SpellComponent | ComponentInstance]] = None
+    ) -> tuple[tuple[Any, ...], ...]:
+        components = self.components if components is None else components
+        return (
+            tuple(map(id, components)),
+            tuple(x.x for x in components),
+            tuple(x.formula for x in components),
+        )
+
+    def _watch_components(self) -> None:
+        for component in self.components:
+            component._watch(self)
+
+    def _recompute_dc(self) -> None:
+        # Keyed before summing, so a change made meanwhile is seen on the next read
+        # rather than stored under a key it doesn't match.
+        components = tuple(self.components)
+        key = self._components_key(components)
+        self._watch_components()
+        self._dc = sum(x.dc for x in components)
+        self._dc_components = components
+        self._dc_key = key
 
     @property
     def dc(self):
-        return sum([x.dc for x in self.components])
+        if self._dc_key != self._components_key():
+            self._recompute_dc()
+        return self._dc
+
+    def largest_x(
+        self,
+        component: SpellComponent | ComponentInstance | int,
+        dc: int,
+        low: int = 0,
+        high: Optional[int] = None,
+    ) -> Optional[int]:
+        """Largest x for one component, by index or itself, keeping the spell's dc
+        at or under dc. The other components stay as they are, so their dc is folded
+        into a constant and the component's formula is solved as in Calc.solve."""
+        if isinstance(component, int):
+            component = self.components[component]
+        occurrences = sum(1 for x in self.components if x is component)
+        if not occurrences:
+            raise IndexError(f"{component.name} is not a component of {self.name}")
+        fixed = self.dc - occurrences * component.dc
+        return component.largest_x((dc - fixed) // occurrences, low, high)
+
+    def __getstate__(self) -> dict[str, Any]:
+        state = self.__dict__.copy()
+        state["_books"] = None  # Weak references can't be pickled
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._watch_components()  # Components lost their watchers when pickled
+
+
+class SpellBookListener:
+    """Follows changes to a SpellBook. Override the changes you care about."""
+
+    def spell_added(self, book: SpellBook, spell: Spell) -> None:
+        pass
+
+    def spell_removed(self, book: SpellBook, spell: Spell) -> None:
+        pass
+
+    def spell_changed(
+        self,
+        book: SpellBook,
+        spell: Spell,
+        component: SpellComponent | ComponentInstance,
+    ) -> None:
+        """A component of spell was customized."""
+
+    def template_changed(
+        self, book: SpellBook, spell: Spell, template: SpellComponent
+    ) -> None:
+        """A catalog reload changed a template spell uses, its own x left as it was."""
 
 
 @dataclass
 class SpellBook:
     name: str
-    spells: list[Spell] = field(default_factory=list)
+    spells: dict[str, Spell] = field(default_factory=dict)  # Insertion ordered by name
     components: SpellComponentCollection = field(
         default_factory=SpellComponentCollection
     )
+    listeners: list[SpellBookListener] = field(
+        default_factory=list, repr=False, compare=False
+    )
+
+    def __post_init__(self) -> None:
+        if not isinstance(self.spells, dict):  # Still accept a list of spells
+            spells, self.spells = self.spells, {}
+            for spell in spells:
+                self.add_spell(spell)
+        else:
+            for spell in self.spells.values():
+                self._watch(spell)
+
+    def _watch(self, spell: Spell) -> None:
+        if spell._books is None:
+            spell._books = WeakValueDictionary()
+        spell._books[id(self)] = self
+
+    def _spell_changed(
+        self, spell: Spell, component: SpellComponent | ComponentInstance
+    ) -> None:
+        for listener in self.listeners:
+            listener.spell_changed(self, spell, component)
+
+    def _template_changed(self, spell: Spell, template: SpellComponent) -> None:
+        for listener in self.listeners:
+            listener.template_changed(self, spell, template)
 
     def spell_list(self) -> list[str]:
-        return [spell.name for spell in self.spells]
+        return list(self.spells)
 
     def detailed_spell_list(self) -> list[Spell]:
-        return self.spells
+        return list(self.spells.values())
 
     def add_spell(self, spell: Spell) -> None:
-        if spell.name in self.spell_list():
+        if spell.name in self.spells:
             raise ValueError(f"Spell already in SpellBook {self.name}")
-        self.spells.append(spell)
+        self.spells[spell.name] = spell
+        self._watch(spell)
+        for listener in self.listeners:
+            listener.spell_added(self, spell)
 
     def remove_spell(self, spellname: str) -> None:
-        filtered = [
-            spell_index
-            for spell_index, spell in enumerate(self.spells)
-            if spell.name == spellname
-        ]
-        if filtered and len(filtered) == 1:
-            self.spells.pop(filtered[0])
+        spell = self.spells.pop(spellname, None)
+        if spell is None:
+            return
+        if spell._books is not None:
+            spell._books.pop(id(self), None)
+        for listener in self.listeners:
+            listener.spell_removed(self, spell)
 
     def get_spell(self, spellname: str) -> Spell:
-        filtered = [spell for spell in self.spells if spell.name == spellname]
-        return filtered[0]
+        try:
+            return self.spells[spellname]
+        except KeyError:
+            raise IndexError(f"No spell named {spellname} in SpellBook {self.name}")
 
     def load_components(self, data: dict[str, list[dict[str, str | int]]]):
-        self.components.init_data = data
-        self.components.load_init_data()  # TODO: Find better way, perhaps spellbook must have json?
+        """Use the catalog_registry collection of data, shared with other books."""
+        self.components = catalog_registry.get(data)
+
+
+# Hot paths Instrumentation can count and time, by the name they are reported under.
+INSTRUMENTED = [
+    "Calc.evaluate",
+    "SpellComponent.dc",
+    "ComponentInstance.dc",
+    "SpellComponentCollection.get",
+    "SpellComponentCollection.get_template",
+    "SpellComponentCollection.get_by_type",
+    "SpellComponentCollection.get_by_name",
+    "SpellComponentCollection._load_from_source",
+    "Spell.add_component",
+    "SpellBook.add_spell",
+    "SpellBook.remove_spell",
+    "SpellBook.get_spell",
+    "SpellBook.spell_list",
+    "SpellBook.detailed_spell_list",
+]
+
+
+@dataclass
+class Timing:
+    calls: int = 0
+    seconds: float = 0.0
+
+
+@dataclass
+class Instrumentation:
+    """Counts and times the INSTRUMENTED hot paths while enabled.
+
+    enable() swaps timing wrappers onto the classes and disable() puts the originals
+    back, so nothing is paid while it is off. Times include nested instrumented calls,
+    such as the Calc.evaluate inside SpellComponent.dc.
+    """
+
+    timings: dict[str, Timing] = field(default_factory=dict)
+    _originals: dict[str, Any] = field(default_factory=dict, init=False, repr=False)
+    _cache_start: tuple[int, int] = field(default=(0, 0), init=False, repr=False)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._originals)
+
+    def enable(self) -> None:
+        if self.enabled:
+            return
+        self._cache_start = (formula_cache.hits, formula_cache.misses)
+        for name in INSTRUMENTED:
+            owner_name, attribute = name.split(".")
+            owner = globals()[owner_name]
+            original = owner.__dict__[attribute]
+            self._originals[name] = original
+            setattr(owner, attribute, self._wrap(name, original))
+
+    def disable(self) -> None:
+        for name, original in self._originals.items():
+            owner_name, attribute = name.split(".")
+            setattr(globals()[owner_name], attribute, original)
+        self._originals.clear()
+
+    def reset(self) -> None:
+        for timing in self.timings.values():
+            timing.calls, timing.seconds = 0, 0.0
+        self._cache_start = (formula_cache.hits, formula_cache.misses)
+
+    def _wrap(self, name: str, original: Any) -> Any:
+        if isinstance(original, property):
+            return property(self._timed(name, original.fget), original.fset)
+        if isinstance(original, classmethod):
+            return classmethod(self._timed(name, original.__func__))
+        return self._timed(name, original)
+
+    def _timed(self, name: str, function: Callable) -> Callable:
+        timing = self.timings.setdefault(name, Timing())
+        clock = time.perf_counter
+
+        @wraps(function)
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timing.calls += 1
+                timing.seconds += clock() - start
+
+        return timed
+
+    def snapshot(self) -> dict[str, Any]:
+        """Calls and seconds per hot path that ran, and formula_cache hit rate."""
+        hits = formula_cache.hits - self._cache_start[0]
+        misses = formula_cache.misses - self._cache_start[1]
+        return {
+            "timings": {
+                name: {"calls": x.calls, "seconds": x.seconds}
+                for name, x in self.timings.items()
+                if x.calls
+            },
+            "formula_cache": {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": hits / (hits + misses) if hits + misses else None,
+                "size": len(formula_cache),
+            },
+        }
+
+    def log(self, level: str = "DEBUG") -> None:
+        from loguru import logger
+
+        snapshot = self.snapshot()
+        for name, timing in snapshot["timings"].items():
+            logger.log(
+                level,
+                f"{name}: {timing['calls']} calls in {timing['seconds']:.6f}s",
+            )
+        cache = snapshot["formula_cache"]
+        logger.log(
+            level,
+            f"formula_cache: {cache['hits']} hits, {cache['misses']} misses,"
+            f" {cache['size']} formulas",
+        )
+
+
+instrumentation = Instrumentation()
 
 
 if __name__ == "__main__":
+    from loguru import logger
+
     # Usage example
 
     # Data setup
@@ -0,0 +1,255 @@
+"""Prefix and fuzzy search over component and spell names, for autocomplete."""
+from __future__ import annotations  # For using | with type hints
+
+import heapq
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
+from typing import Hashable, Iterable, Optional
+
+from kbr_char.magic import (
+    CATEGORY_NAMES,
+    Spell,
+    SpellBook,
+    SpellBookListener,
+    SpellComponent,
+    SpellComponentCollection,
+    SpellComponentCollectionListener,
+)
+
+SPELL = "Spell"  # Kind of the entries of spells, components use their category
+LAST_CHARACTER = chr(0x10FFFF)  # Sorts after any character a name continues with
+FUZZY_VISITS = 32  # Prefixes a fuzzy search walks before settling for what it found
+
+
+@dataclass(frozen=True)
+class NameMatch:
+    name: str
+    entry: Hashable
+    distance: int  # Edits from the query to the start of the name, 0 for a prefix
+
+
+def default_distance(query: str) -> int:
+    """Typos tolerated in a query, more for longer ones."""
+    return 0 if len(query) < 4 else 1 if len(query) < 8 else 2
+
+
+@dataclass(eq=False)
+class NameIndex(SpellBookListener, SpellComponentCollectionListener):
+    """Ranked prefix and fuzzy search of names, each standing for an entry.
+
+    Names are kept casefolded in a sorted list. The names sharing a prefix form one
+    run of it, found by bisection, so the list doubles as a trie: the children of a
+    prefix are the runs for each next character. A sorted list per length of name
+    gives the shortest names of a run without reading all of it. Fuzzy search walks
+    the trie with one row of the edit distance table per prefix, closest prefixes
+    first, and stops once limit names are found that nothing left to walk could
+    beat.
+
+    Watching a SpellComponentCollection or SpellBook keeps the index up to date,
+    with entries (category, name) for components and ("Spell", name) for spells.
+    """
+
+    # Casefolded names in order, and the id of the entry at each position
+    _keys: list[str] = field(default_factory=list, repr=False)
+    _order: list[int] = field(default_factory=list, repr=False)
+    _entries: dict[int, tuple[str, Hashable]] = field(default_factory=dict, repr=False)
+    _ids: dict[tuple[str, Hashable], int] = field(default_factory=dict, repr=False)
+    # The same again for each length of name
+    _by_length: dict[int, tuple[list[str], list[int]]] = field(
+        default_factory=dict, repr=False
+    )
+    _next_id: int = field(default=0, repr=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _file(self, name: str, entry: Hashable) -> Optional[tuple[str, int]]:
+        if (name, entry) in self._ids:
+            return None
+        identifier = self._next_id
+        self._next_id += 1
+        self._entries[identifier] = (name, entry)
+        self._ids[(name, entry)] = identifier
+        return name.casefold(), identifier
+
+    def add(self, name: str, entry: Hashable = None) -> None:
+        filed = self._file(name, entry)
+        if filed is not None:
+            _insert(self._keys, self._order, *filed)
+            _insert(*self._by_length.setdefault(len(name), ([], [])), *filed)
+
+    def update(self, names: Iterable[tuple[str, Hashable]]) -> None:
+        """Add many (name, entry) pairs, sorting once rather than per name."""
+        filed = [self._file(name, entry) for name, entry in names]
+        merged = sorted(
+            list(zip(self._keys, self._order)) + [x for x in filed if x is not None]
+        )
+        self._keys = [x[0] for x in merged]
+        self._order = [x[1] for x in merged]
+        self._by_length = {}
+        for key, identifier in merged:
+            name = self._entries[identifier][0]
+            keys, order = self._by_length.setdefault(len(name), ([], []))
+            keys.append(key)
+            order.append(identifier)
+
+    def remove(self, name: str, entry: Hashable = None) -> None:
+        identifier = self._ids.pop((name, entry), None)
+        if identifier is None:
+            return
+        del self._entries[identifier]
+        _delete(self._keys, self._order, name.casefold(), identifier)
+        keys, order = self._by_length[len(name)]
+        _delete(keys, order, name.casefold(), identifier)
+        if not keys:
+            del self._by_length[len(name)]
+
+    def _run_end(self, prefix: str, low: int, high: int) -> int:
+        """End of the run of names starting with prefix, which begins at low."""
+        return bisect_left(self._keys, prefix + LAST_CHARACTER, low, high)
+
+    def _shortest(self, prefix: str, limit: int) -> list[int]:
+        """Up to limit names starting with prefix, shortest first, then in order."""
+        found: list[int] = []
+        for length in sorted(self._by_length):
+            keys, order = self._by_length[length]
+            low = bisect_left(keys, prefix)
+            high = bisect_left(keys, prefix + LAST_CHARACTER, low)
+            found += order[low : min(high, low + limit - len(found))]
+            if len(found) >= limit:
+                break
+        return found
+
+    def prefix(self, query: str, limit: int = 10) -> list[NameMatch]:
+        """Names starting with query, shortest first."""
+        found = self._shortest(query.casefold(), limit)
+        return self._ranked({x: 0 for x in found}, limit)
+
+    def fuzzy(
+        self,
+        query: str,
+        limit: int = 10,
+        max_distance: Optional[int] = None,
+        visits: Optional[int] = FUZZY_VISITS,
+    ) -> list[NameMatch]:
+        """Names whose start is within max_distance typos of query, closest first.
+
+        As prefixes are walked closest first, stopping after visits of them keeps the
+        closest names found so far, but may miss some when fewer than limit are that
+        close. None walks until nothing left could rank higher, giving the same
+        names as ranking every name.
+        """
+        folded = query.casefold()
+        if max_distance is None:
+            max_distance = default_distance(folded)
+        too_far = max_distance + 1
+        distances: dict[int, int] = {}
+        # Prefixes by the fewest typos any name under them could have, deepest
+        # first, so the closest names are found first and the walk can stop early.
+        row = [min(x, too_far) for x in range(len(folded) + 1)]
+        heap = [(0, 0, "", 0, len(self._keys), row)]
+        while heap:
+            bound, _, prefix, low, high, row = heapq.heappop(heap)
+            if sum(1 for x in distances.values() if x < bound) >= limit:
+                # Nothing left can beat what was found. A name as close as bound
+                # could still rank first by being shorter, so those don't count.
+                break
+            if visits is not None:
+                if visits <= 0:
+                    break
+                visits -= 1
+            if row[-1] <= max_distance:
+                # The whole run is this close, longer prefixes may be closer still
+                for identifier in self._shortest(prefix, limit):
+                    distances[identifier] = min(
+                        row[-1], distances.get(identifier, row[-1])
+                    )
+                if row[-1] == bound:
+                    continue
+            depth = len(prefix)
+            while low < high and len(self._keys[low]) == depth:
+                low += 1  # Names that are just the prefix have no next character
+            while low < high:
+                character = self._keys[low][depth]
+                child = prefix + character
+                end = self._run_end(child, low, high)
+                # Cells more than max_distance off the diagonal can never be in
+                # reach, so only the band around it is worked out.
+                next_row = [too_far] * len(row)
+                next_row[0] = min(depth + 1, too_far)
+                for position in range(
+                    max(1, depth + 1 - max_distance),
+                    min(len(folded), depth + 1 + max_distance) + 1,
+                ):
+                    next_row[position] = min(
+                        row[position] + 1,
+                        next_row[position - 1] + 1,
+                        row[position - 1] + (folded[position - 1] != character),
+                        too_far,
+                    )
+                least = min(next_row)
+                if least <= max_distance:
+                    heapq.heappush(heap, (least, -depth - 1, child, low, end, next_row))
+                low = end
+        return self._ranked(distances, limit)
+
+    def search(self, query: str, limit: int = 10) -> list[NameMatch]:
+        """Prefix matches, then fuzzy ones to fill up to limit."""
+        found = self.prefix(query, limit)
+        if len(found) < limit:
+            seen = {(x.name, x.entry) for x in found}
+            found += [
+                x for x in self.fuzzy(query, limit) if (x.name, x.entry) not in seen
+            ][: limit - len(found)]
+        return found
+
+    def _ranked(self, distances: dict[int, int], limit: int) -> list[NameMatch]:
+        def rank(identifier: int) -> tuple[int, int, str]:
+            name = self._entries[identifier][0]
+            return distances[identifier], len(name), name.casefold()
+
+        ranked = sorted(distances, key=rank)
+        return [NameMatch(*self._entries[x], distances[x]) for x in ranked[:limit]]
+
+    def watch_collection(self, collection: SpellComponentCollection) -> None:
+        """Index every component of collection, reading a lazy one in full."""
+        self.update(
+            (x.name, (CATEGORY_NAMES.get(type(x)), x.name))
+            for x in collection.get_by_type(SpellComponent)
+        )
+        collection.listeners.append(self)
+
+    def watch_book(self, book: SpellBook) -> None:
+        self.update((x, (SPELL, x)) for x in book.spell_list())
+        book.listeners.append(self)
+
+    def component_added(
+        self, collection: SpellComponentCollection, component: SpellComponent
+    ) -> None:
+        self.add(component.name, (CATEGORY_NAMES.get(type(component)), component.name))
+
+    def component_removed(
+        self, collection: SpellComponentCollection, component: SpellComponent
+    ) -> None:
+        entry = (CATEGORY_NAMES.get(type(component)), component.name)
+        self.remove(component.name, entry)
+
+    def spell_added(self, book: SpellBook, spell: Spell) -> None:
+        self.add(spell.name, (SPELL, spell.name))
+
+    def spell_removed(self, book: SpellBook, spell: Spell) -> None:
+        self.remove(spell.name, (SPELL, spell.name))
+
+
+def _insert(keys: list[str], order: list[int], key: str, identifier: int) -> None:
+    position = bisect_right(keys, key)
+    keys.insert(position, key)
+    order.insert(position, identifier)
+
+
+def _delete(keys: list[str], order: list[int], key: str, identifier: int) -> None:
+    position = bisect_left(keys, key)
+    while order[position] != identifier:
+        position += 1  # Past others with the same name
+    del keys[position]
+    del order[position]
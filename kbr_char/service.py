@@ -0,0 +1,375 @@
+"""Local HTTP/JSON service answering spell DC requests."""
+from __future__ import annotations  # For using | with type hints
+
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+from urllib.parse import unquote
+
+from kbr_char.magic import (
+    CatalogDiff,
+    ComponentInstance,
+    Spell,
+    SpellBook,
+    SpellBookListener,
+    SpellComponent,
+    SpellComponentCollection,
+    SpellComponentCollectionListener,
+    spell_from_dict,
+    spell_to_dict,
+)
+
+CACHE_SIZE = 4096
+MAX_BODY = 1 << 20
+
+REASONS = {
+    200: "OK",
+    201: "Created",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+@dataclass(eq=False)
+class DCService(SpellBookListener, SpellComponentCollectionListener):
+    """Serves a SpellBook over HTTP/JSON.
+
+        GET    /spells                          names of the spells in the book
+        GET    /spells/<name>                   a spell with its components and dc
+        POST   /spells                          add a spell, given as spell_to_dict
+        DELETE /spells/<name>                   remove a spell
+        PUT    /spells/<name>/components/<i>    customize a component, {"x": ...}
+        POST   /dc                              dc of a spell without adding it
+
+    The book is only ever touched from one worker thread, so requests never race
+    each other. Identical reads that arrive while one is being evaluated wait for
+    that evaluation rather than starting their own, and rendered reads are cached
+    until the book reports a change to the spells they show, or its catalog is
+    reloaded.
+    """
+
+    book: SpellBook
+    host: str = "127.0.0.1"
+    port: int = 8080
+    cache_size: int = CACHE_SIZE
+    evaluations: int = 0
+    coalesced: int = 0
+    cache_hits: int = 0
+    _cache: OrderedDict[tuple, bytes] = field(
+        default_factory=OrderedDict, init=False, repr=False
+    )
+    _in_flight: dict[tuple, asyncio.Future] = field(
+        default_factory=dict, init=False, repr=False
+    )
+    # Bumped on every invalidation, so reads begun before a change are not cached.
+    _generation: int = field(default=0, init=False, repr=False)
+    _executor: Optional[ThreadPoolExecutor] = field(
+        default=None, init=False, repr=False
+    )
+    _loop: Optional[asyncio.AbstractEventLoop] = field(
+        default=None, init=False, repr=False
+    )
+    _server: Optional[asyncio.AbstractServer] = field(
+        default=None, init=False, repr=False
+    )
+
+    async def start(self) -> asyncio.AbstractServer:
+        self._loop = asyncio.get_running_loop()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self.book.listeners.append(self)
+        self.book.components.listeners.append(self)
+        self._server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]  # When port was 0
+        return self._server
+
+    async def serve_forever(self) -> None:
+        server = self._server or await self.start()
+        async with server:
+            await server.serve_forever()
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self in self.book.listeners:
+            self.book.listeners.remove(self)
+        if self in self.book.components.listeners:
+            self.book.components.listeners.remove(self)
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY:
+                    status, body = 413, _error("Request body too large")
+                else:
+                    data = await reader.readexactly(length) if length else b""
+                    status, body = await self.respond(method, target, data)
+                keep_alive = (
+                    version == "HTTP/1.1"
+                    and headers.get("connection", "").lower() != "close"
+                )
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                    "\r\n".encode("latin-1") + body
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass  # Client went away or sent something that is not HTTP
+        finally:
+            writer.close()
+
+    async def respond(self, method: str, target: str, data: bytes) -> tuple[int, bytes]:
+        """Status and JSON body for a request, HTTP aside."""
+        parts = [unquote(x) for x in target.split("?")[0].strip("/").split("/")]
+        try:
+            payload = json.loads(data) if data else None
+            if parts == ["spells"]:
+                routes = {
+                    "GET": (200, lambda: self._read(("spells",), self._spell_list)),
+                    "POST": (201, lambda: self._write(self._add_spell, payload)),
+                }
+            elif len(parts) == 2 and parts[0] == "spells":
+                key = ("spell", parts[1])
+                routes = {
+                    "GET": (200, lambda: self._read(key, self._spell, parts[1])),
+                    "DELETE": (200, lambda: self._write(self._remove_spell, parts[1])),
+                }
+            elif len(parts) == 4 and parts[::2] == ["spells", "components"]:
+                arguments = (parts[1], int(parts[3]), payload and payload["x"])
+                routes = {
+                    "PUT": (200, lambda: self._write(self._customize, *arguments))
+                }
+            elif parts == ["dc"]:
+                key = ("dc", json.dumps(payload, sort_keys=True))
+                routes = {"POST": (200, lambda: self._read(key, self._dc, payload))}
+            else:
+                raise HTTPError(404, f"No route for {target}")
+            if method not in routes:
+                raise HTTPError(405, f"{method} not allowed on {target}")
+            status, route = routes[method]
+            return status, await route()
+        except HTTPError as error:
+            return error.status, _error(str(error))
+        except IndexError as error:
+            return 404, _error(str(error))
+        except (
+            ArithmeticError,  # Such as 1/x at x=0
+            KeyError,
+            RecursionError,
+            TypeError,
+            ValueError,
+        ) as error:
+            return 400, _error(f"Bad request: {error!r}")
+        except Exception as error:  # Still answer, rather than drop the connection
+            return 500, _error(f"Internal error: {error!r}")
+
+    async def _read(self, key: tuple, function: Callable, *args: Any) -> bytes:
+        """Rendered result of function, cached and coalesced under key."""
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.cache_hits += 1
+            return cached
+        generation = self._generation
+        in_flight_key = (generation, key)
+        future = self._in_flight.get(in_flight_key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            self.evaluations += 1
+            future = self._loop.run_in_executor(self._executor, function, *args)
+            self._in_flight[in_flight_key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(in_flight_key))
+        body = await asyncio.shield(future)
+        if generation == self._generation:
+            self._cache[key] = body
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return body
+
+    async def _write(self, function: Callable, *args: Any) -> bytes:
+        return await self._loop.run_in_executor(self._executor, function, *args)
+
+    # The methods below run on the worker thread.
+
+    def _spell_list(self) -> bytes:
+        return _render({"spells": self.book.spell_list()})
+
+    def _spell(self, name: str) -> bytes:
+        spell = self.book.get_spell(name)
+        return _render(dict(spell_to_dict(spell), dc=spell.dc))
+
+    def _dc(self, payload: dict[str, Any]) -> bytes:
+        spell = spell_from_dict(payload, self.book.components)
+        return _render({"name": spell.name, "dc": spell.dc})
+
+    def _add_spell(self, payload: dict[str, Any]) -> bytes:
+        spell = spell_from_dict(payload, self.book.components)
+        try:
+            self.book.add_spell(spell)
+        except ValueError as error:
+            raise HTTPError(409, str(error))
+        return _render({"name": spell.name, "dc": spell.dc})
+
+    def _remove_spell(self, name: str) -> bytes:
+        self.book.get_spell(name)  # 404 rather than a silent no-op
+        self.book.remove_spell(name)
+        return _render({"removed": name})
+
+    def _customize(self, name: str, index: int, x: int) -> bytes:
+        spell = self.book.get_spell(name)
+        spell.components[index].customize(int(x))
+        return _render({"name": spell.name, "dc": spell.dc})
+
+    def _invalidate(self, *keys: tuple) -> None:
+        self._generation += 1
+        for key in keys:
+            self._cache.pop(key, None)
+
+    def _invalidate_kinds(self, *kinds: str) -> None:
+        self._invalidate(*[x for x in self._cache if x[0] in kinds])
+
+    def _changed(self, *keys: tuple) -> None:
+        self._call(self._invalidate, *keys)
+
+    def _call(self, function: Callable, *args: Any) -> None:
+        """Run function on the event loop, which owns the cache."""
+        if self._loop is None or self._loop.is_closed():
+            function(*args)
+        else:
+            self._loop.call_soon_threadsafe(function, *args)
+
+    def spell_added(self, book: SpellBook, spell: Spell) -> None:
+        self._changed(("spells",), ("spell", spell.name))
+
+    def spell_removed(self, book: SpellBook, spell: Spell) -> None:
+        self._changed(("spells",), ("spell", spell.name))
+
+    def spell_changed(
+        self,
+        book: SpellBook,
+        spell: Spell,
+        component: SpellComponent | ComponentInstance,
+    ) -> None:
+        self._changed(("spell", spell.name))
+
+    def template_changed(
+        self, book: SpellBook, spell: Spell, template: SpellComponent
+    ) -> None:
+        self._changed(("spell", spell.name))
+
+    def catalog_reloaded(
+        self, collection: SpellComponentCollection, diff: CatalogDiff
+    ) -> None:
+        if diff:  # Any spell or dc rendered may use a changed template
+            self._call(self._invalidate_kinds, "spell", "dc")
+
+
+def _render(payload: dict[str, Any]) -> bytes:
+    return json.dumps(payload).encode()
+
+
+def _error(message: str) -> bytes:
+    return _render({"error": message})
+
+
+async def _request(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    method: str,
+    path: str,
+    body: bytes = b"",
+) -> tuple[int, bytes]:
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: localhost\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+    )
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if not line.strip():
+            break
+        key, _, value = line.decode("latin-1").partition(":")
+        if key.strip().lower() == "content-length":
+            length = int(value)
+    return status, await reader.readexactly(length)
+
+
+async def load_test(
+    host: str,
+    port: int,
+    requests: list[tuple[str, str, bytes]],
+    total: int = 10000,
+    concurrency: int = 100,
+) -> dict[str, Any]:
+    """Send total requests, cycling through (method, path, body), over concurrency
+    keep-alive connections. Returns the throughput and latency percentiles."""
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+    sent = 0
+
+    async def client() -> None:
+        nonlocal sent
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            while sent < total:
+                method, path, body = requests[sent % len(requests)]
+                sent += 1
+                start = time.perf_counter()
+                status, _ = await _request(reader, writer, method, path, body)
+                latencies.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    seconds = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "seconds": seconds,
+        "requests_per_second": len(latencies) / seconds,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+        "statuses": statuses,
+    }
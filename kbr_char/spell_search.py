@@ -0,0 +1,189 @@
+"""Searching for spells that fit within a DC budget."""
+from __future__ import annotations  # For using | with type hints
+
+import ast
+import heapq
+import multiprocessing
+from dataclasses import dataclass
+from functools import partial
+from typing import Iterator, Optional, Tuple
+
+from kbr_char.magic import (
+    CATEGORIES,
+    Calc,
+    Spell,
+    SpellComponentCollection,
+)
+
+REQUIRED = ["Elements", "Range", "Shape"]
+OPTIONAL = "Modifiers"
+
+Option = Tuple[int, str, str, int]  # dc, category, name, x
+
+
+@dataclass(frozen=True)
+class SpellCandidate:
+    dc: int
+    components: tuple[tuple[str, str, int], ...]  # category, name, x
+
+    def to_spell(self, collection: SpellComponentCollection, name: str) -> Spell:
+        spell = Spell(name)
+        for category, component_name, x in self.components:
+            component = collection.get(CATEGORIES[category], component_name)
+            component.x = x
+            spell.add_component(component)
+        return spell
+
+
+def uses_x(formula: str) -> bool:
+    return any(isinstance(x, ast.Name) for x in ast.walk(ast.parse(formula)))
+
+
+def component_options(
+    collection: SpellComponentCollection,
+    category: str,
+    max_dc: int,
+    x_range: Optional[tuple[int, int]] = None,
+) -> list[Option]:
+    """Every way to use a category's components within max_dc, cheapest first.
+
+    Components use their catalog x. With x_range, components whose formula uses x
+    instead get one option per dc they can reach in that range, each at the largest
+    x for that dc. This assumes formulas never decrease as x grows, so the x for
+    each dc is found by Calc.solve.
+    """
+    options = []
+    for template in collection.get_by_type(CATEGORIES[category]):
+        if x_range is None or not uses_x(template.formula):
+            if template.dc <= max_dc:
+                options.append((template.dc, category, template.name, template.x))
+            continue
+        x, high = x_range
+        compiled = Calc.compile(template.formula)
+        while x <= high:
+            dc = int(compiled(x))
+            if dc > max_dc:
+                break
+            x = Calc.solve(template.formula, dc, x, high)
+            options.append((dc, category, template.name, x))
+            x += 1
+    options.sort()
+    return options
+
+
+def _search(
+    levels: list[list[Option]],
+    modifiers: list[Option],
+    max_modifiers: int,
+    max_dc: int,
+) -> Iterator[tuple[int, tuple[Option, ...]]]:
+    if not all(levels):
+        return
+    # Lowest dc the levels from each depth on can add, to prune against the budget.
+    # Modifiers are optional, so only negative ones can lower it.
+    least = [sum(sorted(x[0] for x in modifiers if x[0] < 0)[:max_modifiers])]
+    for options in reversed(levels):
+        least.insert(0, least[0] + options[0][0])
+    chosen: list[Option] = []
+
+    def required(depth: int, total: int) -> Iterator[tuple[int, tuple[Option, ...]]]:
+        if depth == len(levels):
+            yield from optional(0, total, set())
+            return
+        for option in levels[depth]:
+            if total + option[0] + least[depth + 1] > max_dc:
+                break  # Options are cheapest first, so the rest are over too
+            chosen.append(option)
+            yield from required(depth + 1, total + option[0])
+            chosen.pop()
+
+    def optional(
+        start: int, total: int, names: set[str]
+    ) -> Iterator[tuple[int, tuple[Option, ...]]]:
+        if total <= max_dc:
+            yield total, tuple(chosen)
+        if len(names) == max_modifiers:
+            return
+        for position in range(start, len(modifiers)):
+            option = modifiers[position]
+            if total + option[0] + least[-1] > max_dc:
+                break
+            if option[2] in names:
+                continue  # Already used at another x
+            chosen.append(option)
+            names.add(option[2])
+            yield from optional(position + 1, total + option[0], names)
+            names.discard(option[2])
+            chosen.pop()
+
+    yield from required(0, 0)
+
+
+def _candidate(found: tuple[int, tuple[Option, ...]]) -> SpellCandidate:
+    dc, options = found
+    return SpellCandidate(dc, tuple((x[1], x[2], x[3]) for x in options))
+
+
+def _rank_key(candidate: SpellCandidate) -> tuple:
+    return -candidate.dc, candidate.components
+
+
+def _search_element(
+    element: Option,
+    levels: list[list[Option]],
+    modifiers: list[Option],
+    max_modifiers: int,
+    max_dc: int,
+    limit: Optional[int],
+) -> list[SpellCandidate]:
+    found = (
+        _candidate(x)
+        for x in _search([[element]] + levels, modifiers, max_modifiers, max_dc)
+    )
+    if limit is None:
+        return list(found)
+    return heapq.nsmallest(limit, found, key=_rank_key)
+
+
+def iter_spells(
+    collection: SpellComponentCollection,
+    max_dc: int,
+    max_modifiers: int = 1,
+    x_range: Optional[tuple[int, int]] = None,
+) -> Iterator[SpellCandidate]:
+    """Every Element, Range, Shape and up to max_modifiers Modifiers within max_dc."""
+    levels = [component_options(collection, x, max_dc, x_range) for x in REQUIRED]
+    modifiers = component_options(collection, OPTIONAL, max_dc, x_range)
+    for found in _search(levels, modifiers, max_modifiers, max_dc):
+        yield _candidate(found)
+
+
+def search_spells(
+    collection: SpellComponentCollection,
+    max_dc: int,
+    limit: Optional[int] = None,
+    max_modifiers: int = 1,
+    x_range: Optional[tuple[int, int]] = None,
+    workers: int = 1,
+) -> list[SpellCandidate]:
+    """Spells within max_dc ranked from the highest dc down, the top limit if given.
+
+    With more than one worker, the search is split by element across a process pool.
+    """
+    levels = [component_options(collection, x, max_dc, x_range) for x in REQUIRED]
+    modifiers = component_options(collection, OPTIONAL, max_dc, x_range)
+    search = partial(
+        _search_element,
+        levels=levels[1:],
+        modifiers=modifiers,
+        max_modifiers=max_modifiers,
+        max_dc=max_dc,
+        limit=limit,
+    )
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            found = [x for part in pool.imap(search, levels[0]) for x in part]
+    else:
+        found = [x for element in levels[0] for x in search(element)]
+    found.sort(key=_rank_key)
+    return found if limit is None else found[:limit]
@@ -0,0 +1,323 @@
+"""SQLite storage for SpellBooks and catalogs."""
+from __future__ import annotations  # For using | with type hints
+
+import json
+import sqlite3
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Iterator, Optional, Type
+
+from kbr_char.catalog import CatalogSource
+from kbr_char.magic import (
+    CATEGORY_NAMES,
+    CatalogDiff,
+    ComponentInstance,
+    Spell,
+    SpellBook,
+    SpellComponent,
+    SpellComponentCollection,
+    SpellComponentCollectionListener,
+    component_from_dict,
+    component_to_dict,
+)
+
+BATCH_SIZE = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS components (
+    category TEXT NOT NULL,
+    component_key TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    x INTEGER NOT NULL,
+    formula TEXT NOT NULL,
+    units TEXT,
+    desc TEXT,
+    PRIMARY KEY (category, component_key)
+);
+CREATE TABLE IF NOT EXISTS spells (
+    id INTEGER PRIMARY KEY,
+    book TEXT NOT NULL,
+    name TEXT NOT NULL,
+    dc INTEGER NOT NULL,
+    UNIQUE (book, name)
+);
+CREATE INDEX IF NOT EXISTS spells_by_dc ON spells (book, dc);
+CREATE TABLE IF NOT EXISTS spell_components (
+    spell_id INTEGER NOT NULL REFERENCES spells (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    category TEXT,
+    component_key TEXT NOT NULL,
+    x INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (spell_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS spell_components_by_component
+    ON spell_components (component_key, category, spell_id);
+"""
+
+
+def connect(database: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(database)
+    connection.execute("PRAGMA foreign_keys = ON")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+@dataclass
+class SQLiteCatalog(CatalogSource):
+    """Catalog kept in the components table, as a SpellComponentCollection source."""
+
+    connection: sqlite3.Connection
+
+    def store(self, data: dict[str, list[dict[str, Any]]]) -> None:
+        """Add a catalog such as load_data returns. Repeated names keep the first."""
+        with self.connection:
+            for category, records in data.items():
+                start = self.connection.execute(
+                    "SELECT COUNT(*) FROM components WHERE category = ?", (category,)
+                ).fetchone()[0]
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO components VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        (
+                            category,
+                            record["name"].casefold(),
+                            start + position,
+                            record["name"],
+                            record["x"],
+                            record["formula"],
+                            record.get("units"),
+                            record.get("desc"),
+                        )
+                        for position, record in enumerate(records)
+                    ),
+                )
+
+    @staticmethod
+    def _record(row: tuple) -> dict[str, Any]:
+        name, x, formula, units, desc = row
+        return {"name": name, "x": x, "formula": formula, "units": units, "desc": desc}
+
+    def find(self, category: str, name: str) -> Optional[dict[str, Any]]:
+        row = self.connection.execute(
+            "SELECT name, x, formula, units, desc FROM components"
+            " WHERE category = ? AND component_key = ?",
+            (category, name.casefold()),
+        ).fetchone()
+        return None if row is None else self._record(row)
+
+    def records(self, category: str) -> Iterator[dict[str, Any]]:
+        rows = self.connection.execute(
+            "SELECT name, x, formula, units, desc FROM components"
+            " WHERE category = ? ORDER BY position",
+            (category,),
+        )
+        return (self._record(row) for row in rows)
+
+
+@dataclass
+class SQLiteSpellBook(SpellBook, SpellComponentCollectionListener):
+    """SpellBook whose spells are kept in SQLite rather than in memory.
+
+    Each spell row carries its dc, kept up to date when a component of a spell from
+    get_spell is customized or the catalog is reloaded, so find_spells can filter by
+    dc and by component through indexes instead of scanning every spell. Several
+    books can share one database.
+    """
+
+    database: str = ":memory:"
+    connection: sqlite3.Connection = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self.connection = connect(self.database)
+        super().__post_init__()
+        self.components.listeners.append(self)
+
+    def _stop_listening(self) -> None:
+        # By identity, as another book may compare equal
+        listeners = self.components.listeners
+        listeners[:] = [x for x in listeners if x is not self]
+
+    def load_components(self, data: dict[str, list[dict[str, str | int]]]):
+        self._stop_listening()
+        super().load_components(data)
+        self.components.listeners.append(self)
+
+    def close(self) -> None:
+        self._stop_listening()
+        self.connection.close()
+
+    def _spell_id(self, spellname: str) -> Optional[int]:
+        row = self.connection.execute(
+            "SELECT id FROM spells WHERE book = ? AND name = ?", (self.name, spellname)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def spell_list(self) -> list[str]:
+        rows = self.connection.execute(
+            "SELECT name FROM spells WHERE book = ? ORDER BY id", (self.name,)
+        )
+        return [row[0] for row in rows]
+
+    def detailed_spell_list(self) -> list[Spell]:
+        return [self.get_spell(x) for x in self.spell_list()]
+
+    def add_spell(self, spell: Spell) -> None:
+        self.add_spells([spell])
+
+    def add_spells(self, spells: Iterable[Spell], batch_size: int = BATCH_SIZE) -> None:
+        """Add spells in batches, each batch in one transaction."""
+        batch: list[Spell] = []
+        for spell in spells:
+            batch.append(spell)
+            if len(batch) >= batch_size:
+                self._insert(batch)
+                batch = []
+        if batch:
+            self._insert(batch)
+
+    def _insert(self, spells: list[Spell]) -> None:
+        try:
+            with self.connection:
+                next_id = self.connection.execute(
+                    "SELECT COALESCE(MAX(id), 0) + 1 FROM spells"
+                ).fetchone()[0]
+                ids = range(next_id, next_id + len(spells))
+                self.connection.executemany(
+                    "INSERT INTO spells (id, book, name, dc) VALUES (?, ?, ?, ?)",
+                    (
+                        (spell_id, self.name, spell.name, spell.dc)
+                        for spell_id, spell in zip(ids, spells)
+                    ),
+                )
+                self.connection.executemany(
+                    "INSERT INTO spell_components VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        (
+                            spell_id,
+                            position,
+                            _category(component),
+                            component.name.casefold(),
+                            component.x,
+                            json.dumps(component_to_dict(component)),
+                        )
+                        for spell_id, spell in zip(ids, spells)
+                        for position, component in enumerate(spell.components)
+                    ),
+                )
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Spell already in SpellBook {self.name}")
+        for spell in spells:
+            self._watch(spell)
+            for listener in self.listeners:
+                listener.spell_added(self, spell)
+
+    def remove_spell(self, spellname: str) -> None:
+        spell_id = self._spell_id(spellname)
+        if spell_id is None:
+            return
+        spell = self.get_spell(spellname) if self.listeners else None
+        with self.connection:
+            self.connection.execute("DELETE FROM spells WHERE id = ?", (spell_id,))
+        for listener in self.listeners:
+            listener.spell_removed(self, spell)
+
+    def get_spell(self, spellname: str) -> Spell:
+        spell_id = self._spell_id(spellname)
+        if spell_id is None:
+            raise IndexError(f"No spell named {spellname} in SpellBook {self.name}")
+        spell = self._build(spell_id, spellname)
+        self._watch(spell)
+        return spell
+
+    def _build(self, spell_id: int, spellname: str) -> Spell:
+        rows = self.connection.execute(
+            "SELECT x, data FROM spell_components WHERE spell_id = ? ORDER BY position",
+            (spell_id,),
+        )
+        components = []
+        for x, data in rows:
+            component = component_from_dict(json.loads(data), self.components)
+            component.x = x
+            components.append(component)
+        return Spell(spellname, components)
+
+    def find_spells(
+        self,
+        min_dc: Optional[int] = None,
+        max_dc: Optional[int] = None,
+        component: Optional[str] = None,
+        component_type: Optional[Type[SpellComponent]] = None,
+    ) -> list[str]:
+        """Names of spells with dc in [min_dc, max_dc] that use the named component."""
+        query = "SELECT name FROM spells WHERE book = ?"
+        parameters: list[Any] = [self.name]
+        if min_dc is not None:
+            query += " AND dc >= ?"
+            parameters.append(min_dc)
+        if max_dc is not None:
+            query += " AND dc <= ?"
+            parameters.append(max_dc)
+        if component is not None:
+            query += (
+                " AND id IN (SELECT spell_id FROM spell_components"
+                " WHERE component_key = ?"
+            )
+            parameters.append(component.casefold())
+            if component_type is not None:
+                query += " AND category = ?"
+                parameters.append(CATEGORY_NAMES.get(component_type))
+            query += ")"
+        rows = self.connection.execute(query + " ORDER BY id", parameters)
+        return [row[0] for row in rows]
+
+    def _spell_changed(
+        self, spell: Spell, component: SpellComponent | ComponentInstance
+    ) -> None:
+        spell_id = self._spell_id(spell.name)
+        if spell_id is not None:
+            with self.connection:
+                self.connection.execute(
+                    "UPDATE spells SET dc = ? WHERE id = ?", (spell.dc, spell_id)
+                )
+                self.connection.executemany(
+                    "UPDATE spell_components SET x = ?"
+                    " WHERE spell_id = ? AND position = ?",
+                    (
+                        (component.x, spell_id, position)
+                        for position, x in enumerate(spell.components)
+                        if x is component
+                    ),
+                )
+        super()._spell_changed(spell, component)
+
+    def catalog_reloaded(
+        self, collection: SpellComponentCollection, diff: CatalogDiff
+    ) -> None:
+        """Recompute the stored dc of every spell using a template the reload
+        changed, whether or not it was ever read with get_spell."""
+        spells: dict[int, str] = {}
+        for category, name in diff.changed:
+            rows = self.connection.execute(
+                "SELECT spells.id, spells.name FROM spell_components"
+                " JOIN spells ON spells.id = spell_id"
+                " WHERE component_key = ? AND category = ? AND book = ?",
+                (name.casefold(), category, self.name),
+            )
+            spells.update(rows)
+        updates = []
+        for spell_id, spellname in spells.items():
+            try:
+                updates.append((self._build(spell_id, spellname).dc, spell_id))
+            except (ArithmeticError, IndexError, RecursionError, ValueError):
+                pass  # Such as a template the reload removed, get_spell raises too
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE spells SET dc = ? WHERE id = ?", updates
+            )
+
+
+def _category(component: SpellComponent | ComponentInstance) -> Optional[str]:
+    if isinstance(component, ComponentInstance):
+        return CATEGORY_NAMES.get(component.component_type)
+    return CATEGORY_NAMES.get(type(component))
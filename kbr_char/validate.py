@@ -0,0 +1,181 @@
+"""Checking every formula of a catalog before any spell needs its dc."""
+from __future__ import annotations  # For using | with type hints
+
+import ast
+import json
+import math
+import multiprocessing
+import os
+from dataclasses import asdict, astuple, dataclass
+from functools import partial
+from typing import Any, Iterable, Optional
+
+from kbr_char.catalog import CatalogSource, open_catalog
+from kbr_char.magic import CATEGORIES, Calc, formula_cache
+
+X_RANGE = (0, 100)  # Every x a formula is evaluated at, besides its catalog x
+CHUNK_SIZE = 64
+# Bumped whenever the checks change, so cached results from older checks are redone
+CHECKS_VERSION = 1
+CACHED_CATALOGS = 64  # Results kept in the cache, the oldest dropped first
+
+SUPPORTED_NODES = (ast.Expression, ast.BinOp, ast.Constant, ast.Name, ast.Load)
+
+
+@dataclass(frozen=True)
+class FormulaIssue:
+    category: str
+    name: str
+    formula: str
+    problem: str
+
+
+def check_formula(formula: str, xs: Iterable[int]) -> Optional[str]:
+    """What is wrong with formula, or None when it is supported and gives a finite,
+    non-negative dc at every x in xs."""
+    if not isinstance(formula, str):
+        return f"Formula is not text: {formula!r}"
+    try:
+        tree = ast.parse(formula, mode="eval")
+    except SyntaxError as error:
+        return f"Can't parse: {error.msg}"
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id != "x":
+            return f"Unknown variable: {node.id}"
+        if isinstance(node, ast.Constant) and type(node.value) not in (int, float):
+            return f"Unsupported constant: {node.value!r}"
+        if not isinstance(node, SUPPORTED_NODES) and type(node) not in Calc.op_map:
+            return f"Unsupported syntax: {type(node).__name__}"
+    try:
+        compiled = Calc.compile(formula)
+    except ValueError as error:  # Over the evaluation budget
+        return str(error)
+    for x in xs:
+        try:
+            value = compiled(x)
+        except (ArithmeticError, ValueError) as error:
+            return f"Fails at x={x}: {type(error).__name__}: {error}"
+        if not isinstance(value, (int, float)):
+            return f"Not a real number at x={x}: {value!r}"
+        if not math.isfinite(value):
+            return f"Not finite at x={x}: {value}"
+        if value < 0:
+            return f"Negative at x={x}: {value}"
+    return None
+
+
+def _check(
+    task: tuple[str, tuple[int, ...]], x_range: tuple[int, int]
+) -> Optional[str]:
+    formula, extra_xs = task
+    xs = list(range(x_range[0], x_range[1] + 1))
+    return check_formula(formula, xs + [x for x in extra_xs if x not in xs])
+
+
+def validate_source(
+    source: CatalogSource,
+    x_range: tuple[int, int] = X_RANGE,
+    workers: Optional[int] = None,
+) -> list[FormulaIssue]:
+    """Issues with the formulas of every component in source, in catalog order.
+
+    Each distinct formula is checked once, over x_range and every catalog x it is
+    used with, spread over a pool of workers. With one worker, or too few formulas
+    to be worth a pool, everything runs in this process.
+    """
+    records = [
+        (category, record)
+        for category in CATEGORIES
+        for record in source.records(category)
+    ]
+    tasks: dict[Any, set[int]] = {}
+    for _, record in records:
+        xs = tasks.setdefault(record.get("formula"), set())
+        if isinstance(record.get("x"), int):
+            xs.add(record["x"])
+    work = [(formula, tuple(sorted(xs))) for formula, xs in tasks.items()]
+    check = partial(_check, x_range=x_range)
+    workers = workers or multiprocessing.cpu_count()
+    if workers == 1 or len(work) < CHUNK_SIZE:
+        problems = [check(x) for x in work]
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            problems = pool.map(check, work, CHUNK_SIZE)
+    by_formula = {task[0]: problem for task, problem in zip(work, problems)}
+    return [
+        FormulaIssue(
+            category, record.get("name"), record.get("formula"), by_formula[formula]
+        )
+        for category, record in records
+        for formula in [record.get("formula")]
+        if by_formula[formula] is not None
+    ]
+
+
+def default_cache_path() -> str:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, "kbr_char", "validation.json")
+
+
+def catalog_hash(filepath: str) -> str:
+    import hashlib
+
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as file_object:
+        for block in iter(lambda: file_object.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def validate_file(
+    filepath: str,
+    x_range: tuple[int, int] = X_RANGE,
+    workers: Optional[int] = None,
+    cache_path: Optional[str] = None,
+) -> list[FormulaIssue]:
+    """Issues with a JSON or compiled catalog file, as validate_source.
+
+    Results are cached in cache_path, by default under the user cache directory,
+    by the sha256 of the file and the evaluation budget, so an unchanged catalog is
+    only checked once per budget.
+    """
+    cache_path = cache_path or default_cache_path()
+    budget = ":".join(map(str, astuple(formula_cache.budget)))
+    key = (
+        f"{catalog_hash(filepath)}:{x_range[0]}:{x_range[1]}:{CHECKS_VERSION}:{budget}"
+    )
+    cache = _read_cache(cache_path)
+    if key in cache:
+        return [FormulaIssue(**x) for x in cache[key]]
+    source = open_catalog(filepath)
+    try:
+        issues = validate_source(source, x_range, workers)
+    finally:
+        source.close()
+    cache[key] = [asdict(x) for x in issues]
+    for stale in list(cache)[:-CACHED_CATALOGS]:
+        del cache[stale]
+    _write_cache(cache_path, cache)
+    return issues
+
+
+def _read_cache(cache_path: str) -> dict[str, list[dict[str, Any]]]:
+    try:
+        with open(cache_path) as file_object:
+            cache = json.load(file_object)
+    except (OSError, ValueError):
+        return {}  # Missing or damaged, so checked again
+    return cache if isinstance(cache, dict) else {}
+
+
+def _write_cache(cache_path: str, cache: dict[str, list[dict[str, Any]]]) -> None:
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        temporary = f"{cache_path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as file_object:
+            json.dump(cache, file_object)
+        os.replace(temporary, cache_path)  # Readers never see half a cache
+    except OSError:
+        pass  # Caching is only an optimization
@@ -0,0 +1,335 @@
+"""SpellBooks keeping every version, sharing what each edit leaves unchanged."""
+from __future__ import annotations  # For using | with type hints
+
+from dataclasses import dataclass, field, replace
+from typing import Any, Iterator, Mapping, Optional
+
+from kbr_char.magic import ComponentInstance, Spell, SpellBook, SpellComponent
+
+
+class _Node:
+    """A node of a persistent treap, never changed once made."""
+
+    __slots__ = ("key", "value", "priority", "left", "right", "size")
+
+    def __init__(
+        self,
+        key: Any,
+        value: Any,
+        priority: tuple[int, Any],
+        left: Optional[_Node],
+        right: Optional[_Node],
+    ) -> None:
+        self.key = key
+        self.value = value
+        self.priority = priority
+        self.left = left
+        self.right = right
+        self.size = 1 + _size(left) + _size(right)
+
+    def with_children(self, left: Optional[_Node], right: Optional[_Node]) -> _Node:
+        return _Node(self.key, self.value, self.priority, left, right)
+
+
+def _size(node: Optional[_Node]) -> int:
+    return 0 if node is None else node.size
+
+
+def _priority(key: Any) -> tuple[int, Any]:
+    # Taken from the key, so the same keys always make the same shape of tree,
+    # and versions differing in a few keys share all but the paths to them. Hashed
+    # in a tuple, as sequence numbers would otherwise hash to themselves, making
+    # the tree a list.
+    return hash((key,)), key
+
+
+def _split(
+    node: Optional[_Node], key: Any
+) -> tuple[Optional[_Node], Optional[_Node], Optional[_Node]]:
+    """Nodes before key, the node of key if any, and nodes after it. Only the path
+    to key is copied, so a node of key keeps its subtrees as they were."""
+    if node is None:
+        return None, None, None
+    if key == node.key:
+        return node.left, node, node.right
+    if key < node.key:
+        left, found, right = _split(node.left, key)
+        return left, found, node.with_children(right, node.right)
+    left, found, right = _split(node.right, key)
+    return node.with_children(node.left, left), found, right
+
+
+def _replace(node: _Node, key: str, value: Any) -> _Node:
+    """node with the value of key, which it must hold, copying only the path."""
+    if key == node.key:
+        return _Node(key, value, node.priority, node.left, node.right)
+    if key < node.key:
+        return node.with_children(_replace(node.left, key, value), node.right)
+    return node.with_children(node.left, _replace(node.right, key, value))
+
+
+def _merge(left: Optional[_Node], right: Optional[_Node]) -> Optional[_Node]:
+    """Join two treaps, every key of left before every key of right."""
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        return left.with_children(left.left, _merge(left.right, right))
+    return right.with_children(_merge(left, right.left), right.right)
+
+
+def _walk(node: Optional[_Node]) -> Iterator[_Node]:
+    stack = []
+    while stack or node is not None:
+        while node is not None:
+            stack.append(node)
+            node = node.left
+        node = stack.pop()
+        yield node
+        node = node.right
+
+
+def _diff(
+    old: Optional[_Node], new: Optional[_Node], found: VersionDiff
+) -> VersionDiff:
+    if old is new:
+        return found  # Shared, so nothing under it changed
+    if old is None:
+        found.added.extend(x.key for x in _walk(new))
+    elif new is None:
+        found.removed.extend(x.key for x in _walk(old))
+    else:
+        left, match, right = _split(new, old.key)
+        _diff(old.left, left, found)
+        if match is None:
+            found.removed.append(old.key)
+        elif match.value is not old.value:
+            found.changed.append(old.key)
+        _diff(old.right, right, found)
+    return found
+
+
+@dataclass
+class VersionDiff:
+    added: list[str] = field(default_factory=list)
+    changed: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.changed or self.removed)
+
+
+class PersistentSpells(Mapping[str, Spell]):
+    """Spells by name in the order they were set, as treaps that are copied only
+    along the path to a changed name. Setting or deleting returns a new mapping, in
+    O(log n), and leaves this one as it was. Setting a name already held keeps its
+    place, as in a dict.
+
+    One treap holds each spell by name, with the sequence number it was set at,
+    the other holds each name by that sequence number, giving the order.
+    """
+
+    __slots__ = ("_root", "_order", "_next")
+
+    def __init__(
+        self,
+        root: Optional[_Node] = None,
+        order: Optional[_Node] = None,
+        next_sequence: int = 0,
+    ) -> None:
+        self._root = root
+        self._order = order
+        self._next = next_sequence
+
+    def _find(self, key: str) -> Optional[_Node]:
+        node = self._root
+        while node is not None:
+            if key == node.key:
+                return node
+            node = node.left if key < node.key else node.right
+        return None
+
+    def __getitem__(self, key: str) -> Spell:
+        node = self._find(key)
+        if node is None:
+            raise KeyError(key)
+        return node.value[1]
+
+    def __contains__(self, key: Any) -> bool:
+        return self._find(key) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return (x.value for x in _walk(self._order))
+
+    def __len__(self) -> int:
+        return _size(self._root)
+
+    def set(self, key: str, value: Spell) -> PersistentSpells:
+        node = self._find(key)
+        if node is not None:
+            sequence, spell = node.value
+            if spell is value:
+                return self
+            root = _replace(self._root, key, (sequence, value))
+            return PersistentSpells(root, self._order, self._next)
+        left, _, right = _split(self._root, key)
+        node = _Node(key, (self._next, value), _priority(key), None, None)
+        # The newest sequence number, so it goes after every other
+        last = _Node(self._next, key, _priority(self._next), None, None)
+        return PersistentSpells(
+            _merge(_merge(left, node), right),
+            _merge(self._order, last),
+            self._next + 1,
+        )
+
+    def delete(self, key: str) -> PersistentSpells:
+        left, found, right = _split(self._root, key)
+        if found is None:
+            return self
+        before, _, after = _split(self._order, found.value[0])
+        return PersistentSpells(_merge(left, right), _merge(before, after), self._next)
+
+    def diff(self, other: PersistentSpells) -> VersionDiff:
+        """Names added, changed and removed going from this mapping to other, each
+        in name order. Subtrees the two share are skipped, so this costs O(log n)
+        per change."""
+        return _diff(self._root, other._root, VersionDiff())
+
+
+@dataclass(frozen=True)
+class Version:
+    number: int
+    spells: PersistentSpells = field(repr=False)
+    change: str
+
+
+@dataclass
+class VersionedSpellBook(SpellBook):
+    """SpellBook where every edit makes a new version, with undo and redo.
+
+    Spells are kept in a PersistentSpells, so each version only holds the spells
+    and tree nodes its edit changed and shares the rest with the version before.
+    customize makes a new spell sharing all but the customized component, rather
+    than changing a spell that earlier versions hold too. Spells are listed in the
+    order they were added, as in SpellBook.
+
+    Undoing then editing drops the undone versions, as in an editor. Customizing a
+    component in place, as spell.components[i].customize(x), would change every
+    version sharing it, so it is undone and raises ValueError.
+    """
+
+    history: list[Version] = field(
+        default_factory=list, init=False, repr=False, compare=False
+    )
+    position: int = field(default=0, init=False, repr=False, compare=False)
+    # Each spell ever in a version, by id, with the x of each of its components then
+    _committed: dict[int, tuple[Spell, tuple[int, ...]]] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self) -> None:
+        spells = self.spells
+        self.spells = PersistentSpells()
+        for spell in spells.values() if isinstance(spells, Mapping) else spells:
+            if spell.name in self.spells:
+                raise ValueError(f"Spell already in SpellBook {self.name}")
+            self.spells = self.spells.set(spell.name, spell)
+            self._watch(spell)
+        self.history = [Version(0, self.spells, "Created")]
+
+    def _watch(self, spell: Spell) -> None:
+        super()._watch(spell)
+        self._committed.setdefault(
+            id(spell), (spell, tuple(x.x for x in spell.components))
+        )
+
+    def _spell_changed(
+        self, spell: Spell, component: SpellComponent | ComponentInstance
+    ) -> None:
+        _, xs = self._committed[id(spell)]
+        for x, spell_component in zip(xs, spell.components):
+            if spell_component is component:
+                component.x = x
+        raise ValueError(
+            f"{component.name} of {spell.name} is shared by versions of SpellBook"
+            f" {self.name}, use its customize method to change it"
+        )
+
+    @property
+    def version(self) -> Version:
+        return self.history[self.position]
+
+    def _commit(self, spells: PersistentSpells, change: str) -> Version:
+        previous = self.spells
+        del self.history[self.position + 1 :]
+        self.history.append(Version(self.version.number + 1, spells, change))
+        self.position += 1
+        self.spells = spells
+        self._notify(previous, spells)
+        return self.version
+
+    def _notify(self, old: PersistentSpells, new: PersistentSpells) -> None:
+        # Spells stay watched once removed, as undo may bring them back
+        if not self.listeners:
+            return
+        diff = old.diff(new)
+        for name in diff.removed + diff.changed:
+            for listener in self.listeners:
+                listener.spell_removed(self, old[name])
+        for name in diff.added + diff.changed:
+            for listener in self.listeners:
+                listener.spell_added(self, new[name])
+
+    def add_spell(self, spell: Spell) -> None:
+        if spell.name in self.spells:
+            raise ValueError(f"Spell already in SpellBook {self.name}")
+        self._watch(spell)
+        self._commit(self.spells.set(spell.name, spell), f"Add {spell.name}")
+
+    def remove_spell(self, spellname: str) -> None:
+        if spellname in self.spells:
+            self._commit(self.spells.delete(spellname), f"Remove {spellname}")
+
+    def customize(self, spellname: str, index: int, x: int) -> Spell:
+        """Set x of one component of a spell, as a new spell in a new version."""
+        spell = self.get_spell(spellname)
+        components = list(spell.components)
+        component = components[index]
+        if isinstance(component, ComponentInstance):
+            components[index] = component.template.instance(x)
+        else:
+            components[index] = replace(component, x=x)
+        customized = Spell(spell.name, components)
+        self._watch(customized)
+        self._commit(
+            self.spells.set(spellname, customized),
+            f"Customize {component.name} of {spellname}",
+        )
+        return customized
+
+    def undo(self) -> Optional[Version]:
+        """Go back a version, returning it, or None at the first."""
+        if self.position == 0:
+            return None
+        return self.checkout(self.position - 1)
+
+    def redo(self) -> Optional[Version]:
+        """Go forward a version undone, returning it, or None if there is none."""
+        if self.position == len(self.history) - 1:
+            return None
+        return self.checkout(self.position + 1)
+
+    def checkout(self, position: int) -> Version:
+        """Go to the version at position in history, keeping the versions after it
+        for redo."""
+        previous = self.spells
+        self.position = position
+        self.spells = self.version.spells
+        self._notify(previous, self.spells)
+        return self.version
+
+    def diff(self, old: Version, new: Optional[Version] = None) -> VersionDiff:
+        """Spells added, changed and removed from old to new, by default the
+        current version."""
+        return old.spells.diff((new or self.version).spells)
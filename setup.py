@@ -14,6 +14,10 @@ requirements = [
     "Click>=8.0",
 ]
 
+extra_requirements = {
+    "numpy": ["numpy>=1.21"],
+}
+
 test_requirements = [
     "pytest>=6",
 ]
@@ -40,6 +44,7 @@ setup(
         ],
     },
     install_requires=requirements,
+    extras_require=extra_requirements,
     license="MIT license",
     long_description=readme + "\n\n" + history,
     include_package_data=True,
@@ -0,0 +1,82 @@
+import json
+
+import pytest
+from click.testing import CliRunner
+from kbr_char import cli
+from kbr_char.batch import score_line, score_spells
+from kbr_char.magic import SpellComponentCollection, load_data
+
+from tests.test_magic import json_file
+
+FIREBALL = {
+    "name": "Fireball",
+    "components": [
+        {"name": "Combustion"},
+        {"type": "Range", "name": "SpellRange", "x": 100},
+        {"type": "Shape", "name": "Arrow"},
+    ],
+}
+
+
+def spell_lines(count):
+    for number in range(count):
+        spell = dict(FIREBALL, name=f"Fireball {number}")
+        spell["components"] = [
+            FIREBALL["components"][0],
+            dict(FIREBALL["components"][1], x=number),
+        ]
+        yield json.dumps(spell) + "\n"
+
+
+class TestScoreLine:
+    @classmethod
+    def setup_class(cls):
+        cls.spell_components = SpellComponentCollection(load_data(json_file))
+
+    def test_score(self):
+        result = score_line(json.dumps(FIREBALL), self.spell_components)
+        assert json.loads(result) == {"name": "Fireball", "dc": 73}
+
+    @pytest.mark.parametrize(
+        "line",
+        [
+            '{"name": "Broken", "components": [{"name": "NonExistant"}]}',
+            '{"name": "Broken"}',
+            "not json",
+            "[]",
+            '{"name": "Divided", "components": [{"type": "Range", "name": "Bolt",'
+            ' "x": 0, "desc": "", "formula": "10/x"}]}',
+        ],
+    )
+    def test_errors_are_reported(self, line):
+        result = json.loads(score_line(line, self.spell_components))
+        assert "error" in result
+        assert "dc" not in result
+
+
+class TestScoreSpells:
+    @pytest.mark.parametrize("workers", [1, 2])
+    def test_results_in_input_order(self, workers):
+        results = list(score_spells(spell_lines(50), json_file, workers, 3))
+        assert [json.loads(x)["name"] for x in results] == [
+            f"Fireball {x}" for x in range(50)
+        ]
+        assert [json.loads(x)["dc"] for x in results] == [
+            12 + int(x / 5 * 3) for x in range(50)
+        ]
+
+    def test_blank_lines_skipped(self):
+        lines = ["\n", json.dumps(FIREBALL), "  \n"]
+        assert len(list(score_spells(lines, json_file, 1))) == 1
+
+
+def test_dc_command():
+    """Test scoring spells from the CLI."""
+    runner = CliRunner()
+    result = runner.invoke(
+        cli.main,
+        ["dc", "--catalog", json_file, "--workers", "1"],
+        input="".join(spell_lines(3)),
+    )
+    assert result.exit_code == 0
+    assert [json.loads(x)["dc"] for x in result.output.splitlines()] == [12, 12, 13]
@@ -0,0 +1,294 @@
+import io
+import json
+import os
+import tempfile
+
+import pytest
+from kbr_char.catalog import (
+    CatalogWatcher,
+    MappedCatalog,
+    StreamingCatalog,
+    compile_catalog,
+    decode_formula,
+    encode_formula,
+    iter_records,
+    open_catalog,
+)
+from kbr_char.magic import (
+    Calc,
+    Element,
+    FormulaBudgetError,
+    Modifier,
+    Range,
+    Shape,
+    Spell,
+    SpellBook,
+    SpellBookListener,
+    SpellComponent,
+    SpellComponentCollection,
+    load_data,
+)
+
+from tests.test_magic import json_file
+
+
+class TestIterRecords:
+    @pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+    def test_records_match_json(self, chunk_size):
+        with open(json_file, "rb") as file_object:
+            records = list(iter_records(file_object, chunk_size))
+        test_data = load_data(json_file)
+        expected = [
+            (category, record)
+            for category, category_records in test_data.items()
+            for record in category_records
+        ]
+        assert [(x[0], json.loads(x[3])) for x in records] == expected
+
+    def test_spans_point_at_records(self):
+        with open(json_file, "rb") as file_object:
+            content = file_object.read()
+            file_object.seek(0)
+            for _, start, end, raw in iter_records(file_object, 16):
+                assert content[start:end] == raw
+
+    def test_strings_with_brackets_and_unicode(self):
+        data = {"Ünits": [{"name": 'Brace }{ ]\\"', "x": 1}], "Empty": []}
+        content = json.dumps(data, ensure_ascii=False).encode()
+        records = list(iter_records(io.BytesIO(content), 3))
+        assert [(x[0], json.loads(x[3])) for x in records] == [
+            ("Ünits", data["Ünits"][0])
+        ]
+
+    @pytest.mark.parametrize("content", [b"[]", b'{"Elements": {}}', b'{"A": [{'])
+    def test_malformed_catalog(self, content):
+        with pytest.raises(ValueError):
+            list(iter_records(io.BytesIO(content)))
+
+    @pytest.mark.parametrize("bad", [b'{"name": [{"nested": 1}]}', b"7", b'"a"'])
+    def test_malformed_record_stops_reading(self, bad):
+        records = b",".join([b'{"name": "Padding"}'] * 10000)
+        content = b'{"A": [' + bad + b"," + records + b"]}"
+        file_object = io.BytesIO(content)
+        with pytest.raises(ValueError):
+            list(iter_records(file_object, 64))
+        assert file_object.tell() < 1024
+
+    def test_malformed_category_stops_reading(self):
+        file_object = io.BytesIO(b'{"A" [' + b" " * 100000 + b"]}")
+        with pytest.raises(ValueError):
+            list(iter_records(file_object, 64))
+        assert file_object.tell() < 1024
+
+
+class TestStreamingCatalog:
+    def test_find_scans_only_as_far_as_needed(self):
+        catalog = StreamingCatalog(json_file)
+        record = catalog.find("Elements", "mineral")
+        assert record["name"] == "Mineral"
+        assert len(catalog._spans) < 10
+        assert catalog.find("Elements", "NonExistant") is None
+
+    def test_close_releases_a_partial_scan(self):
+        catalog = StreamingCatalog(json_file)
+        catalog.find("Elements", "mineral")
+        stream = catalog._stream
+        catalog.close()
+        assert catalog._stream is None
+        assert stream.gi_frame is None  # Finished, so its file is closed
+        test_data = load_data(json_file)
+        assert list(catalog.records("Elements")) == test_data["Elements"]
+
+    def test_records_by_category(self):
+        catalog = StreamingCatalog(json_file)
+        test_data = load_data(json_file)
+        assert list(catalog.records("Shape")) == test_data["Shape"]
+
+
+class TestLazySpellComponentCollection:
+    @classmethod
+    def setup_class(cls):
+        cls.eager = SpellComponentCollection(load_data(json_file))
+
+    def setup_method(self):
+        self.lazy = SpellComponentCollection.from_file(json_file)
+
+    def test_nothing_built_up_front(self):
+        assert not self.lazy.components
+
+    def test_get_builds_one_component(self):
+        spell_range = self.lazy.get(Range, "SpellRange")
+        assert spell_range == self.eager.get(Range, "SpellRange")
+        assert spell_range.dc == self.eager.get(Range, "SpellRange").dc
+        assert self.lazy.components == [spell_range.template]
+        assert self.lazy.get_template(Range, "spellrange") is spell_range.template
+
+    def test_exception_when_retrieving_a_nonexistant_component_name(self):
+        with pytest.raises(IndexError):
+            self.lazy.get(Element, "NonExistant")
+
+    @pytest.mark.parametrize("component_type", [Element, Range, Shape, Modifier])
+    def test_get_by_type(self, component_type):
+        self.lazy.get(component_type, self.eager.get_by_type(component_type)[-1].name)
+        lazy_components = self.lazy.get_by_type(component_type)
+        eager_components = self.eager.get_by_type(component_type)
+        assert sorted(lazy_components, key=lambda x: x.name) == sorted(
+            eager_components, key=lambda x: x.name
+        )
+
+    def test_get_by_base_type_and_name(self):
+        assert self.lazy.get_by_name("Arrow") == self.eager.get_by_name("Arrow")
+        assert self.lazy.get(SpellComponent, "Combustion").name == "Combustion"
+        assert len(self.lazy.get_by_type(SpellComponent)) == len(self.eager.components)
+
+
+class TestBinaryCatalog:
+    @classmethod
+    def setup_class(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.binary_file = os.path.join(cls.directory.name, "magic.kbrc")
+        compile_catalog(json_file, cls.binary_file)
+
+    @classmethod
+    def teardown_class(cls):
+        cls.directory.cleanup()
+
+    @pytest.mark.parametrize("formula", ["x", "(x/5)*3", "12", "2**x-0.5", "x/5"])
+    def test_formula_program_round_trip(self, formula):
+        compiled = decode_formula(encode_formula(formula))
+        for x in [0, 3, 20]:
+            assert compiled(x) == Calc.evaluate(formula, x)
+
+    def test_unsupported_formula(self):
+        with pytest.raises(ValueError):
+            encode_formula("abs(x)")
+
+    @pytest.mark.parametrize("formula,x", [("x**x", 100), ("10**x", 10**3)])
+    def test_program_budgeted(self, formula, x):
+        with pytest.raises(FormulaBudgetError):
+            decode_formula(encode_formula(formula))(x)
+
+    def test_records_match_json(self):
+        catalog = open_catalog(self.binary_file)
+        assert isinstance(catalog, MappedCatalog)
+        for category, records in load_data(json_file).items():
+            mapped = list(catalog.records(category))
+            for record in mapped:
+                del record["program"]
+            assert mapped == [{"units": None, **x} for x in records]
+
+    def test_find(self):
+        catalog = MappedCatalog(self.binary_file)
+        test_data = load_data(json_file)
+        for category, records in test_data.items():
+            for record in records:
+                assert catalog.find(category, record["name"].upper())["x"] == (
+                    record["x"]
+                )
+        assert catalog.find("Elements", "NonExistant") is None
+        assert catalog.find("Elements", "zzz") is None
+        assert catalog.find("Unknown", "Combustion") is None
+
+    def test_collection_matches_json(self):
+        eager = SpellComponentCollection(load_data(json_file))
+        mapped = SpellComponentCollection.from_file(self.binary_file)
+        for component in eager.components:
+            found = mapped.get(type(component), component.name)
+            assert found.template == component
+            assert found.dc == component.dc
+        with pytest.raises(IndexError):
+            mapped.get(Element, "NonExistant")
+
+    def test_not_a_binary_catalog(self):
+        with pytest.raises(ValueError):
+            MappedCatalog(json_file)
+
+
+def edited_catalog():
+    data = load_data(json_file)
+    data["Range"][2] = dict(data["Range"][2], formula="x/5")
+    data["Shape"] = data["Shape"][1:]
+    data["Elements"].append(
+        {"name": "Frost", "x": 5, "formula": "5", "units": None, "desc": "cold"}
+    )
+    return data
+
+
+class TestReload:
+    @classmethod
+    def setup_class(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.catalog_file = os.path.join(cls.directory.name, "magic.json")
+
+    @classmethod
+    def teardown_class(cls):
+        cls.directory.cleanup()
+
+    def fireball(self, collection):
+        fireball = Spell("Fireball")
+        fireball.add_component(collection.get(Element, "Combustion"))
+        bolt = collection.get(Range, "SpellRange")
+        bolt.customize(100)
+        fireball.add_component(bolt)
+        return fireball
+
+    def test_unchanged_catalog(self):
+        collection = SpellComponentCollection(load_data(json_file))
+        assert not collection.reload(load_data(json_file))
+
+    def test_spells_follow_changed_formula(self):
+        collection = SpellComponentCollection(load_data(json_file))
+        fireball = self.fireball(collection)
+        changes = []
+
+        class Recorder(SpellBookListener):
+            def spell_changed(self, book, spell, component):
+                changes.append(("customized", spell.name, component.name))
+
+            def template_changed(self, book, spell, template):
+                changes.append(("reloaded", spell.name, template.name))
+
+        book = SpellBook("Reloaded", listeners=[Recorder()])
+        book.add_spell(fireball)
+        assert fireball.dc == 72
+        diff = collection.reload(edited_catalog())
+        assert diff.changed == [("Range", "SpellRange")]
+        assert diff.removed == [("Shape", "Arrow")]
+        assert diff.added == [("Elements", "Frost")]
+        assert fireball.dc == 32
+        assert fireball.components[1].x == 100
+        assert changes == [("reloaded", "Fireball", "SpellRange")]
+        assert collection.get(Element, "Frost").dc == 5
+        with pytest.raises(IndexError):
+            collection.get(Shape, "Arrow")
+
+    @pytest.mark.parametrize("binary", [False, True])
+    def test_lazy_reload_file(self, binary):
+        with open(self.catalog_file, "w") as file_object:
+            json.dump(load_data(json_file), file_object)
+        path = self.catalog_file
+        if binary:
+            path = os.path.join(self.directory.name, "magic.kbrc")
+            compile_catalog(self.catalog_file, path)
+        collection = SpellComponentCollection.from_file(path)
+        fireball = self.fireball(collection)
+        with open(self.catalog_file, "w") as file_object:
+            json.dump(edited_catalog(), file_object)
+        if binary:
+            compile_catalog(self.catalog_file, path)
+        diff = collection.reload_file(path)
+        assert diff.changed == [("Range", "SpellRange")]
+        assert fireball.dc == 32
+
+    def test_watcher_reloads_on_change(self):
+        with open(self.catalog_file, "w") as file_object:
+            json.dump(load_data(json_file), file_object)
+        collection = SpellComponentCollection.from_file(self.catalog_file, lazy=False)
+        fireball = self.fireball(collection)
+        watcher = CatalogWatcher(collection, self.catalog_file)
+        assert watcher.poll() is None
+        with open(self.catalog_file, "w") as file_object:
+            json.dump(edited_catalog(), file_object, indent=1)
+        assert watcher.poll().changed == [("Range", "SpellRange")]
+        assert fireball.dc == 32
+        assert watcher.poll() is None
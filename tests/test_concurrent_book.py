@@ -0,0 +1,131 @@
+import threading
+import time
+
+import pytest
+from benchmarks.generate import generate_spells
+from kbr_char.concurrent_book import (
+    ConcurrentSpellBook,
+    ConcurrentSpellComponentCollection,
+)
+from kbr_char.magic import Range, Spell, SpellComponentCollection, load_data
+
+from tests.test_catalog import edited_catalog
+from tests.test_magic import json_file
+
+READ_SECONDS = 0.2
+
+
+def run_threads(count, target):
+    threads = [threading.Thread(target=target, args=(x,)) for x in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+class TestConcurrentSpellBook:
+    @classmethod
+    def setup_class(cls):
+        cls.collection = ConcurrentSpellComponentCollection(load_data(json_file))
+        cls.spells = generate_spells(cls.collection, 400, seed=23)
+
+    def test_same_lookups_as_collection(self):
+        plain = SpellComponentCollection(load_data(json_file))
+        for template in plain.get_by_type(Range):
+            found = self.collection.get_template(Range, template.name)
+            assert found == template
+        assert self.collection.get_by_name("Metal") == plain.get_by_name("Metal")
+        with pytest.raises(IndexError):
+            self.collection.get_template(Range, "Nowhere")
+
+    def test_reload_published(self):
+        collection = ConcurrentSpellComponentCollection(load_data(json_file))
+        before = collection.snapshot()
+        collection.reload(edited_catalog())
+        assert collection.snapshot() is not before
+        assert collection.get_template(Range, "SpellRange").formula == "x/5"
+        assert collection.get_by_name("Frost")
+
+    def test_snapshot_unchanged_by_writes(self):
+        book = ConcurrentSpellBook("Snapshots", self.spells[:10])
+        snapshot = book.snapshot()
+        book.remove_spell(self.spells[0].name)
+        book.add_spell(Spell("New"))
+        assert list(snapshot) == [x.name for x in self.spells[:10]]
+        assert "New" in book.spell_list()
+
+    def test_add_spells_all_or_nothing(self):
+        book = ConcurrentSpellBook("Atomic", self.spells[:2])
+        with pytest.raises(ValueError):
+            book.add_spells([Spell("Fresh"), self.spells[0]])
+        assert "Fresh" not in book.spell_list()
+
+    def test_replace_spell(self):
+        book = ConcurrentSpellBook("Replace", self.spells[:3])
+        replacement = Spell(self.spells[1].name)
+        book.replace_spell(replacement)
+        assert book.get_spell(replacement.name) is replacement
+        assert len(book.spell_list()) == 3
+
+    def test_readers_see_whole_writes(self):
+        """Writers add and remove spells in pairs, so no reader may ever see half."""
+        book = ConcurrentSpellBook("Stress")
+        pairs = [self.spells[x : x + 2] for x in range(0, len(self.spells), 2)]
+        done = threading.Event()
+        errors = []
+
+        def write(number):
+            for pair in pairs[number::2]:
+                book.add_spells(pair)
+            for pair in pairs[number::2][::2]:
+                book.remove_spells([x.name for x in pair])
+
+        def read(_):
+            while not done.is_set():
+                names = set(book.snapshot())
+                for first, second in pairs:
+                    if (first.name in names) != (second.name in names):
+                        errors.append((first.name, second.name))
+                for name in book.spell_list()[:20]:
+                    book.get_spell(name).dc
+
+        readers = [threading.Thread(target=read, args=(x,)) for x in range(4)]
+        for thread in readers:
+            thread.start()
+        run_threads(2, write)
+        done.set()
+        for thread in readers:
+            thread.join()
+        assert not errors
+        removed = {x.name for y in [0, 1] for pair in pairs[y::2][::2] for x in pair}
+        assert set(book.spell_list()) == {x.name for x in self.spells} - removed
+
+    def test_read_throughput_scales(self):
+        book = ConcurrentSpellBook("Throughput", self.spells)
+        names = [x.name for x in self.spells]
+        throughput = {}
+        for count in [1, 2, 4, 8]:
+            reads = [0] * count
+            stop = time.perf_counter() + READ_SECONDS
+
+            def read(number):
+                position = number
+                while time.perf_counter() < stop:
+                    book.get_spell(names[position % len(names)])
+                    position += 1
+                reads[number] = position - number
+
+            def write(_):
+                spare = Spell("Spare")
+                while time.perf_counter() < stop:
+                    book.add_spell(spare)
+                    book.remove_spell(spare.name)
+
+            writer = threading.Thread(target=write, args=(0,))
+            writer.start()
+            run_threads(count, read)
+            writer.join()
+            throughput[count] = sum(reads) / READ_SECONDS
+        # Readers share the interpreter, so more of them can't go much faster, but
+        # as they never wait on the writer or each other they mustn't go slower.
+        assert min(throughput.values()) > throughput[1] * 0.3, throughput
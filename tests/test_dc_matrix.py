@@ -0,0 +1,59 @@
+import pytest
+from benchmarks.generate import generate_spells
+from kbr_char.magic import (
+    Element,
+    Spell,
+    SpellBook,
+    SpellComponentCollection,
+    load_data,
+)
+
+from tests.test_catalog import edited_catalog
+from tests.test_magic import json_file
+
+
+class TestDCMatrix:
+    @classmethod
+    def setup_class(cls):
+        pytest.importorskip("numpy")
+        from kbr_char.dc_matrix import DCMatrix, book_dcs
+
+        cls.DCMatrix = DCMatrix
+        cls.book_dcs = staticmethod(book_dcs)
+
+    def setup_method(self):
+        self.collection = SpellComponentCollection(load_data(json_file))
+        self.book = SpellBook("Matrix", components=self.collection)
+        for spell in generate_spells(self.collection, 500, seed=22):
+            self.book.add_spell(spell)
+
+    def expected(self):
+        return {x.name: x.dc for x in self.book.detailed_spell_list()}
+
+    def test_matches_spell_dc(self):
+        assert self.book_dcs(self.book) == self.expected()
+
+    def test_repeated_and_empty_spells(self):
+        metal = self.collection.get(Element, "Metal")
+        twice = [metal, metal, self.collection.get(Element, "Metal")]
+        self.book.add_spell(Spell("Twice", twice))
+        self.book.add_spell(Spell("Empty"))
+        dcs = self.book_dcs(self.book)
+        assert dcs == self.expected()
+        assert dcs["Empty"] == 0
+
+    def test_refresh_after_customizing(self):
+        matrix = self.DCMatrix.from_book(self.book)
+        for spell in self.book.detailed_spell_list()[::7]:
+            spell.components[1].customize(spell.components[1].x + 13)
+        assert matrix.dcs() != self.expected()
+        matrix.refresh()
+        assert matrix.dcs() == self.expected()
+
+    def test_refresh_after_reload(self):
+        matrix = self.DCMatrix.from_book(self.book)
+        before = matrix.dcs()
+        self.collection.reload(edited_catalog())
+        matrix.refresh()
+        assert matrix.dcs() == self.expected()
+        assert matrix.dcs() != before
@@ -0,0 +1,51 @@
+import os
+import subprocess
+import sys
+from typing import Dict, Set, Tuple
+
+import pytest
+
+# Cumulative microseconds -X importtime may report for each module. Generous, so that
+# slow machines pass, but well under the cost of importing loguru or numpy eagerly.
+IMPORT_BUDGET = {"kbr_char": 20_000, "kbr_char.magic": 120_000, "kbr_char.cli": 150_000}
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(module: str) -> Tuple[Dict[str, int], Set[str]]:
+    """Cumulative import time of every module, and sys.modules, after import module."""
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            f"import sys, {module}; print(' '.join(sys.modules))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=ROOT,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times, set(result.stdout.split())
+
+
+class TestImportTime:
+    @pytest.mark.parametrize("module", list(IMPORT_BUDGET))
+    def test_within_budget(self, module):
+        # Best of three, as the first run may still be writing bytecode caches
+        best = min(import_times(module)[0][module] for _ in range(3))
+        assert best <= IMPORT_BUDGET[module]
+
+    def test_magic_defers_heavy_imports(self):
+        modules = import_times("kbr_char.magic")[1]
+        assert not modules & {"loguru", "numpy", "click", "sqlite3", "multiprocessing"}
+
+    def test_cli_defers_commands(self):
+        modules = import_times("kbr_char.cli")[1]
+        assert not modules & {"kbr_char.magic", "kbr_char.batch", "loguru", "numpy"}
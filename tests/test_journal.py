@@ -0,0 +1,117 @@
+import os
+
+import pytest
+from kbr_char.journal import SpellBookJournal
+from kbr_char.magic import (
+    Element,
+    Range,
+    Shape,
+    Spell,
+    SpellComponent,
+    SpellComponentCollection,
+    load_data,
+)
+
+from tests.test_magic import json_file
+
+
+class TestSpellBookJournal:
+    @classmethod
+    def setup_class(cls):
+        cls.spell_components = SpellComponentCollection(load_data(json_file))
+
+    @pytest.fixture
+    def path(self, tmp_path):
+        return str(tmp_path / "exodius")
+
+    def make_fireball(self, name="Fireball"):
+        fireball = Spell(name)
+        fireball.add_component(self.spell_components.get(Element, "Combustion"))
+        fireball.add_component(self.spell_components.get(Range, "SpellRange"))
+        fireball.add_component(self.spell_components.get(Shape, "Arrow"))
+        return fireball
+
+    def reload(self, path):
+        journal = SpellBookJournal(path)
+        return journal, journal.load("Exodius", self.spell_components)
+
+    def test_empty_book(self, path):
+        journal, spellbook = self.reload(path)
+        assert spellbook.name == "Exodius"
+        assert not spellbook.spell_list()
+
+    def test_replaying_edits(self, path):
+        journal, spellbook = self.reload(path)
+        spellbook.add_spell(self.make_fireball())
+        spellbook.add_spell(self.make_fireball("Frostbolt"))
+        spellbook.add_spell(Spell("Bolt", [SpellComponent("Bolt", 5, "x+4")]))
+        spellbook.get_spell("Fireball").components[1].customize(100)
+        spellbook.remove_spell("Frostbolt")
+        journal.close()
+
+        journal, reloaded = self.reload(path)
+        assert reloaded.spell_list() == ["Fireball", "Bolt"]
+        assert reloaded.get_spell("Fireball").dc == 73
+        assert reloaded.get_spell("Fireball").components[1].x == 100
+        assert reloaded.get_spell("Bolt").dc == 9
+        journal.close()
+
+    def test_compaction(self, path):
+        journal = SpellBookJournal(path, compact_every=3)
+        spellbook = journal.load("Exodius", self.spell_components)
+        for number in range(7):
+            spellbook.add_spell(self.make_fireball(f"Fireball {number}"))
+        spellbook.get_spell("Fireball 6").components[1].customize(50)
+        journal.close()
+        with open(journal.journal_path) as file_object:
+            assert len(file_object.readlines()) == 2
+        assert os.path.exists(journal.snapshot_path)
+
+        journal, reloaded = self.reload(path)
+        assert reloaded.spell_list() == [f"Fireball {x}" for x in range(7)]
+        assert reloaded.get_spell("Fireball 6").dc == 43
+        journal.close()
+
+    def test_journal_already_in_snapshot_is_skipped(self, path):
+        journal, spellbook = self.reload(path)
+        spellbook.add_spell(self.make_fireball())
+        with open(journal.journal_path) as file_object:
+            entries = file_object.read()
+        journal.compact()
+        journal.close()
+        with open(journal.journal_path, "w") as file_object:
+            file_object.write(entries)  # As if the crash came before truncating
+
+        journal, reloaded = self.reload(path)
+        assert reloaded.spell_list() == ["Fireball"]
+        journal.close()
+
+    def test_torn_last_entry_is_ignored(self, path):
+        journal, spellbook = self.reload(path)
+        spellbook.add_spell(self.make_fireball())
+        journal.close()
+        with open(journal.journal_path, "a") as file_object:
+            file_object.write('{"op": "add_sp')
+
+        journal, reloaded = self.reload(path)
+        assert reloaded.spell_list() == ["Fireball"]
+        reloaded.add_spell(Spell("Two"))
+        reloaded.add_spell(Spell("Three"))
+        journal.close()
+
+        journal, reloaded = self.reload(path)
+        assert reloaded.spell_list() == ["Fireball", "Two", "Three"]
+        journal.close()
+
+    def test_reload_not_journaled_as_customize(self, path):
+        collection = SpellComponentCollection(load_data(json_file))
+        journal = SpellBookJournal(path)
+        spellbook = journal.load("Exodius", collection)
+        for name in ["One", "Two", "Three"]:
+            spellbook.add_spell(Spell(name, [collection.get(Range, "SpellRange")]))
+        size = os.path.getsize(journal.journal_path)
+        data = load_data(json_file)
+        next(x for x in data["Range"] if x["name"] == "SpellRange")["formula"] = "x"
+        collection.reload(data)
+        journal.close()
+        assert os.path.getsize(journal.journal_path) == size
@@ -6,6 +6,8 @@ import pytest
 from click.testing import CliRunner
 from kbr_char import cli
 
+from tests.test_magic import json_file
+
 
 @pytest.fixture
 def response():
@@ -32,3 +34,13 @@ def test_command_line_interface():
     help_result = runner.invoke(cli.main, ["--help"])
     assert help_result.exit_code == 0
     assert "--help  Show this message and exit." in help_result.output
+
+
+def test_compile_catalog_command(tmp_path):
+    """Test compiling a binary catalog from the CLI."""
+    runner = CliRunner()
+    target = str(tmp_path / "magic.kbrc")
+    result = runner.invoke(cli.main, ["compile-catalog", json_file, target])
+    assert result.exit_code == 0
+    with open(target, "rb") as file_object:
+        assert file_object.read(4) == b"KBRC"
@@ -1,9 +1,18 @@
 import os.path
+import pickle
+import tracemalloc
+from dataclasses import FrozenInstanceError
+from fractions import Fraction
 
 import pytest
 from kbr_char.magic import (
     Calc,
+    CatalogRegistry,
     Element,
+    EvaluationBudget,
+    FormulaBudgetError,
+    FormulaCache,
+    Instrumentation,
     Modifier,
     Range,
     Shape,
@@ -11,6 +20,7 @@ from kbr_char.magic import (
     SpellBook,
     SpellComponent,
     SpellComponentCollection,
+    formula_cache,
     load_data,
 )
 
@@ -59,6 +69,26 @@ class TestSpellComponentCollections:
         assert spell_component
         assert spell_component[0].name == "Combustion"
 
+    def test_retrieving_is_case_insensitive(self):
+        spell_component = self.spell_components.get(Range, "spellrange")
+        assert spell_component.name == "SpellRange"
+
+    def test_retrieving_by_base_type(self):
+        spell_component = self.spell_components.get(SpellComponent, "Arrow")
+        assert spell_component.component_type is Shape
+        assert len(self.spell_components.get_by_type(SpellComponent)) == len(
+            self.spell_components.components
+        )
+
+    def test_appended_components_are_indexed(self):
+        spell_components = SpellComponentCollection(load_data(json_file))
+        spell_components.get(Element, "Combustion")
+        bolt = Element(name="Bolt", x=5, formula="x+4")
+        spell_components.components.append(bolt)
+        assert spell_components.get_template(Element, "bolt") is bolt
+        assert bolt in spell_components.get_by_type(Element)
+        assert spell_components.get_by_name("BOLT") == [bolt]
+
 
 class TestSpell:
     @classmethod
@@ -78,6 +108,148 @@ class TestSpell:
         assert len(fireball.components) == 1
         assert fireball.dc != 0
 
+    def test_dc_follows_customized_components(self):
+        bolt = Range(name="Bolt", x=20, formula="(x/5)*3")
+        arrow = Shape(name="Arrow", x=1, formula="1")
+        fireball = Spell("Fireball", [arrow])
+        frostbolt = Spell("Frostbolt")
+        fireball.add_component(bolt)
+        frostbolt.add_component(bolt)
+        frostbolt.add_component(bolt)
+        assert fireball.dc == 13
+        assert frostbolt.dc == 24
+        bolt.customize(100)
+        assert fireball.dc == 61
+        assert frostbolt.dc == 120
+
+    def test_dc_read_without_evaluating(self):
+        fireball = Spell("Fireball")
+        fireball.add_component(Range(name="Bolt", x=20, formula="(x/5)*3"))
+        fireball.dc
+        calls = formula_cache.hits + formula_cache.misses
+        assert fireball.dc == 12
+        assert formula_cache.hits + formula_cache.misses == calls
+
+    def test_dc_after_direct_component_changes(self):
+        fireball = Spell("Fireball")
+        bolt = Range(name="Bolt", x=20, formula="(x/5)*3")
+        fireball.components.append(bolt)
+        assert fireball.dc == 12
+        bolt.customize(10)
+        assert fireball.dc == 6
+
+    def test_dc_after_replacing_components_in_place(self):
+        bolt = Range(name="Bolt", x=20, formula="(x/5)*3")
+        arrow = Shape(name="Arrow", x=1, formula="1")
+        fireball = Spell("Fireball", [bolt])
+        assert fireball.dc == 12
+        fireball.components[0] = arrow
+        assert fireball.dc == 1
+        fireball.components.pop()
+        fireball.components.append(bolt)
+        assert fireball.dc == 12
+        bolt.x = 10
+        assert fireball.dc == 6
+        spell_range = self.spell_components.get(Range, "SpellRange")
+        fireball.components[0] = spell_range
+        spell_range.x = 100
+        assert fireball.dc == 60
+
+    def test_dc_after_formula_changed_directly(self):
+        bolt = Range(name="Bolt", x=20, formula="(x/5)*3")
+        fireball = Spell("Fireball", [bolt])
+        assert fireball.dc == 12
+        bolt.formula = "1"
+        assert fireball.dc == 1
+
+    def test_dc_read_while_x_changes(self):
+        class Drifting(Range):
+            @property
+            def dc(self):
+                value = int(Calc.evaluate(self.formula, self.x))
+                self.x += 1  # As another thread customizing it mid-read
+                return value
+
+        fireball = Spell("Fireball", [Drifting(name="Bolt", x=20, formula="x")])
+        assert fireball.dc == 20
+        assert fireball.dc == 21
+
+    def test_dc_evaluated_only_when_read(self):
+        spell = Spell("Broken", [Range(name="z", x=0, formula="1/x", desc="")])
+        with pytest.raises(ZeroDivisionError):
+            spell.dc
+
+    def test_largest_x_for_target_dc(self):
+        bolt = self.spell_components.get(Range, "SpellRange")
+        fireball = Spell("Fireball", [self.spell_components.get(Element, "Combustion")])
+        fireball.add_component(bolt)
+        assert fireball.largest_x(bolt, 25) == 23
+        bolt.customize(23)
+        assert fireball.dc == 25
+        bolt.customize(24)
+        assert fireball.dc == 26
+
+    def test_pickled_spell_keeps_dc(self):
+        fireball = Spell("Fireball")
+        fireball.add_component(Range(name="Bolt", x=20, formula="(x/5)*3"))
+        copied = pickle.loads(pickle.dumps(fireball))
+        assert copied.dc == 12
+        copied.components[0].customize(5)
+        assert copied.dc == 3
+        assert fireball.dc == 12
+
+
+class TestComponentInstance:
+    @classmethod
+    def setup_class(cls):
+        cls.spell_components = SpellComponentCollection(load_data(json_file))
+
+    def test_customizing_does_not_leak_between_spells(self):
+        fireball = Spell("Fireball")
+        frostbolt = Spell("Frostbolt")
+        fireball.add_component(self.spell_components.get(Range, "SpellRange"))
+        frostbolt.add_component(self.spell_components.get(Range, "SpellRange"))
+        fireball.components[0].customize(100)
+        assert fireball.dc == 60
+        assert frostbolt.dc == 12
+        assert self.spell_components.get_template(Range, "SpellRange").x == 20
+
+    def test_instance_reads_from_template(self):
+        spell_range = self.spell_components.get(Range, "SpellRange")
+        template = self.spell_components.get_template(Range, "SpellRange")
+        assert spell_range.template is template
+        assert spell_range.name == template.name
+        assert spell_range.units == "ft"
+        assert str(spell_range) == "SpellRange"
+        assert not hasattr(spell_range, "__dict__")
+
+    def test_templates_are_immutable(self):
+        template = self.spell_components.get_template(Range, "SpellRange")
+        with pytest.raises(FrozenInstanceError):
+            template.customize(100)
+        with pytest.raises(FrozenInstanceError):
+            template.formula = "x"
+
+    def test_instance_in_a_spell_stays_small(self):
+        spell_range = self.spell_components.get(Range, "SpellRange")
+        fireball = Spell("Fireball", [spell_range])
+        assert isinstance(spell_range._spells, tuple)
+        assert len(spell_range._spells) == 1
+        assert fireball.dc == 12
+
+    def test_customizing_a_component_in_many_spells(self):
+        spell_range = self.spell_components.get(Range, "SpellRange")
+        spells = [Spell(f"Spell {x}", [spell_range]) for x in range(10)]
+        del spells[3]
+        spell_range.customize(100)
+        assert [x.dc for x in spells] == [60] * 9
+        assert len(spell_range._watching()) == 9
+
+    def test_pickled_instance(self):
+        spell_range = self.spell_components.get(Range, "SpellRange")
+        spell_range.customize(50)
+        assert pickle.loads(pickle.dumps(spell_range)) == spell_range
+
 
 class TestSpellComponent:
     @classmethod
@@ -111,10 +283,51 @@ class TestSpellBook:  # Note: may differ from expected usage, need to revisit. I
         testing_spellbook = SpellBook("Complexity")
         testing_spellbook.load_components(self.test_data)
 
+    def test_books_share_catalog(self):
+        first, second = SpellBook("First"), SpellBook("Second")
+        first.load_components(self.test_data)
+        second.load_components(load_data(json_file))
+        assert first.components is second.components
+        bolt = first.components.get(Range, "SpellRange")
+        bolt.customize(100)
+        assert second.components.get(Range, "SpellRange").x == 20
+
+    def test_catalog_changed_in_place_not_shared(self):
+        data = load_data(json_file)
+        first, second = SpellBook("First"), SpellBook("Second")
+        first.load_components(data)
+        data["Range"][0]["formula"] = "1"
+        second.load_components(data)
+        assert first.components is not second.components
+        assert second.components.get(Range, data["Range"][0]["name"]).dc == 1
+
+    def test_reloaded_catalog_shared_under_new_data(self):
+        registry = CatalogRegistry()
+        data, changed = load_data(json_file), load_data(json_file)
+        changed["Range"][0]["formula"] = "1"
+        collection = registry.get(data)
+        collection.reload(changed)
+        assert registry.get(changed) is collection
+        original = registry.get(data)
+        assert original is not collection
+        assert original.init_data is data
+        assert len(registry) == 2
+
+    def test_memory_flat_as_books_grow(self):
+        books = []
+        tracemalloc.start()
+        for number in range(500):
+            book = SpellBook(f"Player {number}")
+            book.load_components(self.test_data)
+            books.append(book)
+        per_book = tracemalloc.get_traced_memory()[0] / len(books)
+        tracemalloc.stop()
+        assert per_book < 2048  # A catalog of its own is tens of KiB
+
     def test_adding_spell_to_spellbook(self):
         self.spellbook.add_spell(self.test_spell)
         assert self.spellbook.spells
-        assert self.spellbook.spells[0].name == "Fireball"
+        assert self.spellbook.spells["Fireball"].name == "Fireball"
 
     def test_retrieving_spell_from_spellbook(self):
         self.spellbook.add_spell(self.test_spell)
@@ -146,6 +359,26 @@ class TestSpellBook:  # Note: may differ from expected usage, need to revisit. I
         with pytest.raises(ValueError):
             self.spellbook.add_spell(self.test_spell)
 
+    def test_exception_when_retrieving_a_nonexistant_spell(self):
+        with pytest.raises(IndexError):
+            self.spellbook.get_spell("NonExistant")
+
+    def test_spell_order_is_kept(self):
+        names = ["Frostbolt", "Fireball", "Arcane Missile"]
+        for name in names:
+            self.spellbook.add_spell(Spell(name))
+        self.spellbook.remove_spell("Fireball")
+        self.spellbook.add_spell(Spell("Fireball"))
+        expected = ["Frostbolt", "Arcane Missile", "Fireball"]
+        assert self.spellbook.spell_list() == expected
+        assert [x.name for x in self.spellbook.detailed_spell_list()] == expected
+
+    def test_creating_spellbook_from_spell_list(self):
+        spellbook = SpellBook("Listed", [Spell("Fireball"), Spell("Frostbolt")])
+        assert spellbook.spell_list() == ["Fireball", "Frostbolt"]
+        with pytest.raises(ValueError):
+            SpellBook("Listed", [Spell("Fireball"), Spell("Fireball")])
+
 
 class TestCalc:
 
@@ -165,3 +398,193 @@ class TestCalc:
     @pytest.mark.parametrize("test_input,expected", test_cases)
     def test_formula(self, test_input, expected):
         assert int(Calc.evaluate(test_input)) == expected
+
+    @pytest.mark.parametrize("test_input,expected", test_cases)
+    def test_compiled_formula_matches_interpreted(self, test_input, expected):
+        assert Calc.evaluate(test_input) == Calc.interpret(test_input)
+
+    @pytest.mark.parametrize("formula", ["x", "(x/5)*3", "x/5", "12", "x**2+x"])
+    @pytest.mark.parametrize("x", [0, 1, 20, 100])
+    def test_compiled_formula_with_x(self, formula, x):
+        assert Calc.evaluate(formula, x) == Calc.interpret(formula, x)
+
+    def test_unknown_variable(self):
+        with pytest.raises(ValueError):
+            Calc.compile("y+1")
+
+    @pytest.mark.parametrize("formula", ["x%2", "x//2", "x@x"])
+    def test_unsupported_operator(self, formula):
+        with pytest.raises(ValueError, match="Unsupported operator"):
+            Calc.compile(formula)
+        with pytest.raises(ValueError, match="Unsupported operator"):
+            Calc.evaluate(formula, 3)
+
+
+class TestFormulaNormalization:
+    @pytest.mark.parametrize(
+        "formula,coefficients",
+        [
+            ("12", (12,)),
+            ("x", (0, 1)),
+            ("(x/5)*3", (0, Fraction(3, 5))),
+            ("2**3+x-x", (8,)),
+            ("(x+1)*(x-1)", (-1, 0, 1)),
+        ],
+    )
+    def test_folded_to_coefficients(self, formula, coefficients):
+        assert Calc.normalize(formula).coefficients == coefficients
+
+    @pytest.mark.parametrize("formula", ["1/x", "2**x", "x**0.5", "(x/5", ""])
+    def test_not_polynomial(self, formula):
+        assert Calc.normalize(formula) is None
+
+    def test_bad_formula_leaves_other_lookups(self):
+        data = load_data(json_file)
+        data["Shape"][0] = dict(data["Shape"][0], formula="(x/5")
+        collection = SpellComponentCollection(data)
+        assert collection.get(Range, "SpellRange").dc == 12
+
+    @pytest.mark.parametrize("formula", ["x", "(x/5)*3", "x/5", "(x+1)/3-2", "x*x"])
+    @pytest.mark.parametrize("dc", [-2, 0, 7, 25])
+    def test_solve_matches_search(self, formula, dc):
+        fitting = [x for x in range(201) if int(Calc.evaluate(formula, x)) <= dc]
+        assert Calc.solve(formula, dc, 0, 200) == (max(fitting) if fitting else None)
+
+    def test_linear_solved_without_high(self):
+        assert Calc.solve("(x/5)*3", 25) == 43
+
+    def test_non_linear_needs_high(self):
+        with pytest.raises(ValueError):
+            Calc.solve("x*x", 25)
+
+
+class TestVectorizedCalc:
+    @classmethod
+    def setup_class(cls):
+        cls.numpy = pytest.importorskip("numpy")
+        cls.spell_components = SpellComponentCollection(load_data(json_file))
+
+    @pytest.mark.parametrize("formula", ["x", "(x/5)*3", "x/5", "12", "7-x/3"])
+    def test_matches_scalar_evaluation(self, formula):
+        xs = self.numpy.arange(0, 1000)
+        expected = [int(Calc.evaluate(formula, int(x))) for x in xs]
+        assert Calc.evaluate_many(formula, xs).tolist() == expected
+
+    def test_component_dc_range(self):
+        spell_range = self.spell_components.get(Range, "SpellRange")
+        assert spell_range.dc_range([0, 20, 100]).tolist() == [0, 12, 60]
+
+    def test_collection_dc_table(self):
+        xs = self.numpy.arange(0, 50)
+        table = self.spell_components.dc_table(xs, Shape)
+        shapes = self.spell_components.get_by_type(Shape)
+        assert table.shape == (len(shapes), len(xs))
+        for row, shape in zip(table, shapes):
+            expected = [int(Calc.evaluate(shape.formula, int(x))) for x in xs]
+            assert row.tolist() == expected
+
+
+class TestEvaluationBudget:
+    @pytest.mark.parametrize(
+        "formula", ["10**10**8", "9**99", "x" * 2000, "+".join(["x"] * 300)]
+    )
+    def test_rejected_when_compiled(self, formula):
+        with pytest.raises(FormulaBudgetError):
+            FormulaCache().get(formula)
+
+    @pytest.mark.parametrize(
+        "formula,x", [("x**x", 100), ("x*x*x*x*x*x*x*x", 10**5), ("x", 10**16)]
+    )
+    def test_rejected_when_evaluated(self, formula, x):
+        compiled = FormulaCache().get(formula)
+        with pytest.raises(FormulaBudgetError):
+            compiled(x)
+
+    @pytest.mark.parametrize("formula", ["(x/5)*3", "2**3+x", "x*x-1", "(x+1)/3-2"])
+    def test_matches_interpreter(self, formula):
+        compiled = FormulaCache().get(formula)
+        assert all(compiled(x) == Calc.interpret(formula, x) for x in range(50))
+
+    @pytest.mark.parametrize("formula", ["7**7**7", "10**10**7", "x" * 2000])
+    def test_normalizing_budgeted(self, formula):
+        assert FormulaCache().normalize(formula) is None
+
+    @pytest.mark.parametrize("formula", ["'ab'*x", "'a'*99999999999", "True*x"])
+    def test_only_numeric_constants(self, formula):
+        with pytest.raises(ValueError):
+            FormulaCache().get(formula)
+
+    def test_configurable(self):
+        cache = FormulaCache()
+        assert cache.get("x**3")(10) == 1000
+        cache.set_budget(EvaluationBudget(max_exponent=2))
+        with pytest.raises(FormulaBudgetError):
+            cache.get("x**3")(10)
+
+    def test_arrays_unchecked(self):
+        numpy = pytest.importorskip("numpy")
+        xs = numpy.arange(0, 5)
+        assert (FormulaCache().get("x*x")(xs) == xs * xs).all()
+
+
+class TestFormulaCache:
+    def test_formula_compiled_once(self):
+        cache = FormulaCache()
+        compiled = cache.get("(x/5)*3")
+        assert cache.get("(x/5)*3") is compiled
+        assert cache.misses == 1
+        assert cache.hits == 1
+
+    def test_least_recently_used_evicted(self):
+        cache = FormulaCache(maxsize=2)
+        cache.get("x+1")
+        cache.get("x+2")
+        cache.get("x+1")
+        cache.get("x+3")
+        assert len(cache) == 2
+        assert "x+1" in cache.compiled
+        assert "x+2" not in cache.compiled
+
+
+class TestInstrumentation:
+    def setup_class(self):
+        self.data = load_data(json_file)
+
+    def test_counts_hot_paths_while_enabled(self):
+        metrics = Instrumentation()
+        original = SpellBook.get_spell
+        metrics.enable()
+        try:
+            book = SpellBook("Instrumented")
+            book.load_components(self.data)
+            spell = Spell("Fireball")
+            spell.add_component(book.components.get(Element, "Combustion"))
+            book.add_spell(spell)
+            book.get_spell("Fireball").components[0].dc
+        finally:
+            metrics.disable()
+        assert SpellBook.get_spell is original
+        timings = metrics.snapshot()["timings"]
+        assert timings["SpellBook.get_spell"]["calls"] == 1
+        assert timings["SpellComponentCollection.get"]["calls"] == 1
+        assert timings["ComponentInstance.dc"]["calls"] >= 1
+        assert timings["Calc.evaluate"]["calls"] >= 1
+
+    def test_nothing_counted_while_disabled(self):
+        metrics = Instrumentation()
+        metrics.enable()
+        metrics.disable()
+        SpellComponent("Test", 1, "x").dc
+        assert metrics.snapshot()["timings"] == {}
+
+    def test_formula_cache_hit_rate(self):
+        metrics = Instrumentation()
+        metrics.enable()
+        try:
+            Calc.evaluate("x*7+3", 1)
+            Calc.evaluate("x*7+3", 2)
+        finally:
+            metrics.disable()
+        cache = metrics.snapshot()["formula_cache"]
+        assert cache["hits"] >= 1
+        assert 0 < cache["hit_rate"] <= 1
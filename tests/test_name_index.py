@@ -0,0 +1,132 @@
+import random
+
+import pytest
+from kbr_char.magic import (
+    Element,
+    Spell,
+    SpellBook,
+    SpellComponentCollection,
+    load_data,
+)
+from kbr_char.name_index import NameIndex
+
+from tests.test_magic import json_file
+
+
+def prefix_distance(query, name):
+    """Least edit distance from query to any prefix of name, the slow way."""
+    previous = list(range(len(query) + 1))
+    best = previous[-1]
+    for character in name:
+        current = [previous[0] + 1]
+        for position, wanted in enumerate(query, 1):
+            current.append(
+                min(
+                    previous[position] + 1,
+                    current[position - 1] + 1,
+                    previous[position - 1] + (wanted != character),
+                )
+            )
+        previous = current
+        best = min(best, current[-1])
+    return best
+
+
+class TestNameIndex:
+    @classmethod
+    def setup_class(cls):
+        cls.index = NameIndex()
+        cls.collection = SpellComponentCollection(load_data(json_file))
+        cls.index.watch_collection(cls.collection)
+
+    def test_prefix(self):
+        matches = self.index.prefix("spellr", 2)
+        assert [x.name for x in matches] == ["SpellRange", "SpellRangeSelf"]
+        assert matches[0].entry == ("Range", "SpellRange")
+        assert matches[0].distance == 0
+
+    @pytest.mark.parametrize(
+        "query,name", [("cmbustion", "Combustion"), ("gravty", "Gravity")]
+    )
+    def test_fuzzy(self, query, name):
+        assert self.index.fuzzy(query)[0].name == name
+
+    def test_search_fills_prefix_matches_with_fuzzy(self):
+        matches = self.index.search("combus")
+        assert matches[0].name == "Combustion"
+        assert self.index.search("cmbus", 1)[0].name == "Combustion"
+
+    def test_fuzzy_matches_brute_force(self):
+        rng = random.Random(7)
+        names = sorted(
+            {
+                "".join(rng.choice("abcde") for _ in range(rng.randint(1, 8)))
+                for _ in range(400)
+            }
+        )
+        index = NameIndex()
+        index.update((x, None) for x in names)
+        for query in ["abcd", "eeab", "dcbaed", "aaaaaaa"]:
+            expected = sorted(
+                (prefix_distance(query, x), len(x), x)
+                for x in names
+                if prefix_distance(query, x) <= 1
+            )
+            found = index.fuzzy(query, 1000, max_distance=1, visits=None)
+            assert [(x.distance, len(x.name), x.name) for x in found] == expected
+
+    def test_fuzzy_with_small_limit_matches_brute_force(self):
+        rng = random.Random(16)
+        names = {
+            "".join(rng.choice("abcde") for _ in range(rng.randint(1, 8)))
+            for _ in range(3000)
+        }
+        index = NameIndex()
+        index.update((x, None) for x in names)
+        queries = ["ceaca"] + [
+            "".join(rng.choice("abcde") for _ in range(rng.randint(3, 7)))
+            for _ in range(60)
+        ]
+        for query in queries:
+            distances = ((prefix_distance(query, x), len(x), x) for x in names)
+            expected = sorted(x for x in distances if x[0] <= 2)[:5]
+            found = index.fuzzy(query, 5, max_distance=2, visits=None)
+            assert [(x.distance, len(x.name), x.name) for x in found] == expected
+
+    def test_follows_collection_and_book(self):
+        index = NameIndex()
+        collection = SpellComponentCollection(load_data(json_file))
+        book = SpellBook("Indexed", components=collection)
+        index.watch_collection(collection)
+        index.watch_book(book)
+        fireball = Spell("Fireball", [collection.get(Element, "Combustion")])
+        book.add_spell(fireball)
+        assert index.prefix("fire")[0].entry == ("Spell", "Fireball")
+        book.remove_spell("Fireball")
+        assert index.prefix("fire") == []
+        data = load_data(json_file)
+        data["Elements"].append(
+            {"name": "Frost", "x": 5, "formula": "5", "desc": "cold"}
+        )
+        data["Elements"] = [x for x in data["Elements"] if x["name"] != "Gravity"]
+        collection.reload(data)
+        assert index.prefix("frost")[0].entry == ("Elements", "Frost")
+        assert index.prefix("gravity") == []
+
+    def test_prefix_ranks_the_whole_run(self):
+        index = NameIndex()
+        index.update((f"Fa{x:03}xxxxxxxx", None) for x in range(100))
+        index.add("Fz")
+        assert [x.name for x in index.prefix("f", 3)] == [
+            "Fz",
+            "Fa000xxxxxxxx",
+            "Fa001xxxxxxxx",
+        ]
+        assert index.search("f", 3) == index.prefix("f", 3)
+        index.remove("Fz")
+        index.add("Fb")
+        assert index.prefix("f", 1)[0].name == "Fb"
+        assert [x.name for x in index.fuzzy("fq", 2, max_distance=1)] == [
+            "Fb",
+            "Fa000xxxxxxxx",
+        ]
@@ -0,0 +1,127 @@
+import asyncio
+import json
+
+from kbr_char.magic import SpellBook, SpellComponentCollection, load_data
+from kbr_char.service import DCService, _request, load_test
+
+from tests.test_batch import FIREBALL
+from tests.test_magic import json_file
+
+
+def run_with_service(test):
+    """Run test(service, request) against a service on a free localhost port."""
+
+    async def main():
+        book = SpellBook(
+            "Served", components=SpellComponentCollection(load_data(json_file))
+        )
+        service = DCService(book, port=0)
+        await service.start()
+        reader, writer = await asyncio.open_connection(service.host, service.port)
+
+        async def request(method, path, payload=None):
+            body = b"" if payload is None else json.dumps(payload).encode()
+            status, data = await _request(reader, writer, method, path, body)
+            return status, json.loads(data)
+
+        try:
+            return await test(service, request)
+        finally:
+            writer.close()
+            await service.close()
+
+    return asyncio.run(main())
+
+
+class TestDCService:
+    def test_dc_without_adding(self):
+        async def test(service, request):
+            assert await request("POST", "/dc", FIREBALL) == (
+                200,
+                {"name": "Fireball", "dc": 73},
+            )
+            assert await request("GET", "/spells") == (200, {"spells": []})
+
+        run_with_service(test)
+
+    def test_spell_lifecycle(self):
+        async def test(service, request):
+            assert (await request("POST", "/spells", FIREBALL))[0] == 201
+            assert (await request("POST", "/spells", FIREBALL))[0] == 409
+            status, spell = await request("GET", "/spells/Fireball")
+            assert status == 200
+            assert spell["dc"] == 73
+            status, _ = await request("PUT", "/spells/Fireball/components/1", {"x": 50})
+            assert status == 200
+            assert (await request("GET", "/spells/Fireball"))[1]["dc"] == 43
+            assert (await request("DELETE", "/spells/Fireball"))[0] == 200
+            assert (await request("GET", "/spells/Fireball"))[0] == 404
+
+        run_with_service(test)
+
+    def test_errors(self):
+        async def test(service, request):
+            assert (await request("GET", "/nowhere"))[0] == 404
+            assert (await request("GET", "/dc"))[0] == 405
+            broken = {"name": "Broken", "components": [{"name": "NonExistant"}]}
+            assert (await request("POST", "/dc", broken))[0] == 404
+            assert (await request("POST", "/dc", {"name": "Broken"}))[0] == 400
+
+        run_with_service(test)
+
+    def test_failing_formula_is_a_bad_request(self):
+        async def test(service, request):
+            component = {"name": "z", "formula": "1/x", "x": 0, "desc": "d"}
+            payload = {"name": "a", "components": [component]}
+            assert (await request("POST", "/dc", payload))[0] == 400
+
+            def broken(payload):
+                raise RuntimeError("Broken")
+
+            service._dc = broken
+            assert (await request("POST", "/dc", FIREBALL))[0] == 500
+
+        run_with_service(test)
+
+    def test_dc_cache_cleared_on_reload(self):
+        async def test(service, request):
+            assert (await request("POST", "/dc", FIREBALL))[1]["dc"] == 73
+            data = load_data(json_file)
+            next(x for x in data["Range"] if x["name"] == "SpellRange")["formula"] = "x"
+            service.book.components.reload(data)
+            await asyncio.sleep(0)
+            assert (await request("POST", "/dc", FIREBALL))[1]["dc"] == 113
+
+        run_with_service(test)
+
+    def test_reads_cached_until_changed(self):
+        async def test(service, request):
+            await request("POST", "/spells", FIREBALL)
+            await request("GET", "/spells/Fireball")
+            await request("GET", "/spells/Fireball")
+            assert service.cache_hits == 1
+            await request("PUT", "/spells/Fireball/components/1", {"x": 0})
+            assert (await request("GET", "/spells/Fireball"))[1]["dc"] == 13
+
+        run_with_service(test)
+
+    def test_concurrent_identical_requests_coalesced(self):
+        async def test(service, request):
+            body = json.dumps(FIREBALL).encode()
+            results = await asyncio.gather(
+                *(service.respond("POST", "/dc", body) for _ in range(20))
+            )
+            assert {x for x in results} == {(200, b'{"name": "Fireball", "dc": 73}')}
+            assert service.evaluations == 1
+            assert service.coalesced == 19
+
+        run_with_service(test)
+
+    def test_load_test(self):
+        async def test(service, request):
+            requests = [("POST", "/dc", json.dumps(FIREBALL).encode())]
+            report = await load_test(service.host, service.port, requests, 200, 10)
+            assert report["requests"] == 200
+            assert report["statuses"] == {200: 200}
+
+        run_with_service(test)
@@ -0,0 +1,72 @@
+import itertools
+
+from kbr_char.magic import (
+    Calc,
+    Element,
+    Modifier,
+    Range,
+    Shape,
+    SpellComponentCollection,
+    load_data,
+)
+from kbr_char.spell_search import (
+    component_options,
+    iter_spells,
+    search_spells,
+)
+
+from tests.test_magic import json_file
+
+
+class TestSpellSearch:
+    @classmethod
+    def setup_class(cls):
+        cls.spell_components = SpellComponentCollection(load_data(json_file))
+
+    def brute_force(self, max_dc, max_modifiers):
+        found = set()
+        required = [
+            self.spell_components.get_by_type(x) for x in [Element, Range, Shape]
+        ]
+        modifiers = self.spell_components.get_by_type(Modifier)
+        for components in itertools.product(*required):
+            for count in range(max_modifiers + 1):
+                for extra in itertools.combinations(modifiers, count):
+                    chosen = components + extra
+                    dc = sum(x.dc for x in chosen)
+                    if dc <= max_dc:
+                        found.add((dc, tuple(sorted(x.name for x in chosen))))
+        return found
+
+    def test_matches_brute_force(self):
+        found = {
+            (x.dc, tuple(sorted(y[1] for y in x.components)))
+            for x in iter_spells(self.spell_components, 20, max_modifiers=2)
+        }
+        assert found == self.brute_force(20, 2)
+
+    def test_ranked_search(self):
+        everything = search_spells(self.spell_components, 22)
+        assert [x.dc for x in everything] == sorted(
+            (x.dc for x in everything), reverse=True
+        )
+        top = search_spells(self.spell_components, 22, limit=5)
+        assert top == everything[:5]
+        assert search_spells(self.spell_components, 22, limit=5, workers=2) == top
+
+    def test_nothing_under_budget(self):
+        assert search_spells(self.spell_components, 2) == []
+
+    def test_x_range_options(self):
+        options = component_options(self.spell_components, "Range", 12, (0, 1000))
+        spell_ranges = [x for x in options if x[2] == "SpellRange"]
+        assert [x[0] for x in spell_ranges] == list(range(13))
+        for dc, _, _, x in spell_ranges:
+            assert int(Calc.evaluate("(x/5)*3", x)) == dc
+            assert int(Calc.evaluate("(x/5)*3", x + 1)) > dc
+
+    def test_x_range_search(self):
+        found = search_spells(self.spell_components, 20, limit=20, x_range=(0, 200))
+        for candidate in found:
+            spell = candidate.to_spell(self.spell_components, "Candidate")
+            assert spell.dc == candidate.dc <= 20
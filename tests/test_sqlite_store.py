@@ -0,0 +1,126 @@
+import pytest
+from kbr_char.magic import (
+    Element,
+    Range,
+    Shape,
+    Spell,
+    SpellComponent,
+    SpellComponentCollection,
+    load_data,
+)
+from kbr_char.sqlite_store import SQLiteCatalog, SQLiteSpellBook, connect
+
+from tests.test_magic import json_file
+
+
+class TestSQLiteCatalog:
+    @classmethod
+    def setup_class(cls):
+        cls.test_data = load_data(json_file)
+        cls.catalog = SQLiteCatalog(connect(":memory:"))
+        cls.catalog.store(cls.test_data)
+
+    def test_records_match_json(self):
+        for category, records in self.test_data.items():
+            assert list(self.catalog.records(category)) == [
+                {"units": None, **x} for x in records
+            ]
+
+    def test_collection_matches_json(self):
+        eager = SpellComponentCollection(self.test_data)
+        stored = SpellComponentCollection(source=self.catalog)
+        for component in eager.components:
+            found = stored.get(type(component), component.name.lower())
+            assert found.template == component
+            assert found.dc == component.dc
+        with pytest.raises(IndexError):
+            stored.get(Element, "NonExistant")
+
+
+class TestSQLiteSpellBook:
+    @classmethod
+    def setup_class(cls):
+        cls.spell_components = SpellComponentCollection(load_data(json_file))
+
+    def setup_method(self):
+        self.spellbook = SQLiteSpellBook("Exodius", components=self.spell_components)
+
+    def teardown_method(self):
+        self.spellbook.close()
+
+    def make_spell(self, name, element="Combustion", spell_range=20):
+        spell = Spell(name)
+        spell.add_component(self.spell_components.get(Element, element))
+        spell.add_component(self.spell_components.get(Range, "SpellRange"))
+        spell.add_component(self.spell_components.get(Shape, "Arrow"))
+        spell.components[1].customize(spell_range)
+        return spell
+
+    def test_spellbook_surface(self):
+        self.spellbook.add_spell(self.make_spell("Fireball"))
+        self.spellbook.add_spell(self.make_spell("Frostbolt", "Ice"))
+        self.spellbook.add_spell(Spell("Bolt", [SpellComponent("Bolt", 5, "x+4")]))
+        assert self.spellbook.spell_list() == ["Fireball", "Frostbolt", "Bolt"]
+        fireball = self.spellbook.get_spell("Fireball")
+        assert fireball == self.make_spell("Fireball")
+        assert fireball.dc == 25
+        assert self.spellbook.get_spell("Bolt").dc == 9
+        assert [x.dc for x in self.spellbook.detailed_spell_list()] == [25, 26, 9]
+        with pytest.raises(ValueError):
+            self.spellbook.add_spell(self.make_spell("Fireball"))
+        self.spellbook.remove_spell("Frostbolt")
+        self.spellbook.remove_spell("NonExistant")
+        assert self.spellbook.spell_list() == ["Fireball", "Bolt"]
+        with pytest.raises(IndexError):
+            self.spellbook.get_spell("Frostbolt")
+
+    def test_books_share_a_database(self):
+        self.spellbook.add_spell(self.make_spell("Fireball"))
+        other = SQLiteSpellBook("Other")
+        other.connection = self.spellbook.connection
+        other.add_spell(self.make_spell("Fireball"))
+        assert self.spellbook.spell_list() == ["Fireball"]
+        assert other.spell_list() == ["Fireball"]
+
+    def test_find_spells(self):
+        self.spellbook.add_spells(
+            (
+                self.make_spell(f"Spell {x}", ["Combustion", "Ice"][x % 2], x * 5)
+                for x in range(20)
+            ),
+            batch_size=7,
+        )
+        expected = [
+            spell.name
+            for spell in self.spellbook.detailed_spell_list()
+            if 20 <= spell.dc <= 30 and spell.components[0].name == "Combustion"
+        ]
+        assert expected
+        assert self.spellbook.find_spells(20, 30, "combustion") == expected
+        assert self.spellbook.find_spells(20, 30, "Combustion", Element) == expected
+        assert (
+            self.spellbook.find_spells(component="Combustion", component_type=Range)
+            == []
+        )
+        assert len(self.spellbook.find_spells(max_dc=1000)) == 20
+
+    def test_customize_updates_stored_dc(self):
+        self.spellbook.add_spell(self.make_spell("Fireball"))
+        fireball = self.spellbook.get_spell("Fireball")
+        fireball.components[1].customize(100)
+        assert self.spellbook.get_spell("Fireball").dc == 73
+        assert self.spellbook.find_spells(min_dc=73) == ["Fireball"]
+
+    def test_reload_updates_stored_dc(self):
+        collection = SpellComponentCollection(load_data(json_file))
+        book = SQLiteSpellBook("Reloaded", components=collection)
+        book.add_spell(Spell("F", [collection.get(Range, "SpellRange")]))
+        book.add_spell(Spell("G", [collection.get(Element, "Combustion")]))
+        data = load_data(json_file)
+        next(x for x in data["Range"] if x["name"] == "SpellRange")["formula"] = "x"
+        collection.reload(data)
+        assert book.get_spell("F").dc == 20
+        assert book.find_spells(20, 20) == ["F"]
+        assert book.find_spells(12, 12, "SpellRange") == []
+        book.close()
+        assert book not in collection.listeners
@@ -0,0 +1,121 @@
+import json
+import os
+import tempfile
+
+import pytest
+from click.testing import CliRunner
+from kbr_char import cli, validate
+from kbr_char.magic import EvaluationBudget, formula_cache, load_data
+from kbr_char.validate import FormulaIssue, check_formula, validate_file
+
+from tests.test_magic import json_file
+
+BROKEN = {
+    "Elements": [{"name": "Typo", "x": 1, "formula": "(x/5"}],
+    "Range": [
+        {"name": "Stray", "x": 1, "formula": "x+y"},
+        {"name": "Shifted", "x": 1, "formula": "x<<2"},
+    ],
+    "Shape": [{"name": "Negative", "x": 1, "formula": "x-50"}],
+    "Modifiers": [{"name": "Good", "x": 1, "formula": "(x/5)*3"}],
+}
+
+
+class TestCheckFormula:
+    @pytest.mark.parametrize("formula", ["x", "(x/5)*3", "12", "2**3+x", "x*x-x"])
+    def test_valid(self, formula):
+        assert check_formula(formula, range(101)) is None
+
+    @pytest.mark.parametrize(
+        "formula,problem",
+        [
+            ("(x/5", "Can't parse"),
+            ("x+y", "Unknown variable"),
+            ("x<<2", "Unsupported syntax: LShift"),
+            ("-x", "Unsupported syntax: UnaryOp"),
+            ("abs(x)", "Unsupported syntax: Call"),
+            ("'x'", "Unsupported constant"),
+            ("x; x", "Can't parse"),
+            ("10/x", "Fails at x=0"),
+            ("x-50", "Negative at x=0"),
+            ("x**x", "Fails at x=16"),
+            ("10**10**8", "Exponent over"),
+            (12, "not text"),
+        ],
+    )
+    def test_invalid(self, formula, problem):
+        assert problem in check_formula(formula, range(101))
+
+
+class TestValidateFile:
+    def setup_method(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = os.path.join(self.directory.name, "cache", "validation.json")
+        self.catalog = os.path.join(self.directory.name, "broken.json")
+        with open(self.catalog, "w") as file_object:
+            json.dump(BROKEN, file_object)
+
+    def teardown_method(self):
+        self.directory.cleanup()
+
+    def test_issues_in_catalog_order(self):
+        issues = validate_file(self.catalog, workers=1, cache_path=self.cache)
+        assert [(x.category, x.name) for x in issues] == [
+            ("Elements", "Typo"),
+            ("Range", "Stray"),
+            ("Range", "Shifted"),
+            ("Shape", "Negative"),
+        ]
+
+    def test_unchanged_catalog_cached(self, monkeypatch):
+        issues = validate_file(self.catalog, workers=1, cache_path=self.cache)
+
+        def fail(*args, **kwargs):
+            raise AssertionError("validated again")
+
+        monkeypatch.setattr(validate, "validate_source", fail)
+        assert validate_file(self.catalog, cache_path=self.cache) == issues
+        with open(self.catalog, "a") as file_object:
+            file_object.write("\n")  # Same catalog, different content
+        with pytest.raises(AssertionError):
+            validate_file(self.catalog, cache_path=self.cache)
+
+    def test_cached_per_budget(self):
+        validate_file(self.catalog, workers=1, cache_path=self.cache)
+        budget = formula_cache.budget
+        formula_cache.set_budget(EvaluationBudget(max_length=3))
+        try:
+            issues = validate_file(self.catalog, workers=1, cache_path=self.cache)
+        finally:
+            formula_cache.set_budget(budget)
+        assert any("characters" in x.problem for x in issues)
+
+    def test_pool_matches_one_worker(self):
+        data = load_data(json_file)
+        data["Range"] = data["Range"] + [
+            {"name": f"Range{n}", "x": n, "formula": f"(x-{n})*{n}"} for n in range(100)
+        ]
+        with open(self.catalog, "w") as file_object:
+            json.dump(data, file_object)
+        single = validate.validate_source(
+            validate.open_catalog(self.catalog), workers=1
+        )
+        pooled = validate.validate_source(
+            validate.open_catalog(self.catalog), workers=2
+        )
+        assert pooled == single
+        assert len(single) == 99  # All but (x-0)*0 go negative below their x
+        assert single[0] == FormulaIssue(
+            "Range", "Range1", "(x-1)*1", "Negative at x=0: -1"
+        )
+
+    def test_builtin_catalog_valid(self):
+        assert validate_file(json_file, cache_path=self.cache) == []
+
+    def test_command(self):
+        runner = CliRunner(env={"XDG_CACHE_HOME": self.directory.name})
+        result = runner.invoke(cli.main, ["validate", self.catalog])
+        assert result.exit_code == 1
+        assert "Shape Negative: 'x-50': Negative at x=0: -50" in result.output
+        result = runner.invoke(cli.main, ["validate", json_file, "--no-cache"])
+        assert result.exit_code == 0
@@ -0,0 +1,167 @@
+import random
+import tracemalloc
+
+import pytest
+from benchmarks.generate import generate_spells
+from kbr_char.magic import SpellBookListener, SpellComponentCollection, load_data
+from kbr_char.versioned_book import PersistentSpells, VersionedSpellBook
+
+from tests.test_magic import json_file
+
+
+class Recorder(SpellBookListener):
+    def __init__(self):
+        self.events = []
+
+    def spell_added(self, book, spell):
+        self.events.append(("added", spell.name))
+
+    def spell_removed(self, book, spell):
+        self.events.append(("removed", spell.name))
+
+
+class TestPersistentSpells:
+    def test_matches_dict(self):
+        rng = random.Random(24)
+        mapping = PersistentSpells()
+        expected = {}
+        for _ in range(2000):
+            key = f"Spell{rng.randrange(300)}"
+            if rng.random() < 0.3:
+                mapping = mapping.delete(key)
+                expected.pop(key, None)
+            else:
+                value = object()
+                mapping = mapping.set(key, value)
+                expected[key] = value
+        assert list(mapping) == list(expected)
+        assert len(mapping) == len(expected)
+        assert all(mapping[x] is expected[x] for x in expected)
+
+    def test_edits_leave_original(self):
+        first = PersistentSpells().set("A", 1).set("B", 2)
+        second = first.set("C", 3).delete("A")
+        assert dict(first) == {"A": 1, "B": 2}
+        assert dict(second) == {"B": 2, "C": 3}
+
+    def test_diff(self):
+        first = PersistentSpells()
+        for number in range(100):
+            first = first.set(f"Spell{number:03d}", object())
+        second = first.set("Spell010", object()).delete("Spell050").set("New", 1)
+        diff = first.diff(second)
+        assert (diff.added, diff.changed, diff.removed) == (
+            ["New"],
+            ["Spell010"],
+            ["Spell050"],
+        )
+        assert not first.diff(first)
+
+
+class TestVersionedSpellBook:
+    @classmethod
+    def setup_class(cls):
+        cls.collection = SpellComponentCollection(load_data(json_file))
+        cls.spells = generate_spells(cls.collection, 50, seed=24)
+
+    def test_undo_redo(self):
+        book = VersionedSpellBook("Versions", self.spells[:10])
+        name = self.spells[0].name
+        dc = book.get_spell(name).dc
+        x = book.get_spell(name).components[1].x
+        book.customize(name, 1, x + 40)
+        book.remove_spell(self.spells[1].name)
+        assert book.get_spell(name).dc != dc
+        assert book.undo().change.startswith("Customize")
+        assert self.spells[1].name in book.spell_list()
+        book.undo()
+        assert book.get_spell(name).dc == dc
+        assert book.get_spell(name).components[1].x == x
+        assert book.undo() is None
+        book.redo()
+        book.redo()
+        assert self.spells[1].name not in book.spell_list()
+        assert book.redo() is None
+
+    def test_spells_listed_in_insertion_order(self):
+        spells = sorted(self.spells[:10], key=lambda x: x.name, reverse=True)
+        book = VersionedSpellBook("Ordered", spells[:5])
+        for spell in spells[5:]:
+            book.add_spell(spell)
+        names = [x.name for x in spells]
+        assert book.spell_list() == names
+        book.customize(names[3], 1, 7)
+        book.remove_spell(names[0])
+        assert book.spell_list() == names[1:]
+        assert [x.name for x in book.detailed_spell_list()] == names[1:]
+        book.undo()
+        assert book.spell_list() == names
+
+    def test_edit_after_undo_drops_redo(self):
+        book = VersionedSpellBook("Branch", self.spells[:3])
+        book.remove_spell(self.spells[0].name)
+        book.undo()
+        book.remove_spell(self.spells[1].name)
+        assert book.redo() is None
+        assert [x.change for x in book.history] == [
+            "Created",
+            f"Remove {self.spells[1].name}",
+        ]
+
+    def test_diff_and_listeners(self):
+        book = VersionedSpellBook("Diff", self.spells[:5])
+        recorder = Recorder()
+        book.listeners.append(recorder)
+        start = book.version
+        book.add_spell(self.spells[5])
+        book.customize(self.spells[0].name, 1, 3)
+        diff = book.diff(start)
+        assert diff.added == [self.spells[5].name]
+        assert diff.changed == [self.spells[0].name]
+        recorder.events.clear()
+        book.checkout(0)
+        assert sorted(recorder.events) == [
+            ("added", self.spells[0].name),
+            ("removed", self.spells[0].name),
+            ("removed", self.spells[5].name),
+        ]
+
+    def test_versions_share_unchanged_spells(self):
+        book = VersionedSpellBook("Shared", self.spells)
+        book.customize(self.spells[0].name, 1, 7)
+        old, new = book.history[0].spells, book.version.spells
+        assert old[self.spells[0].name] is not new[self.spells[0].name]
+        assert all(old[x.name] is new[x.name] for x in self.spells[1:])
+        customized = new[self.spells[0].name].components
+        assert customized[0] is self.spells[0].components[0]
+
+    @pytest.mark.parametrize("count", [500, 4000])
+    def test_memory_per_edit_independent_of_size(self, count):
+        spells = generate_spells(self.collection, count, seed=24)
+        book = VersionedSpellBook("Memory", spells)
+        rng = random.Random(24)
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for _ in range(200):
+            book.customize(rng.choice(spells).name, 1, rng.randrange(100))
+        per_edit = (tracemalloc.get_traced_memory()[0] - before) / 200
+        tracemalloc.stop()
+        # A copy of the book per edit would take over 36 bytes a spell for the
+        # dict alone, a path through the tree is a few dozen nodes.
+        assert per_edit < 6000
+
+    def test_customizing_in_place_raises(self):
+        book = VersionedSpellBook("InPlace", self.spells[:3])
+        name = self.spells[0].name
+        spell = book.get_spell(name)
+        x, dc = spell.components[1].x, spell.dc
+        with pytest.raises(ValueError):
+            spell.components[1].customize(x + 40)
+        assert spell.components[1].x == x
+        assert book.get_spell(name).dc == dc
+        assert len(book.history) == 1
+        book.customize(name, 1, x + 40)
+        with pytest.raises(ValueError):
+            book.history[0].spells[name].components[0].customize(3)
+        book.undo()
+        assert book.get_spell(name).dc == dc